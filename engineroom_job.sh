@@ -172,6 +172,7 @@ Arguments:
 
 Options:
   -a PAGERANK_ALPHA   Damping factor (alpha) for the PageRank [default: 0.85].
+  -C                  Keep the LoopRank cycles when streaming them (-S).
   -d                  Enable debug output.
   -D DATE             Date [default: infer from input graph].
   -f SCORING_FUNCTION LoopRank scoring function {linear,square,cube,nlogn,expe,exp10} [default: linear].
@@ -181,6 +182,9 @@ Options:
   -n                  Dry run, do not really launch the jobs.
   -p PROJECT          Project name [default: infer from input graph].
   -P PYTHON_VERSION   Python version [default: 3.6].
+  -S                  Stream the LoopRank cycles from pageloop_back_map_noscore
+                      straight into compute_scores.py, without writing them
+                      to a temporary file (use -C to keep them anyway).
   -t TIMEOUT          Timeout (in seconds) for executing the LoopRank and
                       SSPPR commands.
   -v                  Enable verbose output.
@@ -211,6 +215,8 @@ help_flag=false
 dryrun_flag=false
 keeptmp_flag=false
 notitle_flag=false
+stream_flag=false
+keepcycles_flag=false
 
 VENV_PATH="$PWD/looprank3"
 PYTHON_VERSION='3.6'
@@ -233,13 +239,16 @@ declare -a SCORING_FUNCTION_CHOICES=( 'linear'
                                       'exp10'
                                      )
 
-while getopts ":a:dD:f:hi:I:k:Kl:no:p:P:s:t:T:vV:wX" opt; do
+while getopts ":a:CdD:f:hi:I:k:Kl:no:p:P:s:St:T:vV:wX" opt; do
   case $opt in
     a)
       check_posfloat "$OPTARG" '-a'
 
       PAGERANK_ALPHA="$OPTARG"
       ;;
+    C)
+      keepcycles_flag=true
+      ;;
     d)
       debug_flag=true
       ;;
@@ -305,6 +314,9 @@ while getopts ":a:dD:f:hi:I:k:Kl:no:p:P:s:t:T:vV:wX" opt; do
 
       SNAPSHOT="$OPTARG"
       ;;
+    S)
+      stream_flag=true
+      ;;
     t)
       check_posint "$OPTARG" '-t'
 
@@ -563,6 +575,7 @@ echodebug
 
 echodebug "Options:"
 echodebug "  * PAGERANK_ALPHA (-a): $PAGERANK_ALPHA"
+echodebug "  * keepcycles_flag (-C): $keepcycles_flag"
 echodebug "  * debug_flag (-d): $debug_flag"
 echodebug "  * DATE (-D): $DATE"
 echodebug "  * MAXLOOP (-k): $MAXLOOP"
@@ -570,6 +583,7 @@ echodebug "  * keeptmp_flag (-K): $keeptmp_flag"
 echodebug "  * PROJECT (-p): $PROJECT"
 echodebug "  * PYTHON_VERSION (-P): $PYTHON_VERSION"
 echodebug "  * dryrun_flag (-n): $dryrun_flag"
+echodebug "  * stream_flag (-S): $stream_flag"
 echodebug "  * verbose_flag (-v): $verbose_flag"
 echodebug "  * VENV_PATH (-V): $VENV_PATH"
 echodebug "  * wholenetwork (-w): $wholenetwork"
@@ -631,10 +645,43 @@ else
   logfileLR="${OUTPUTDIR}/${PROJECT}.looprank.${NORMTITLE}.${MAXLOOP}.${DATE}.log"
 fi
 
+if $notitle_flag; then
+  scorefileLR="${PROJECT}.looprank.f${SCORING_FUNCTION}.${INDEX}.${MAXLOOP}.${DATE}.scores.txt"
+else
+  scorefileLR="${PROJECT}.looprank.f${SCORING_FUNCTION}.${NORMTITLE}.${MAXLOOP}.${DATE}.scores.txt"
+fi
+
+echodebug "encoding: $(python3 -c 'import locale; print(locale.getpreferredencoding(False))')"
+
+# With -S the cycles are written to a named pipe and scored while they are
+# enumerated, the raw cycles are saved only with -C.
+cyclesoutputLR="${tmpoutdir}/${outfileLR}"
+if $stream_flag; then
+  cyclesoutputLR="${scratch}/cycles.fifo"
+  mkfifo "${cyclesoutputLR}"
+
+  if $keepcycles_flag; then
+    tee "${tmpoutdir}/${outfileLR}" < "${cyclesoutputLR}" | \
+      wrap_run python3 "${SCRIPTDIR}/utils/compute_scores.py" \
+        -f "${SCORING_FUNCTION}" \
+        --order score \
+        -o "${tmpoutdir}/${scorefileLR}" \
+          - &
+  else
+    wrap_run python3 "${SCRIPTDIR}/utils/compute_scores.py" \
+      -f "${SCORING_FUNCTION}" \
+      --order score \
+      -o "${tmpoutdir}/${scorefileLR}" \
+        - < "${cyclesoutputLR}" &
+  fi
+  scorer_pid="$!"
+  echodebug "scorer_pid: $scorer_pid"
+fi
+
 commandLR=("wrap_run" \
            "$SCRIPTDIR/pageloop_back_map_noscore" \
            "-f" "${INPUT_GRAPH}" \
-           "-o" "${tmpoutdir}/${outfileLR}" \
+           "-o" "${cyclesoutputLR}" \
            "-s" "${INDEX}" \
            "-k" "${MAXLOOP}" \
            ${verbosity_flag:+"$verbosity_flag"}
@@ -673,24 +720,28 @@ else
   echodebug "No timeout"
   log_cmd "${logfileLR}" "${commandLR[@]}"
 fi
-touch "${tmpoutdir}/${outfileLR}"
 
 # Compute LoopRank scores
-if $notitle_flag; then
-  scorefileLR="${PROJECT}.looprank.f${SCORING_FUNCTION}.${INDEX}.${MAXLOOP}.${DATE}.scores.txt"
+if $stream_flag; then
+  # opening the pipe read-write never blocks: if pageloop_back_map_noscore
+  # never opened it (e.g. it failed), this gives the scorer its end-of-file.
+  while kill -0 "$scorer_pid" 2>/dev/null; do
+    exec 3<>"${cyclesoutputLR}"
+    exec 3>&-
+    sleep 1
+  done
+  wait "$scorer_pid"
+  unset scorer_pid
 else
-  scorefileLR="${PROJECT}.looprank.f${SCORING_FUNCTION}.${NORMTITLE}.${MAXLOOP}.${DATE}.scores.txt"
+  touch "${tmpoutdir}/${outfileLR}"
+  inputfileLR="${tmpoutdir}/${outfileLR}"
+
+  wrap_run python3 "${SCRIPTDIR}/utils/compute_scores.py" \
+    -f "${SCORING_FUNCTION}" \
+    --order score \
+    -o "${tmpoutdir}/${scorefileLR}" \
+      "${inputfileLR}"
 fi
-inputfileLR="${tmpoutdir}/${outfileLR}"
-
-touch "${inputfileLR}"
-
-echodebug "encoding: $(python3 -c 'import locale; print(locale.getpreferredencoding(False))')"
-
-wrap_run python3 "${SCRIPTDIR}/utils/compute_scores.py" \
-  -f "${SCORING_FUNCTION}" \
-  -o "${tmpoutdir}/${scorefileLR}" \
-    "${inputfileLR}"
 
 
 ##### Single-source Personalized PageRank
@@ -817,10 +868,6 @@ else
 fi
 touch "${OUTPUTDIR}/${comparefileSSPPR}"
 
-touch "${tmpoutdir}/${scorefileLR}.sorted"
-LC_ALL=C sort -k2 -r -g "${tmpoutdir}/${scorefileLR}" \
-  > "${tmpoutdir}/${scorefileLR}.sorted"
-
 maxrowSSPPR="$(LC_ALL=C \
   awk 'BEGIN{a=0}{if ($1>0+a) a=$1} END{print a}' \
     "${OUTPUTDIR}/${comparefileSSPPR}"
@@ -831,8 +878,11 @@ touch "${tmpoutdir}/${outfileSSPPR}.sorted"
 LC_ALL=C sort -t$'\t' -k2 -r -n "${tmpoutdir}/${outfileSSPPR}" \
   > "${tmpoutdir}/${outfileSSPPR}.sorted"
 
-wrap_run cp "${tmpoutdir}/${outfileLR}" "${OUTPUTDIR}/${outfileLR}"
-wrap_run cp "${tmpoutdir}/${scorefileLR}.sorted" "${OUTPUTDIR}/${scorefileLR}"
+if ! $stream_flag || $keepcycles_flag; then
+  wrap_run cp "${tmpoutdir}/${outfileLR}" "${OUTPUTDIR}/${outfileLR}"
+fi
+# LoopRank scores are already sorted by descending score (--order score)
+wrap_run cp "${tmpoutdir}/${scorefileLR}" "${OUTPUTDIR}/${scorefileLR}"
 
 HEAD_OFFSET=10000
 wrap_run safe_head "$((maxrowSSPPR+HEAD_OFFSET))" "${tmpoutdir}/${outfileSSPPR}.sorted" \
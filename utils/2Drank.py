@@ -8,18 +8,11 @@ import math
 import argparse
 import pathlib
 import itertools
+import multiprocessing
 
-# Score regex
-#
-#  score(<pageid>):<spaces><score>
-#
-# where:
-#   - <pageid> is an integer number
-#   - <score> is a real number that can be written using the scientific
-#     notation
-REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
-regex_score = re.compile(REGEX_SCORE)
+import numpy as np
 
+from scorefile import read_scores, write_binary_scores
 
 # Name regex
 #
@@ -35,57 +28,200 @@ regex_score = re.compile(REGEX_SCORE)
 REGEX_NAME = r'([a-z]{2}wiki)\.cheir\.(.+)\.(.+)\.(\d{4}-\d{2}-\d{2})\.(csv|txt)'
 regex_name = re.compile(REGEX_NAME)
 
+# alpha prefix of the title in the name, e.g. a0.85.<title>
+REGEX_ALPHA = r'a([0-9]+\.[0-9]+)\.'
+regex_alpha = re.compile(REGEX_ALPHA)
+
 
 # output templates
 OUTLINE_SCORE = 'score({pageid}):\t{score}\n'
 OUTLINE_NOSCORE = '{pageid}\n'
 
 
-def process_line(line):
-    match = regex_score.match(line)
+def load_scores(infile):
+    """
+    Read a score file into an array of unique page ids (sorted) and the
+    array of their scores. If a page appears more than once its last score
+    is kept.
+    """
+    pageids, scores = read_scores(infile)
+
+    # keep the last occurrence of each page
+    pageids, idx = np.unique(pageids[::-1], return_index=True)
+    scores = scores[::-1][idx]
+
+    return pageids, scores
+
+
+def rank(scores):
+    """
+    Dense rank of scores in descending order. Scores greater than or equal
+    to 1.0 are ranked 0, the highest score below 1.0 is ranked 1.
+    """
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+
+    newpos = sorted_scores < 1.0
+    newpos[1:] &= sorted_scores[1:] < sorted_scores[:-1]
+
+    pos = np.empty(scores.size, dtype=np.int64)
+    pos[order] = np.cumsum(newpos)
+
+    return pos
+
+
+def rank2d(pageids, cheirpos, sspprpos):
+    """
+    Sort pages by the worst of their two positions, then by the sum of the
+    two positions, then by page id, and return the sorted page ids with
+    their 2D rank (equal positions get the same rank, starting from 1).
+    """
+    lowpos = np.maximum(cheirpos, sspprpos)
+    sumpos = cheirpos + sspprpos
+
+    order = np.lexsort((pageids, sumpos, lowpos))
+    lowpos = lowpos[order]
+    sumpos = sumpos[order]
+
+    newpos = np.ones(order.size, dtype=bool)
+    newpos[1:] = (lowpos[1:] != lowpos[:-1]) | (sumpos[1:] != sumpos[:-1])
+
+    return pageids[order], np.cumsum(newpos)
+
+
+def output_filename(cheir_file, binary=False):
+    """
+    Derive the name of the 2Drank output file from the CheiRank file name,
+    binary files have extension .bin instead of .txt.
+    """
+    cheir_filename = os.path.basename(cheir_file.as_posix())
+    match = regex_name.match(cheir_filename)
+    if match is None:
+        raise ValueError('could not parse CheiRank file name: {}'
+                         .format(cheir_filename))
+
+    proj = match.group(1)
+    title = match.group(2)
+    maxloop = match.group(3)
+    date = match.group(4)
+
+    # {proj}.2Drank.{title}.{maxloop}.{date}.txt
+    return ('{0}.2Drank.{1}.{2}.{3}.{4}'
+            .format(proj, title, maxloop, date, 'bin' if binary else 'txt')
+            )
+
+
+def header_fields(cheir_file):
+    """
+    Get alpha and maxloop from the CheiRank file name for the header of a
+    binary output file, they are None if not found.
+    """
+    alpha = None
+    K = None
 
-    title = None
-    score = None
+    match = regex_name.match(os.path.basename(cheir_file.as_posix()))
     if match:
-        pageid = int(match.group(1))
-        score = float(match.group(2))
-    else:
-        print('Error: could not process line: {}'.format(line),
-              file=sys.stderr)
+        match_alpha = regex_alpha.match(match.group(2))
+        if match_alpha:
+            alpha = float(match_alpha.group(1))
+        if match.group(3).isdigit():
+            K = int(match.group(3))
+
+    return alpha, K
 
-    # if match fails this is (None, None)
-    return pageid, score
 
+def compute_2drank(cheir_file, ssppr_file, output_file, no_score=False,
+                   binary=False):
+    cheir_ids, cheir_scores = load_scores(cheir_file)
+    ssppr_ids, ssppr_scores = load_scores(ssppr_file)
 
-def sort2d(x):
-    pageid = x[0]
-    positions = x[1]
+    cheir_pos = rank(cheir_scores)
+    del cheir_scores
 
-    cheirpos = positions[0]
-    sspprpos = positions[1]
+    ssppr_pos = rank(ssppr_scores)
+    del ssppr_scores
 
-    lowpos = -max(cheirpos, sspprpos)
-    sumpos = -(cheirpos+sspprpos)
+    ids, cheir_idx, ssppr_idx = np.intersect1d(cheir_ids, ssppr_ids,
+                                               assume_unique=True,
+                                               return_indices=True)
 
-    return (lowpos, sumpos, -pageid)
+    pageids, positions = rank2d(ids,
+                                cheir_pos[cheir_idx],
+                                ssppr_pos[ssppr_idx])
+    del cheir_ids, cheir_pos, ssppr_ids, ssppr_pos
 
+    if binary:
+        alpha, K = header_fields(cheir_file)
+        write_binary_scores(output_file, pageids, 1.0/positions,
+                            algorithm='2Drank', alpha=alpha, K=K)
+        return
+
+    with output_file.open('w+') as outfp:
+        for pageid, pos in zip(pageids.tolist(), positions.tolist()):
+            if no_score:
+                outfp.write(OUTLINE_NOSCORE.format(pageid=pageid))
+            else:
+                outfp.write(OUTLINE_SCORE.format(pageid=pageid,
+                                                 score=1.0/pos))
+
+
+def compute_2drank_safe(task):
+    try:
+        compute_2drank(*task)
+        return task, None
+    except (OSError, ValueError) as err:
+        return task, str(err)
+
+
+def read_manifest(manifest_file, output_dir):
+    """
+    Read the list of (cheirank, ssppr, output) files from a TSV manifest,
+    one title per line. The output file is optional, if it is missing it
+    is derived from the CheiRank file name. Relative output paths are
+    resolved in output_dir.
+    """
+    if manifest_file.as_posix() == '-':
+        infp = sys.stdin
+    else:
+        infp = manifest_file.open('r', encoding='UTF-8')
+
+    triples = []
+    with infp:
+        reader = csv.reader(infp, delimiter='\t')
+        for lineno, row in enumerate(reader, start=1):
+            if not row or not ''.join(row).strip():
+                continue
+            if len(row) not in (2, 3):
+                raise ValueError('{}:{}: expected 2 or 3 columns, got {}'
+                                 .format(manifest_file, lineno, len(row)))
+
+            cheir_file = pathlib.Path(row[0])
+            ssppr_file = pathlib.Path(row[1])
+            if len(row) == 3 and row[2]:
+                output_file = output_dir/row[2]
+            else:
+                output_file = None
 
-def rank(algoscores):
-    res = {}
-    pos = 0
-    score = 1.0
-    for k in sorted(algoscores, key=algoscores.get, reverse=True):
-        elscore = algoscores[k]
+            triples.append((cheir_file, ssppr_file, output_file))
 
-        if elscore < score:
-            pos = pos + 1
-            score = elscore
+    return triples
 
-        res[k] = {'score': elscore,
-                  'pos': pos
-                  }
 
-    return res
+def pair_directories(cheir_dir, ssppr_dir):
+    """
+    Pair each CheiRank file in cheir_dir with the SSPPR file in ssppr_dir
+    with the same name, except for '.cheir.' replaced by '.ssppr.'.
+    """
+    triples = []
+    for cheir_file in sorted(cheir_dir.glob('*.cheir.*')):
+        if regex_name.match(cheir_file.name) is None:
+            continue
+
+        ssppr_file = ssppr_dir/(cheir_file.name
+                                .replace('.cheir.', '.ssppr.', 1))
+        triples.append((cheir_file, ssppr_file, None))
+
+    return triples
 
 
 if __name__ == '__main__':
@@ -94,9 +230,33 @@ if __name__ == '__main__':
 
     parser.add_argument('-c', '--cheirank',
                         type=pathlib.Path,
-                        required=True,
                         help='File with scores from CheiRank.'
                         )
+    parser.add_argument('--cheirank-dir',
+                        type=pathlib.Path,
+                        help='Process all the CheiRank files (*.cheir.*) in '
+                             'this directory, see --ssppr-dir.'
+                        )
+    parser.add_argument('--format',
+                        choices=['text', 'binary'],
+                        default='text',
+                        help='Output format, binary files (see '
+                             'scorefile.py) are sorted by page id and named '
+                             '*.bin [default: text].'
+                        )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of titles processed in parallel '
+                             '[default: 1].'
+                        )
+    parser.add_argument('-m', '--manifest',
+                        type=pathlib.Path,
+                        help='TSV file with one title per line: CheiRank '
+                             'file, SSPPR file and, optionally, output file '
+                             '(relative to the output directory). "-" reads '
+                             'it from stdin.'
+                        )
     parser.add_argument('--no-score',
                         action='store_true',
                         help='Just rank results, without scores.'
@@ -108,89 +268,97 @@ if __name__ == '__main__':
                         )
     parser.add_argument('-s', '--ssppr',
                         type=pathlib.Path,
-                        required=True,
                         help='File with scores from PageRank.'
                         )
+    parser.add_argument('--ssppr-dir',
+                        type=pathlib.Path,
+                        help='Directory with the SSPPR files matching the '
+                             'files in --cheirank-dir, i.e. with ".cheir." '
+                             'replaced by ".ssppr." in their name.'
+                        )
 
     args = parser.parse_args()
 
-    cheir_filename = os.path.basename(args.cheirank.as_posix())
-    match = regex_name.match(cheir_filename)
-
-    proj = match.group(1)
-    title = match.group(2)
-    maxloop = match.group(3)
-    date = match.group(4)
-
-    # {proj}.2Drank.{title}.{maxloop}.{date}.txt
-    output_filename = ('{0}.2Drank.{1}.{2}.{3}.txt'
-                       .format(proj, title, maxloop, date)
-                       )
-
-    ssppr_file = args.ssppr
-    cheir_file = args.cheirank
-
-    cheir = {}
-    ssppr = {}
-
-    with cheir_file.open('r') as incheir:
-        for line in incheir:
-            pageid, score = process_line(line)
-            cheir[pageid] = score
+    single = args.cheirank is not None or args.ssppr is not None
+    pairdirs = args.cheirank_dir is not None or args.ssppr_dir is not None
+    if sum([single, pairdirs, args.manifest is not None]) != 1:
+        parser.error('use exactly one of -c/-s, -m or '
+                     '--cheirank-dir/--ssppr-dir.')
+    if single and (args.cheirank is None or args.ssppr is None):
+        parser.error('-c and -s must be given together.')
+    if pairdirs and (args.cheirank_dir is None or args.ssppr_dir is None):
+        parser.error('--cheirank-dir and --ssppr-dir must be given together.')
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
+
+    binary = args.format == 'binary'
+    if binary and args.no_score:
+        parser.error('--no-score can not be used with the binary format.')
 
-    with ssppr_file.open('r') as inssppr:
-        for line in inssppr:
-            pageid, score = process_line(line)
-            ssppr[pageid] = score
-
-    ids = set(cheir.keys()).intersection(set(ssppr.keys()))
-
-    cheirsort = rank(cheir)
-    del(cheir)
-
-    sspprsort = rank(ssppr)
-    del(ssppr)
-
-    scores = {}
-    for idx in ids:
-        cheirdata = cheirsort[idx]
-        sspprdata = sspprsort[idx]
-
-        scores[idx] = (cheirsort[idx]['pos'], sspprsort[idx]['pos'])
-    del cheirsort
-    del sspprsort
-
-
-    rankscores = sorted(scores.items(), key=sort2d, reverse=True)
-
-    pos = 0
-    prevlow_score = None
-    prevsum_score = None
-    low_score = None
-    sum_score = None
-    rank2d = []
-    for pageid, (cheiscore, sspprscore) in rankscores:
-        low_score, sum_score, _ = sort2d((pageid,(cheiscore,sspprscore)))
-
-        if prevlow_score is None or prevlow_score > low_score or \
-                prevsum_score > sum_score:
-            pos = pos + 1
-            prevlow_score = low_score
-            prevsum_score = sum_score
+    output_dir = args.output_dir
 
-        # print ("({}) pageid: {} - cheiscore: {}, sspprscore: {}"
-        #        .format(pos, pageid, cheiscore, sspprscore))
-        rank2d.append((pos, pageid))
-    del rankscores
+    if single:
+        triples = [(args.cheirank, args.ssppr, None)]
+    elif pairdirs:
+        triples = pair_directories(args.cheirank_dir, args.ssppr_dir)
+    else:
+        try:
+            triples = read_manifest(args.manifest, output_dir)
+        except (OSError, ValueError) as err:
+            print('Error: could not read manifest: {}'.format(err),
+                  file=sys.stderr)
+            exit(1)
+
+    tasks = []
+    failures = []
+    for cheir_file, ssppr_file, output_file in triples:
+        if output_file is None:
+            try:
+                output_file = output_dir/output_filename(cheir_file,
+                                                         binary)
+            except ValueError as err:
+                failures.append(((cheir_file, ssppr_file, None, None),
+                                 str(err)))
+                continue
+
+        tasks.append((cheir_file, ssppr_file, output_file, args.no_score,
+                      binary))
+
+    if single:
+        results = [compute_2drank_safe(task) for task in tasks]
+    else:
+        ntasks = len(tasks)
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(args.jobs)
+            results = pool.imap_unordered(compute_2drank_safe, tasks)
+        else:
+            pool = None
+            results = map(compute_2drank_safe, tasks)
+
+        done = []
+        for count, (task, error) in enumerate(results, start=1):
+            status = 'failed' if error is not None else 'done'
+            print('[{}/{}] {}: {}'.format(count, ntasks, status, task[0]),
+                  file=sys.stderr)
+            done.append((task, error))
+        results = done
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    failures.extend((task, error)
+                    for task, error in results
+                    if error is not None)
+
+    if not single:
+        print('Processed {} titles: {} done, {} failed.'
+              .format(len(triples), len(triples)-len(failures),
+                      len(failures)),
+              file=sys.stderr)
 
-    output_dir = args.output_dir
-    output_file = output_dir/output_filename
-    with output_file.open('w+') as outfp:
-        for pos, pageid in rank2d:
-            if args.no_score:
-                outfp.write(OUTLINE_NOSCORE.format(pageid=pageid))
-            else:
-                outfp.write(OUTLINE_SCORE.format(pageid=pageid,
-                                                 score=1.0/pos))
+    for task, error in failures:
+        print('Error: could not process {}: {}'.format(task[0], error),
+              file=sys.stderr)
 
-    exit(0)
+    exit(1 if failures else 0)
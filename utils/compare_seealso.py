@@ -5,12 +5,16 @@ import os
 import re
 import sys
 import csv
-import glob
-import tqdm
 import pathlib
 import argparse
 import itertools
-import subprocess
+import multiprocessing
+
+import numpy as np
+
+from scorefile import read_scores, rank_positions, lookup_positions
+from dirindex import SIDECAR_NAME, sanitize, find_sanitized, get_index
+from snapshotindex import load_snapshot
 
 # Name regex
 #
@@ -35,22 +39,6 @@ OUTPUT_FILENAMES = {
 '2Drank': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.compare.{method}.txt',
 }
 
-# sanitize regex
-sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
-sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
-                     re.IGNORECASE)
-sanre03 = re.compile(r'^\.*$')
-sanre04 = re.compile(r'^$')
-
-def sanitize(filename: str) -> str:
-    res = sanre01.sub('', filename)
-    res = sanre02.sub('', res)
-    res = sanre03.sub('', res)
-    res = sanre04.sub('', res)
-
-    return res
-
-
 # Processing non-UTF-8 Posix filenames using Python pathlib?
 # https://stackoverflow.com/a/45724695/2377454
 def safe_path(path: pathlib.Path) -> pathlib.Path:
@@ -58,46 +46,132 @@ def safe_path(path: pathlib.Path) -> pathlib.Path:
     return pathlib.Path(os.fsdecode(encoded_path))
 
 
-# How to get line count cheaply in Python?
-# https://stackoverflow.com/a/45334571/2377454
-def count_file_lines(file_path: pathlib.Path) -> int:
+def links_filename_for(title, options):
+    if options.links_filename is not None:
+        return sanitize(options.links_filename)
+
+    if options.clickstream:
+        return sanitize('enwiki.comparison.{title}.clickstream.txt'
+                        .format(title=title))
+
+    return sanitize('enwiki.comparison.{title}.seealso.txt'
+                    .format(title=title))
+
+
+def read_links(links_file):
+    with safe_path(links_file).open('r', encoding='utf-8') as linkfp:
+        reader = csv.reader(linkfp, delimiter='\t')
+
+        # skip header
+        next(reader, None)
+
+        links_ids = set()
+        for line in reader:
+            lid = int(line[1])
+            links_ids.add(lid)
+
+    return links_ids
+
+
+def format_filename(templates, algo, title, options, **kwargs):
+    maxloop = options.maxloop
+    if algo != 'looprank' and options.wholenetwork:
+        maxloop = 'wholenetwork'
+
+    return sanitize(templates[algo].format(
+        algo=algo,
+        alpha=options.alpha,
+        title=title.replace(' ', '_'),
+        maxloop=maxloop,
+        scoring_function=options.scoring_function,
+        **kwargs
+        )
+    )
+
+
+def compare_seealso(title, algo, options, snapshot):
     """
-    Counts the number of lines in a file using wc utility.
-    :param file_path: path to file
-    :return: int, no of lines
+    Compute the position of the links of title in the scores of algo and
+    write them to the output file, return its path. snapshot maps page ids
+    to titles.
     """
+    links_filename = links_filename_for(title, options)
+    links_file = find_sanitized(options.links_dir, links_filename,
+                                sidecar=options.index_cache)
+    if not links_file:
+        raise ValueError('Links file "{}" not found.'.format(links_filename))
+
+    links_ids = read_links(links_file)
+    for lid in links_ids:
+        if lid not in snapshot:
+            raise ValueError('Link {} not found in the snapshot.'.format(lid))
+
+    scores_filename = format_filename(SCORES_FILENAMES, algo, title, options)
+    scores_file = find_sanitized(options.scores_dir, scores_filename,
+                                 sidecar=options.index_cache)
+    if not scores_file:
+        raise ValueError('Score file "{}" not found.'.format(scores_filename))
+
+    page_ids, page_scores = read_scores(scores_file)
+
+    # page id 0 is skipped
+    valid = page_ids != 0
+    ranked_ids, positions, ranked_scores = \
+        rank_positions(page_ids[valid], page_scores[valid])
+
+    link_ids = np.array(sorted(links_ids), dtype=np.int64)
+    idx, found = lookup_positions(ranked_ids, link_ids)
+    link_ids = link_ids[found]
+    link_positions = positions[idx[found]]
+    link_scores = ranked_scores[idx[found]]
+
+    # links sorted by position
+    byposition = np.argsort(link_positions, kind='stable')
+    link_ids = link_ids[byposition]
+    link_positions = link_positions[byposition]
+    link_scores = link_scores[byposition]
+
+    method = 'clickstream' if options.clickstream else 'seealso'
+    output_filename = format_filename(OUTPUT_FILENAMES, algo, title, options,
+                                      method=method)
+    output_file = options.output_dir/output_filename
+
+    with safe_path(output_file).open('w+', encoding='UTF-8') as outfp:
+        outwriter = csv.writer(outfp, delimiter='\t')
+        for lid, link_pos, link_score in \
+                zip(link_ids.tolist(),
+                    link_positions.tolist(),
+                    link_scores.tolist()):
+            link_title = snapshot[lid]
 
-    num = subprocess.check_output(
-        ['wc', '-l', safe_path(file_path).as_posix()])
-    num = num.decode('utf-8').strip().split(' ')
-    return int(num[0])
+            # 'pos title lid score'
+            outwriter.writerow((link_pos,
+                                link_title,
+                                lid,
+                                repr(link_score)
+                                )
+                               )
 
+    return output_file
+
+
+# snapshot of the worker processes, set by init_worker
+worker_snapshot = None
 
-# Regex:
-#  score(<pageid>):<spaces><score>
-#
-# where:
-#   - <pageid> is an integer number
-#   - <score> is a real number that can be written using the scientific
-#     notation
-REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
-regex_score = re.compile(REGEX_SCORE)
-
-
-def process_line(line):
-    match = regex_score.match(line)
-
-    title = None
-    score = None
-    if match:
-        pageid = int(match.group(1))
-        score = float(match.group(2))
-    else:
-        print('Error: could not process line: {}'.format(line),
-              file=sys.stderr)
 
-    # if match fails this is (None, None)
-    return pageid, score
+def init_worker(snapshot):
+    global worker_snapshot
+    worker_snapshot = snapshot
+
+
+def compare_seealso_safe(task):
+    title, algo, options = task
+    try:
+        return (title, algo,
+                compare_seealso(title, algo, options, worker_snapshot),
+                None)
+    except (OSError, ValueError, IndexError, StopIteration) as err:
+        return title, algo, None, str(err)
 
 
 if __name__ == '__main__':
@@ -139,6 +213,13 @@ if __name__ == '__main__':
                         action='store_true',
                         help='Use page indexes instead of titles.'
                         )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of (title, algorithm) pairs processed '
+                             'in parallel, the snapshot is read once and '
+                             'shared by the workers [default: 1].'
+                        )
     parser.add_argument('-k', '--maxloop',
                         type=int,
                         default=4,
@@ -157,6 +238,13 @@ if __name__ == '__main__':
                         default=pathlib.Path('.'),
                         help='Directory where to put output files [default: .]'
                         )
+    parser.add_argument('--index-cache',
+                        action='store_true',
+                        help='Save the index of the sanitized file names of '
+                             'each input directory in a {} file there, '
+                             'reused until the directory changes.'
+                             .format(SIDECAR_NAME)
+                        )
     parser.add_argument('--scores-dir',
                         type=pathlib.Path,
                         default=pathlib.Path('.'),
@@ -170,13 +258,15 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
 
     args = parser.parse_args()
-    maxloop = args.maxloop
-    alpha = args.alpha
-    scoring_function = args.scoring_function
+
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
 
     # print('* Read input. ', file=sys.stderr)
     infile = None
@@ -195,184 +285,56 @@ if __name__ == '__main__':
             titles = [line.split('\t')[0] for line in titles]
 
     # print('* Read the "snapshot" file: ', file=sys.stderr)
+    # the snapshot is read once, the worker processes get it from the
+    # pool initializer (inherited with fork, not copied)
     snapshot_file = args.snapshot
-    snaplen = count_file_lines(snapshot_file)
-    snapshot = dict()
-    with tqdm.tqdm(total=snaplen) as pbar:
-        with safe_path(snapshot_file).open('r', encoding='utf-8') as snapfp:
-            reader = csv.reader(snapfp, delimiter='\t')
-            for l in reader:
-                snapshot[int(l[0])] = l[1]
-                pbar.update(1)
+    snapshot, _ = load_snapshot(snapshot_file)
 
     # print('* Processing titles: ', file=sys.stderr)
-    links_dir = args.links_dir
-    scores_dir = args.scores_dir
-    for title in titles:
-        links_filename = None
-        # print('-'*80)
-        # print('    - {}'.format(title), file=sys.stderr)
-        if args.links_filename is None:
-            if args.clickstream:
-                links_filename = sanitize('enwiki.comparison.{title}.clickstream.txt'
-                                          .format(title=title))
-            else:
-                links_filename = sanitize('enwiki.comparison.{title}.seealso.txt'
-                                          .format(title=title))
+    # index the input directories before forking the workers
+    get_index(args.links_dir, sidecar=args.index_cache)
+    get_index(args.scores_dir, sidecar=args.index_cache)
+
+    tasks = [(title, algo, args)
+             for title in titles
+             for algo in args.algo]
+    ntasks = len(tasks)
+
+    if args.jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(
+            args.jobs, initializer=init_worker, initargs=(snapshot,))
+        results = pool.imap_unordered(compare_seealso_safe, tasks)
+    else:
+        pool = None
+        init_worker(snapshot)
+        results = map(compare_seealso_safe, tasks)
+
+    failures = []
+    for count, (title, algo, output_file, error) in \
+            enumerate(results, start=1):
+        if error is None:
+            print('[{}/{}] {} ({}): {}'
+                  .format(count, ntasks, title, algo, output_file),
+                  file=sys.stderr)
         else:
-            links_filename = sanitize(args.links_filename)
-
-        # print('        -> links_filename: {}'.format(links_filename),
-        #       file=sys.stderr)
-
-        for alinkfile in (os.path.basename(x)
-                          for x in glob.glob(links_dir.as_posix() + '/*')):
-            if sanitize(alinkfile) == links_filename:
-                links_file = links_dir/pathlib.Path(alinkfile)
-                break
-
-        if not links_file:
-            raise ValueError('Links file not found.')
-
-        with safe_path(links_file).open('r', encoding='utf-8') as linkfp:
-            reader = csv.reader(linkfp, delimiter='\t')
-
-            # skip header
-            next(reader)
+            print('[{}/{}] {} ({}): failed'
+                  .format(count, ntasks, title, algo),
+                  file=sys.stderr)
+            failures.append((title, algo, error))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if ntasks > 1:
+        print('Processed {} titles x {} algorithms: {} done, {} failed.'
+              .format(len(titles), len(args.algo), ntasks-len(failures),
+                      len(failures)),
+              file=sys.stderr)
 
-            links_ids = set()
-            for line in reader:
-                lid = int(line[1])
-                links_ids.add(lid)
+    for title, algo, error in failures:
+        print('Error: could not process {} ({}): {}'
+              .format(title, algo, error),
+              file=sys.stderr)
 
-        for  lid in links_ids:
-            link_title = snapshot[lid]
-            # print('        > {}'.format(link_title), file=sys.stderr)
-
-        for algo in args.algo:
-            scores_filename = None
-            scores_file = None
-            # print('      * Read score ({}) file'.format(algo),
-            #       file=sys.stderr)
-
-            if algo != 'looprank':
-                scores_filename = sanitize(SCORES_FILENAMES[algo].format(
-                    alpha=alpha,
-                    algo=algo,
-                    title=title.replace(' ', '_'),
-                    maxloop=maxloop
-                    )
-                )
-                if args.wholenetwork:
-                    scores_filename = sanitize(SCORES_FILENAMES[algo].format(
-                        alpha=alpha,
-                        algo=algo,
-                        title=title.replace(' ', '_'),
-                        maxloop='wholenetwork'
-                        )
-                    )
-            else:
-                scores_filename = sanitize(SCORES_FILENAMES[algo].format(
-                    algo=algo,
-                    title=title.replace(' ', '_'),
-                    maxloop=maxloop,
-                    scoring_function=scoring_function
-                    )
-                )
-
-            print('        -> scores_filename: {}'.format(scores_filename),
-                   file=sys.stderr)
-
-            for ascorefile in (os.path.basename(x)
-                            for x in glob.glob(scores_dir.as_posix() + '/*')):
-                if sanitize(ascorefile) == scores_filename:
-                    scores_file = scores_dir/pathlib.Path(ascorefile)
-                    break
-
-            if not scores_file:
-                raise ValueError('Score file not found.')
-
-            # print('        -> scores_file: {}'.format(scores_file),
-            #       file=sys.stderr)
-
-            all_outlines = []
-            scoreslen = count_file_lines(scores_file)
-
-            with safe_path(scores_file).open('r', encoding='UTF-8') \
-                    as scoresfp:
-                with tqdm.tqdm(total=scoreslen, leave=False) as pbar:
-                    for line in scoresfp:
-                        page_id, score = process_line(line)
-
-                        if page_id:
-                            all_outlines.append((page_id, score))
-
-                        pbar.update(1)
-
-
-            sorted_lines = sorted(all_outlines,
-                                  key=lambda tup: tup[1],
-                                  reverse=True
-                                  )
-            scores = dict(sorted_lines)
-
-            link_positions = dict()
-            for lid in links_ids:
-                for pos, item in enumerate(sorted_lines):
-                    if lid == item[0]:
-                        link_positions[lid] = pos + 1
-                        break
-
-            # print('      * Print results for algo {}'.format(algo),
-            #       file=sys.stderr)
-
-            output_dir = args.output_dir
-            method = 'seealso'
-            if args.clickstream:
-                method = 'clickstream'
-            if algo != 'looprank':
-                output_filename = sanitize(OUTPUT_FILENAMES[algo].format(
-                    algo=algo,
-                    alpha=alpha,
-                    title=title.replace(' ', '_'),
-                    maxloop=maxloop,
-                    method=method
-                    )
-                )
-                if  args.wholenetwork:
-                    output_filename = sanitize(OUTPUT_FILENAMES[algo].format(
-                        algo=algo,
-                        alpha=alpha,
-                        title=title.replace(' ', '_'),
-                        maxloop='wholenetwork',
-                        method=method
-                        )
-                    )
-            else:
-                output_filename = sanitize(OUTPUT_FILENAMES[algo].format(
-                    algo=algo,
-                    title=title.replace(' ', '_'),
-                    maxloop=maxloop,
-                    scoring_function=scoring_function,
-                    method=method
-                    )
-                )
-
-            output_file = output_dir/output_filename
-
-            with safe_path(output_file).open('w+', encoding='UTF-8') as outfp:
-                outwriter = csv.writer(outfp, delimiter='\t')
-                for lid in link_positions:
-                    link_title = snapshot[lid]
-                    link_pos = link_positions[lid]
-                    link_score = scores[lid]
-
-                    # 'pos title lid score'
-                    outwriter.writerow((link_pos,
-                                        link_title,
-                                        lid,
-                                        repr(link_score)
-                                        )
-                                       )
-
-    exit(0)
+    exit(1 if failures else 0)
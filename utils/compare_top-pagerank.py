@@ -5,12 +5,15 @@ import os
 import re
 import sys
 import csv
-import glob
-import tqdm
 import pathlib
 import argparse
 import itertools
-import subprocess
+
+import numpy as np
+
+from scorefile import read_scores, rank_positions, lookup_positions
+from dirindex import SIDECAR_NAME, sanitize, find_sanitized
+from snapshotindex import load_snapshot
 
 # Name regex
 #
@@ -35,22 +38,6 @@ OUTPUT_FILENAMES = {
 '2Drank': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.compare.toppr.txt',
 }
 
-# sanitize regex
-sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
-sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
-                     re.IGNORECASE)
-sanre03 = re.compile(r'^\.*$')
-sanre04 = re.compile(r'^$')
-
-def sanitize(filename: str) -> str:
-    res = sanre01.sub('', filename)
-    res = sanre02.sub('', res)
-    res = sanre03.sub('', res)
-    res = sanre04.sub('', res)
-
-    return res
-
-
 # Processing non-UTF-8 Posix filenames using Python pathlib?
 # https://stackoverflow.com/a/45724695/2377454
 def safe_path(path: pathlib.Path) -> pathlib.Path:
@@ -58,48 +45,6 @@ def safe_path(path: pathlib.Path) -> pathlib.Path:
     return pathlib.Path(os.fsdecode(encoded_path))
 
 
-# How to get line count cheaply in Python?
-# https://stackoverflow.com/a/45334571/2377454
-def count_file_lines(file_path: pathlib.Path) -> int:
-    """
-    Counts the number of lines in a file using wc utility.
-    :param file_path: path to file
-    :return: int, no of lines
-    """
-
-    num = subprocess.check_output(
-        ['wc', '-l', safe_path(file_path).as_posix()])
-    num = num.decode('utf-8').strip().split(' ')
-    return int(num[0])
-
-
-# Regex:
-#  score(<pageid>):<spaces><score>
-#
-# where:
-#   - <pageid> is an integer number
-#   - <score> is a real number that can be written using the scientific
-#     notation
-REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
-regex_score = re.compile(REGEX_SCORE)
-
-
-def process_line(line):
-    match = regex_score.match(line)
-
-    title = None
-    score = None
-    if match:
-        pageid = int(match.group(1))
-        score = float(match.group(2))
-    else:
-        print('Error: could not process line: {}'.format(line),
-              file=sys.stderr)
-
-    # if match fails this is (None, None)
-    return pageid, score
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Compute "See also" position from LR and SSPPR/CHEIR.')
@@ -150,6 +95,13 @@ if __name__ == '__main__':
                         default=pathlib.Path('.'),
                         help='Directory where to put output files [default: .]'
                         )
+    parser.add_argument('--index-cache',
+                        action='store_true',
+                        help='Save the index of the sanitized file names of '
+                             'each input directory in a {} file there, '
+                             'reused until the directory changes.'
+                             .format(SIDECAR_NAME)
+                        )
     parser.add_argument('--scores-dir',
                         type=pathlib.Path,
                         default=pathlib.Path('.'),
@@ -169,7 +121,9 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
 
     args = parser.parse_args()
@@ -195,25 +149,14 @@ if __name__ == '__main__':
 
     # print('* Read the "snapshot" file: ', file=sys.stderr)
     snapshot_file = args.snapshot
-    snaplen = count_file_lines(snapshot_file)
-    snapshot = dict()
-    with tqdm.tqdm(total=snaplen) as pbar:
-        with safe_path(snapshot_file).open('r', encoding='utf-8') as snapfp:
-            reader = csv.reader(snapfp, delimiter='\t')
-            for l in reader:
-                snapshot[int(l[0])] = l[1]
-                pbar.update(1)
+    snapshot, _ = load_snapshot(snapshot_file)
 
     # print('* Read the "top pagerank" file: ', file=sys.stderr)
     toppagerank_file = args.top_pagerank
-    topprlen = count_file_lines(toppagerank_file)
-    toppr = set()
-    with tqdm.tqdm(total=topprlen) as pbar:
-        with safe_path(toppagerank_file).open('r', encoding='utf-8') as topprfp:
-            reader = csv.reader(topprfp, delimiter='\t')
-            for l in reader:
-                toppr.add(int(l[1]))
-                pbar.update(1)
+    with safe_path(toppagerank_file).open('r', encoding='utf-8') as topprfp:
+        reader = csv.reader(topprfp, delimiter='\t')
+        toppr = np.unique(np.array([int(l[1]) for l in reader],
+                                   dtype=np.int64))
 
     # print('* Processing titles: ', file=sys.stderr)
     links_dir = args.links_dir
@@ -254,11 +197,8 @@ if __name__ == '__main__':
             print('        -> scores_filename: {}'.format(scores_filename),
                    file=sys.stderr)
 
-            for ascorefile in (os.path.basename(x)
-                            for x in glob.glob(scores_dir.as_posix() + '/*')):
-                if sanitize(ascorefile) == scores_filename:
-                    scores_file = scores_dir/pathlib.Path(ascorefile)
-                    break
+            scores_file = find_sanitized(scores_dir, scores_filename,
+                                         sidecar=args.index_cache)
 
             if not scores_file:
                 raise ValueError('Score file "{}" not found.'
@@ -268,26 +208,23 @@ if __name__ == '__main__':
             # print('        -> scores_file: {}'.format(scores_file),
             #       file=sys.stderr)
 
-            all_outlines = []
-            scoreslen = count_file_lines(scores_file)
-
-            with safe_path(scores_file).open('r', encoding='UTF-8') \
-                    as scoresfp:
-                with tqdm.tqdm(total=scoreslen, leave=False) as pbar:
-                    for line in scoresfp:
-                        page_id, score = process_line(line)
-
-                        if page_id:
-                            all_outlines.append((page_id, score))
+            page_ids, page_scores = read_scores(scores_file)
 
-                        pbar.update(1)
+            # page id 0 is skipped
+            valid = page_ids != 0
+            ranked_ids, positions, ranked_scores = \
+                rank_positions(page_ids[valid], page_scores[valid])
 
+            # positions of all the top PageRank pages, sorted by position
+            idx, found = lookup_positions(ranked_ids, toppr)
+            top_ids = toppr[found]
+            top_positions = positions[idx[found]]
+            top_scores = ranked_scores[idx[found]]
 
-            sorted_lines = sorted(all_outlines,
-                                  key=lambda tup: tup[1],
-                                  reverse=True
-                                  )
-            scores = dict(sorted_lines)
+            byposition = np.argsort(top_positions, kind='stable')
+            top_ids = top_ids[byposition]
+            top_positions = top_positions[byposition]
+            top_scores = top_scores[byposition]
 
             # print('      * Print results for algo {}'.format(algo),
             #       file=sys.stderr)
@@ -322,18 +259,12 @@ if __name__ == '__main__':
 
             with safe_path(output_file).open('w+', encoding='UTF-8') as outfp:
                 outwriter = csv.writer(outfp, delimiter='\t')
-                for pageid in toppr:
+                for pageid, page_pos, page_score in \
+                        zip(top_ids.tolist(),
+                            top_positions.tolist(),
+                            top_scores.tolist()):
                     page_title = snapshot[pageid]
 
-                    page_score = None
-                    if pageid in scores:
-                        page_score = scores[pageid]
-                        page_pos = 1 + [idx for idx, score
-                                        in sorted_lines].index(pageid)
-
-                    if page_score is None:
-                        continue
-
                     # 'pos title lid score'
                     outwriter.writerow((page_pos,
                                         page_title,
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
-import re
 import sys
 import csv
-import math
 import pathlib
 import argparse
+import multiprocessing
+
+from evaluation import CONFIG_HEADER, DEFAULT_NDCG_K, POSITION_METRICS, \
+    SCORING_FUNCTIONS, Ranking, comparison_configs, evaluate, \
+    format_filename, metric_columns, position_scores, read_comparison_file
 
 COMPARE_FILENAMES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{maxloop}.2018-03-01.compare.seealso.txt',
                      'ssppr': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.compare.seealso.txt',
@@ -18,124 +21,90 @@ COMPARISON_FILE_HEADER = ('pos', 'title', 'page_id', 'score')
 OUTPUT_FILENAME = 'enwiki.{algo}.{title}.{maxloop}.2018-03-01.compare.txt'
 
 
-# sanitize regex
-sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
-sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
-                     re.IGNORECASE)
-sanre03 = re.compile(r'^\.*$')
-sanre04 = re.compile(r'^$')
-
-def sanitize(filename: str) -> str:
-    res = sanre01.sub('', filename)
-    res = sanre02.sub('', res)
-    res = sanre03.sub('', res)
-    res = sanre04.sub('', res)
-
-    return res
-
-
-def read_comparison_file(algo,
-                         alpha,
-                         scoring_function,
-                         title,
-                         maxloop,
-                         wholenetwork,
-                         comparison_dir):
-
-    if algo != 'looprank' and wholenetwork:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  alpha=alpha,
-                                  title=title,
-                                  maxloop='wholenetwork'
-                                  )
-                          )
-    else:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  title=title,
-                                  alpha=alpha,
-                                  maxloop=maxloop,
-                                  scoring_function=scoring_function
-                                  )
-                          )
-
-    input_file = comparison_dir/input_filename
-
-
-    links = {}
-    try:
-        with input_file.open('r') as infp:
-            reader = csv.reader(infp, delimiter='\t')
+# per-link output table header
+LINKS_HEADER = (('title',) + CONFIG_HEADER +
+                ('link_title', 'page_id', 'pos', 'linear', 'log'))
 
-            # ['5', 'Bijbehara railway station', '11119524', '2.41667']
-            for line in reader:
-                data = dict()
-                data['pos'] = int(line[0])
-                data['title'] = line[1]
-                data['score'] = float(line[3])
 
-                page_id = int(line[2])
+def results_header(options):
+    return (('title',) + CONFIG_HEADER +
+            metric_columns(options.metric, k=options.ndcg_k) +
+            ('n',))
 
-                links[page_id] = data
-    except FileNotFoundError:
-        print("File {} not found.".format(input_file), file=sys.stderr)
 
-    return links
+def evaluate_title(title, configs, options):
+    """
+    Evaluate the "See also" links of title in the comparison file of each
+    configuration, every file is read once.
 
+    Return a list of (config, row, link rows, error).
+    """
+    results = []
+    for config in configs:
+        input_file = (options.comparison_dir /
+                      format_filename(COMPARE_FILENAMES, config, title))
+        try:
+            ids, positions, scores, link_titles = \
+                read_comparison_file(input_file)
+        except (OSError, ValueError, IndexError) as err:
+            results.append((config, None, None, str(err)))
+            continue
 
-def compute_score(links, use_log=False):
-    pos = 0
-    score = 0.0
-    title = ''
-    try:
-        pos = links[lid]['pos']
-        title = links[lid]['title']
-    except KeyError:
-        pass
+        ranking = Ranking.from_comparison(ids, positions, scores)
+        row = ((title,) + config +
+               evaluate(ranking, options.metric, k=options.ndcg_k) +
+               (len(ranking),))
 
-    if use_log:
+        link_rows = None
+        if options.links_output is not None:
+            link_rows = [(title,) + config + link
+                         for link in zip(link_titles,
+                                         ids.tolist(),
+                                         positions.tolist(),
+                                         position_scores(positions).tolist(),
+                                         position_scores(positions,
+                                                         use_log=True)
+                                         .tolist())]
 
-      try:
-        score = 1.0/(1+math.log(pos))
-      except ValueError:
-        score = 0.0
+        results.append((config, row, link_rows, None))
 
-    else:
+    return results
 
-      try:
-          score = 1.0/pos
-      except ZeroDivisionError:
-          score = 0.0
 
-    return score, title
+def evaluate_title_safe(task):
+    title, configs, options = task
+    return title, evaluate_title(title, configs, options)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
-        description='Compute comparison score between LR and SSPPR.')
+        description='Compute the evaluation scores of the "See also" links '
+                    'for a list of titles, algorithms and parameters.')
     parser.add_argument('-a', '--algo',
                         type=str,
                         choices=ALLOWED_ALGOS,
                         metavar='ALGO',
-                        default='looprank',
-                        help=('Name of the  algorithm to use. '
+                        nargs='+',
+                        default=['looprank'],
+                        help=('Name of the algorithms to evaluate. '
                               'Choices: {{{}}}. '
                               '[default: looprank].'
                               ).format(', '.join(ALLOWED_ALGOS))
                         )
     parser.add_argument('--alpha',
                         type=float,
-                        default=0.85,
-                        help='Alpha PageRank damping factor '
+                        nargs='+',
+                        default=[0.85],
+                        help='Alpha PageRank damping factors, for the '
+                             'algorithms other than LoopRank '
                              '[default: 0.85].'
                         )
     parser.add_argument('-f', '--scoring-function',
                         type=str,
-                        default='linear',
-                        choices=['linear', 'square', 'cube', 'nlogn',
-                                 'expe', 'exp10'],
-                        help='LoopRank scoring function '
+                        nargs='+',
+                        default=['linear'],
+                        choices=SCORING_FUNCTIONS,
+                        help='LoopRank scoring functions '
                              '[default: linear].'
                         )
     parser.add_argument('-i', '--input',
@@ -143,20 +112,56 @@ if __name__ == '__main__':
                         help='File with page titles '
                              '[default: read from stdin].'
                         )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of titles processed in parallel '
+                             '[default: 1].'
+                        )
     parser.add_argument('-k', '--maxloop',
                         type=int,
-                        default=4,
-                        help='Max loop length [default: 4].'
+                        nargs='+',
+                        default=[4],
+                        help='Max loop lengths [default: 4].'
                         )
-    parser.add_argument('--log',
-                        action='store_true',
-                        help='Use 1/log(n) to compute the comparison score instead of 1/n.'
+    parser.add_argument('-m', '--metric',
+                        type=str,
+                        choices=POSITION_METRICS,
+                        metavar='METRIC',
+                        nargs='+',
+                        default=['linear', 'log'],
+                        help=('Metrics to compute (see evaluation.py), '
+                              'linear is the sum of 1/n and log the sum of '
+                              '1/(1+log(n)) over the positions n of the '
+                              'links. Choices: {{{}}}. '
+                              '[default: linear log].'
+                              ).format(', '.join(POSITION_METRICS))
+                        )
+    parser.add_argument('--ndcg-k',
+                        type=int,
+                        default=DEFAULT_NDCG_K,
+                        help='Number of top positions for NDCG '
+                             '[default: {}].'.format(DEFAULT_NDCG_K)
                         )
     parser.add_argument('--comparison-dir',
                         type=pathlib.Path,
                         default=pathlib.Path('.'),
-                        help='File with page titles '
-                             '[default: read from stdin].'
+                        help='Directory with the comparison files '
+                             '[default: .].'
+                        )
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        help='Output file with the results table, one row '
+                             'per title and configuration: title, {}, the '
+                             'columns of each metric, n (number of links) '
+                             '[default: stdout].'
+                             .format(', '.join(CONFIG_HEADER))
+                        )
+    parser.add_argument('--links-output',
+                        type=pathlib.Path,
+                        help='Also write the score of each link to this '
+                             'file, one row per title, configuration and '
+                             'link: {}.'.format(', '.join(LINKS_HEADER))
                         )
     parser.add_argument('-w', '--wholenetwork',
                         action='store_true',
@@ -165,8 +170,15 @@ if __name__ == '__main__':
                         )
 
     args = parser.parse_args()
-    comparison_dir = args.comparison_dir
-    algo = args.algo
+
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
+    if args.ndcg_k < 1:
+        parser.error('--ndcg-k must be positive.')
+
+    configs = comparison_configs(args.algo, args.scoring_function,
+                                 args.alpha, args.maxloop,
+                                 wholenetwork=args.wholenetwork)
 
     print('* Read input. ', file=sys.stderr)
     infile = None
@@ -176,50 +188,64 @@ if __name__ == '__main__':
         infile = sys.stdin
 
     titles = [_.strip() for _ in infile.readlines()]
+    titles = [title for title in titles if title]
 
     print('* Processing titles: ', file=sys.stderr)
-    for title in titles:
-        score = 0.0
-
-        scores = dict()
-        print('-'*80)
-        print('    - {}'.format(title), file=sys.stderr)
-
-        links_algo = read_comparison_file(algo=algo,
-                                           alpha=args.alpha,
-                                           scoring_function=args.scoring_function,
-                                           title=title,
-                                           maxloop=args.maxloop,
-                                           wholenetwork=args.wholenetwork,
-                                           comparison_dir=comparison_dir
-                                           )
-
-        links_set = set(links_algo.keys())
-        for lid in links_set:
-            score_algo, title_algo = compute_score(links_algo, use_log=args.log)
-
-            # import ipdb; ipdb.set_trace()
-            score += score_algo
-
-            title_link = title_algo
-            scores[title_link] = score_algo
-
-        function='linear'
-        if args.log:
-          function='log'
-
-        outfile = sanitize(
-            'enwiki.evaluate.{algo}.{title}.2018-03-01.scores.{function}.txt'
-            .format(title=title.replace(' ', '_'),
-                    algo=algo,
-                    function=function
-                    )
-            )
-
-        with open(outfile, 'w+') as outfp:
-            writer = csv.writer(outfp, delimiter='\t')
-            writer.writerow((score,))
-            for link_title in scores:
-                writer.writerow((scores[link_title], link_title))
-
-    exit(0)
+    tasks = [(title, configs, args) for title in titles]
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        # imap keeps the rows in the order of the titles
+        results = pool.imap(evaluate_title_safe, tasks)
+    else:
+        pool = None
+        results = map(evaluate_title_safe, tasks)
+
+    outfile = sys.stdout
+    if args.output is not None:
+        outfile = args.output.open('w+')
+
+    writer = csv.writer(outfile, delimiter='\t')
+    writer.writerow(results_header(args))
+
+    links_writer = None
+    if args.links_output is not None:
+        linksfile = args.links_output.open('w+')
+        links_writer = csv.writer(linksfile, delimiter='\t')
+        links_writer.writerow(LINKS_HEADER)
+
+    failures = []
+    for count, (title, title_results) in enumerate(results, start=1):
+        for config, row, link_rows, error in title_results:
+            if error is None:
+                writer.writerow(row)
+                if links_writer is not None:
+                    links_writer.writerows(link_rows)
+            else:
+                failures.append((title, config, error))
+
+        print('[{}/{}] {}'.format(count, len(titles), title),
+              file=sys.stderr)
+
+    if args.output is not None:
+        outfile.close()
+    if links_writer is not None:
+        linksfile.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ntasks = len(titles)*len(configs)
+    print('Processed {} titles x {} configurations: {} done, {} failed.'
+          .format(len(titles), len(configs), ntasks-len(failures),
+                  len(failures)),
+          file=sys.stderr)
+
+    for title, config, error in failures:
+        print('Error: could not process {} ({}): {}'
+              .format(title, ', '.join(str(field) for field in config
+                                       if field is not None),
+                      error),
+              file=sys.stderr)
+
+    exit(1 if failures else 0)
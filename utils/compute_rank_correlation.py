@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
-import re
 import sys
 import csv
-import math
 import pathlib
 import argparse
-from operator import itemgetter
-from scipy.stats import rankdata, kendalltau
+import multiprocessing
+
+import numpy as np
+
+from scorefile import read_scores, rank_positions
+from dirindex import SIDECAR_NAME, sanitize, find_sanitized, get_index
+from evaluation import DEFAULT_NDCG_K, DEFAULT_RBO_P, DEFAULT_TOP_K, \
+    METRICS, Ranking, evaluate, format_filename, metric_columns, \
+    read_comparison_file
 
 COMPARE_FILENAMES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{maxloop}.2018-03-01.compare.clickstream.txt',
                      'ssppr': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.compare.clickstream.txt',
@@ -16,135 +21,133 @@ COMPARE_FILENAMES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{max
                      }
 ALLOWED_ALGOS = list(COMPARE_FILENAMES.keys())
 
+# score files of the algorithms (as in compare_seealso.py), read for the
+# metrics that need the full ranking
+SCORES_FILENAMES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{maxloop}.2018-03-01.scores.txt',
+                    'ssppr': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.txt',
+                    'cheir': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.txt',
+                    '2Drank': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.txt',
+                    }
+FULL_RANKING_METRICS = ['kendall_top_k']
+
 COMPARISON_FILE_HEADER = ('pos', 'title', 'page_id', 'score')
 OUTPUT_FILENAME = 'enwiki.{algo}.{title}.{maxloop}.2018-03-01.compare.txt'
 
 
-# sanitize regex
-sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
-sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
-                     re.IGNORECASE)
-sanre03 = re.compile(r'^\.*$')
-sanre04 = re.compile(r'^$')
-
-def sanitize(filename: str) -> str:
-    res = sanre01.sub('', filename)
-    res = sanre02.sub('', res)
-    res = sanre03.sub('', res)
-    res = sanre04.sub('', res)
-
-    return res
-
-
-def read_comparison_file(algo,
-                         alpha,
-                         scoring_function,
-                         title,
-                         maxloop,
-                         wholenetwork,
-                         comparison_dir):
-
-    if algo != 'looprank' and wholenetwork:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  alpha=alpha,
-                                  title=title,
-                                  maxloop='wholenetwork'
-                                  )
-                          )
-    else:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  alpha=alpha,
-                                  title=title,
-                                  maxloop=maxloop,
-                                  scoring_function=scoring_function
-                                  )
-                          )
-
-    input_file = comparison_dir/input_filename
-
-
-    links = {}
-    try:
-        with input_file.open('r') as infp:
-            reader = csv.reader(infp, delimiter='\t')
+def results_header(options):
+    return (('title', 'algo') +
+            metric_columns(options.metric, k=options.ndcg_k,
+                           p=options.rbo_p, top_k=options.top_k) +
+            ('n',))
 
-            # ['5', 'Bijbehara railway station', '11119524', '2.41667']
-            for line in reader:
-                data = dict()
-                data['pos'] = int(line[0])
-                data['title'] = line[1]
-                data['score'] = float(line[3])
 
-                page_id = int(line[2])
+def algo_config(algo, options):
+    """
+    Return the configuration (see evaluation.CONFIG_HEADER) of algo in
+    options, used to name its files.
+    """
+    maxloop = options.maxloop
+    if algo != 'looprank' and options.wholenetwork:
+        maxloop = 'wholenetwork'
 
-                links[page_id] = data
-    except FileNotFoundError:
-        print("File {} not found.".format(input_file), file=sys.stderr)
+    return (algo, options.scoring_function, options.alpha, maxloop)
 
-    return links
 
+def read_full_ranking(algo, title, options):
+    """
+    Return the ranked page ids (sorted) and their positions in the score
+    file of algo for title, page id 0 is skipped.
+    """
+    filename = format_filename(SCORES_FILENAMES,
+                               algo_config(algo, options), title)
+    scores_file = find_sanitized(options.scores_dir, filename,
+                                 sidecar=options.index_cache)
+    if not scores_file:
+        raise ValueError('Score file "{}" not found.'.format(filename))
 
-def read_links_file(title,
-                    links_dir):
+    page_ids, page_scores = read_scores(scores_file)
+    valid = page_ids != 0
+    ranked_ids, positions, _ = rank_positions(page_ids[valid],
+                                              page_scores[valid])
 
-    links_filename = ('enwiki.comparison.{title}.clickstream.txt'
-                      .format(title=title))
+    return ranked_ids, positions
 
-    links_file = links_dir/links_filename
-
-    links = {}
-    try:
-        with links_file.open('r') as infp:
-            reader = csv.reader(infp, delimiter='\t')
 
-            # skip header
-            next(reader)
+def links_filename(title):
+    return sanitize('enwiki.comparison.{title}.clickstream.txt'
+                    .format(title=title))
 
-            # link_title  link_id click_count
-            # Mughal-e-Azam 317154  147
 
-            for line in reader:
-                data = dict()
-                links_id = int(line[1])
+def read_links_file(links_file):
+    """
+    Return the page ids (sorted) and the click counts in a clickstream
+    links file.
+    """
+    counts = {}
+    with links_file.open('r') as infp:
+        reader = csv.reader(infp, delimiter='\t')
 
-                data['title'] = line[0]
-                data['count'] = int(line[2])
+        # skip header
+        next(reader)
 
-                links[links_id] = data
+        # link_title  link_id click_count
+        # Mughal-e-Azam 317154  147
+        for line in reader:
+            counts[int(line[1])] = int(line[2])
 
-    except FileNotFoundError:
-        print("File {} not found.".format(input_file), file=sys.stderr)
+    ids = sorted(counts)
+    return (np.array(ids, dtype=np.int64),
+            np.array([counts[lid] for lid in ids], dtype=np.float64))
 
-    return links
 
+def evaluate_title(title, options):
+    """
+    Evaluate the ranking of the clickstream links of title (by click count)
+    computed by each algorithm in options.algo with options.metric.
 
-def compute_score(links, use_log=False):
-    pos = 0
-    score = 0.0
-    title = ''
+    Return a list of (algo, row, error), row is a tuple as the header of
+    the results table (see results_header).
+    """
     try:
-        pos = links[lid]['pos']
-        title = links[lid]['title']
-    except KeyError:
-        pass
-
-    if use_log:
-
-      try:
-        score = 1.0/(1+math.log(pos))
-      except ValueError:
-        score = 0.0
-
-    else:
-
-      try:
-          score = 1.0/pos
-      except ZeroDivisionError:
-          score = 0.0
-
-    return score, title
+        filename = links_filename(title)
+        links_file = find_sanitized(options.links_dir, filename,
+                                    sidecar=options.index_cache)
+        if not links_file:
+            raise ValueError('Links file "{}" not found.'.format(filename))
+
+        ref_ids, counts = read_links_file(links_file)
+    except (OSError, ValueError, IndexError, StopIteration) as err:
+        return [(algo, None, str(err)) for algo in options.algo]
+
+    results = []
+    for algo in options.algo:
+        try:
+            algo_ids, positions, scores, _ = read_comparison_file(
+                options.comparison_dir /
+                format_filename(COMPARE_FILENAMES,
+                                algo_config(algo, options), title))
+            ranking = Ranking.from_links(ref_ids, counts,
+                                         algo_ids, positions, scores)
+            if any(metric in FULL_RANKING_METRICS
+                   for metric in options.metric):
+                ranking.full = read_full_ranking(algo, title, options)
+        except (OSError, ValueError, IndexError) as err:
+            results.append((algo, None, str(err)))
+            continue
+
+        values = evaluate(ranking, options.metric,
+                          k=options.ndcg_k, p=options.rbo_p,
+                          top_k=options.top_k)
+        results.append((algo,
+                        (title, algo) + values + (len(ranking),),
+                        None))
+
+    return results
+
+
+def evaluate_title_safe(task):
+    title, options = task
+    return title, evaluate_title(title, options)
 
 
 if __name__ == '__main__':
@@ -154,8 +157,9 @@ if __name__ == '__main__':
                         type=str,
                         choices=ALLOWED_ALGOS,
                         metavar='ALGO',
-                        default='looprank',
-                        help=('Name of the  algorithm to use. '
+                        nargs='+',
+                        default=['looprank'],
+                        help=('Name of the algorithms to evaluate. '
                               'Choices: {{{}}}. '
                               '[default: looprank].'
                               ).format(', '.join(ALLOWED_ALGOS))
@@ -179,6 +183,12 @@ if __name__ == '__main__':
                         help='File with page titles '
                              '[default: read from stdin].'
                         )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of titles processed in parallel '
+                             '[default: 1].'
+                        )
     parser.add_argument('-k', '--maxloop',
                         type=int,
                         default=4,
@@ -196,6 +206,58 @@ if __name__ == '__main__':
                         default=pathlib.Path('.'),
                         help='Directory with comparison files'
                         )
+    parser.add_argument('-m', '--metric',
+                        type=str,
+                        choices=list(METRICS),
+                        metavar='METRIC',
+                        nargs='+',
+                        default=['kendall'],
+                        help=('Metrics to compute, all from the same read '
+                              'of the files (see evaluation.py). '
+                              'Choices: {{{}}}. '
+                              '[default: kendall].'
+                              ).format(', '.join(METRICS))
+                        )
+    parser.add_argument('--ndcg-k',
+                        type=int,
+                        default=DEFAULT_NDCG_K,
+                        help='Number of top positions for NDCG '
+                             '[default: {}].'.format(DEFAULT_NDCG_K)
+                        )
+    parser.add_argument('--rbo-p',
+                        type=float,
+                        default=DEFAULT_RBO_P,
+                        help='Persistence of rank-biased overlap '
+                             '[default: {}].'.format(DEFAULT_RBO_P)
+                        )
+    parser.add_argument('--top-k',
+                        type=int,
+                        default=DEFAULT_TOP_K,
+                        help='Number of top pages of the full ranking for '
+                             'kendall_top_k, the pages after them are tied '
+                             '[default: {}].'.format(DEFAULT_TOP_K)
+                        )
+    parser.add_argument('--scores-dir',
+                        type=pathlib.Path,
+                        default=pathlib.Path('.'),
+                        help='Directory with the score files, for '
+                             'kendall_top_k [default: .].'
+                        )
+    parser.add_argument('--index-cache',
+                        action='store_true',
+                        help='Save the index of the sanitized file names of '
+                             'the links and scores directories in a {} '
+                             'file there, reused until the directory '
+                             'changes.'
+                             .format(SIDECAR_NAME)
+                        )
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        help='Output file with the results table, one row '
+                             'per title and algorithm: title, algo, the '
+                             'columns of each metric, n (number of links) '
+                             '[default: stdout].'
+                        )
     parser.add_argument('-w', '--wholenetwork',
                         action='store_true',
                         help='Run PageRank, CheiRank, 2Drank '
@@ -203,9 +265,15 @@ if __name__ == '__main__':
                         )
 
     args = parser.parse_args()
-    comparison_dir = args.comparison_dir
-    links_dir = args.links_dir
-    algo = args.algo
+
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
+    if args.ndcg_k < 1:
+        parser.error('--ndcg-k must be positive.')
+    if not 0 < args.rbo_p < 1:
+        parser.error('--rbo-p must be in (0, 1).')
+    if args.top_k < 1:
+        parser.error('--top-k must be positive.')
 
     print('* Read input. ', file=sys.stderr)
     infile = None
@@ -215,73 +283,57 @@ if __name__ == '__main__':
         infile = sys.stdin
 
     titles = [_.strip() for _ in infile.readlines()]
+    titles = [title for title in titles if title]
+
+    # index the input directories before forking the workers
+    get_index(args.links_dir, sidecar=args.index_cache)
+    if any(metric in FULL_RANKING_METRICS for metric in args.metric):
+        get_index(args.scores_dir, sidecar=args.index_cache)
 
     print('* Processing titles: ', file=sys.stderr)
-    for title in titles:
-        score = 0.0
-
-        scores = dict()
-        print('-'*80)
-        print('    - {}'.format(title), file=sys.stderr)
-
-        links_algo = read_comparison_file(algo=algo,
-                                           alpha=args.alpha,
-                                           scoring_function=args.scoring_function,
-                                           title=title,
-                                           maxloop=args.maxloop,
-                                           wholenetwork=args.wholenetwork,
-                                           comparison_dir=comparison_dir
-                                           )
-
-        links_ref = read_links_file(title=title, links_dir=links_dir)
-
-        assert all(key in links_ref for key in links_algo), \
-                'Error: unexpected key in the comparison results'
-
-        for key in links_ref:
-          if key not in links_algo:
-            links_algo[key] = {'pos': -1,
-                               'title': links_ref[key]['title'],
-                               'score': 0,
-                               }
-
-        rank_algo = sorted([(key, links_algo[key]['score'])
-                            for key in links_algo],
-                            key=itemgetter(1),
-                            reverse=True)
-
-        rank_ref = sorted([(key, links_ref[key]['count'])
-                           for key in links_ref],
-                           key=itemgetter(1),
-                           reverse=True)
-
-        stdrank_algo = rankdata([-el[1] for el
-                                          in sorted(rank_algo,key=itemgetter(0))
-                                          ])
-        cmprank_algo = list(zip([el[0] for el
-                                 in sorted(rank_algo,key=itemgetter(0))],
-                                stdrank_algo
-                                ))
-
-
-        stdrank_ref =rankdata([-el[1] for el
-                               in sorted(rank_ref,key=itemgetter(0))
-                               ])
-        cmprank_ref = list(zip([el[0] for el
-                                in sorted(rank_ref,key=itemgetter(0))],
-                               stdrank_ref
-                               ))
-
-        ktau = kendalltau(stdrank_ref, stdrank_algo)
-
-        outfile = sanitize(
-            'enwiki.evaluate.{algo}.{title}.2018-03-01.clickstream.txt'
-            .format(title=title.replace(' ', '_'),algo=algo)
-            )
-
-        if not math.isnan(ktau.correlation):
-          with open(outfile, 'w+') as outfp:
-              writer = csv.writer(outfp, delimiter='\t')
-              writer.writerow((ktau.correlation, ktau.pvalue))
-
-    exit(0)
+    tasks = [(title, args) for title in titles]
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        # imap keeps the rows in the order of the titles
+        results = pool.imap(evaluate_title_safe, tasks)
+    else:
+        pool = None
+        results = map(evaluate_title_safe, tasks)
+
+    outfile = sys.stdout
+    if args.output is not None:
+        outfile = args.output.open('w+')
+
+    writer = csv.writer(outfile, delimiter='\t')
+    writer.writerow(results_header(args))
+
+    failures = []
+    for count, (title, title_results) in enumerate(results, start=1):
+        for algo, row, error in title_results:
+            if error is None:
+                writer.writerow(row)
+            else:
+                failures.append((title, algo, error))
+
+        print('[{}/{}] {}'.format(count, len(titles), title),
+              file=sys.stderr)
+
+    if args.output is not None:
+        outfile.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ntasks = len(titles)*len(args.algo)
+    print('Processed {} titles x {} algorithms: {} done, {} failed.'
+          .format(len(titles), len(args.algo), ntasks-len(failures),
+                  len(failures)),
+          file=sys.stderr)
+
+    for title, algo, error in failures:
+        print('Error: could not process {} ({}): {}'
+              .format(title, algo, error),
+              file=sys.stderr)
+
+    exit(1 if failures else 0)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import re
 import sys
@@ -8,55 +9,74 @@ import csv
 import math
 import argparse
 import pathlib
+import importlib
 from collections import defaultdict
 
+import numpy as np
+
+from cyclefile import is_stdin, is_binary, open_cycles, \
+    read_cycles_parallel, iter_cycles, CycleFile
+from scorefile import STDIN, write_binary_scores
+
 NDIGITS = 5
 
-def linear_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += 1.0/csize
+# A scoring function gives the weight that a cycle of length n adds to the
+# score of each of its nodes.
+def linear_score(csize):
+    return 1.0/csize
 
 
-def square_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += 1.0/(csize*csize)
+def square_score(csize):
+    return 1.0/(csize*csize)
 
 
-def cube_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += math.pow(csize, -3)
+def cube_score(csize):
+    return math.pow(csize, -3)
 
 
-def nlogn_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += 1.0/(csize*math.log(csize))
+def nlogn_score(csize):
+    return 1.0/(csize*math.log(csize))
 
 
-def expe_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += math.exp(-csize)
+def expe_score(csize):
+    return math.exp(-csize)
 
 
-def exp10_score(scores, cycle):
-    csize = len(cycle)
-    for node in cycle:
-        scores[node] += math.pow(10, -csize)
+def exp10_score(csize):
+    return math.pow(10, -csize)
 
 
 SCORING_FUNCTIONS = {
-'linear': linear_score,		# 1/10^n
+'linear': linear_score,		# 1/n
 'square': square_score,		# 1/n^2
 'cube': cube_score,			# 1/n^3
 'nlogn': nlogn_score,		# 1/n*log(n)
 'expe': expe_score,			# 1/(e^n)
-'exp10': exp10_score 		# 1(10^n)
+'exp10': exp10_score 		# 1/(10^n)
 }
 
+# names available in --weight expressions, besides n
+WEIGHT_NAMESPACE = {name: getattr(math, name)
+                    for name in dir(math)
+                    if not name.startswith('_')}
+
+# module.path:function entry points for --weight
+REGEX_ENTRY_POINT = r'^[A-Za-z_][\w.]*:[A-Za-z_][\w.]*$'
+regex_entry_point = re.compile(REGEX_ENTRY_POINT)
+
+BACKENDS = ['numpy', 'python']
+
+# placeholder for the scoring function name in the output file name
+OUTPUT_PLACEHOLDER = '{scoring_function}'
+# placeholder for the maxloop value in the output file name
+MAXLOOP_PLACEHOLDER = '{maxloop}'
+
+# output orderings
+ORDERS = ['id', 'score']
+
+# output formats, see scorefile.py for the binary format
+FORMATS = ['text', 'binary']
+
 
 # Processing non-UTF-8 Posix filenames using Python pathlib?
 # https://stackoverflow.com/a/45724695/2377454
@@ -65,53 +85,568 @@ def safe_path(path: pathlib.Path) -> pathlib.Path:
     return pathlib.Path(os.fsdecode(encoded_path))
 
 
+def score_cycle(scores, cycle, scoring_function):
+    weight = scoring_function(len(cycle))
+    for node in cycle:
+        scores[node] += weight
+
+
+def update_weight_table(table, scoring_function, lengths):
+    """
+    Make sure that the lookup table with the weight of a cycle of length n
+    at position n contains all the given lengths. Missing entries are NaN,
+    the table is grown if needed and returned.
+    """
+    maxlen = int(lengths.max())
+    if maxlen >= table.size:
+        newtable = np.full(maxlen+1, np.nan, dtype=np.float64)
+        newtable[:table.size] = table
+        table = newtable
+
+    for csize in np.unique(lengths).tolist():
+        if np.isnan(table[csize]):
+            weight = float(scoring_function(csize))
+            if not math.isfinite(weight):
+                raise ValueError('The weight of cycles of length {} is not '
+                                 'finite: {}.'.format(csize, weight))
+            table[csize] = weight
+
+    return table
+
+
+class ScoreAccumulator:
+    """
+    Dense score array indexed by node id.
+
+    Weights are added with np.add.at, which performs the additions in input
+    order, so each node receives exactly the same sequence of floating point
+    additions as with the per-cycle scoring functions.
+    """
+
+    def __init__(self):
+        self.scores = np.zeros(0, dtype=np.float64)
+        self.seen = np.zeros(0, dtype=bool)
+
+    def _grow(self, maxnode):
+        if maxnode < self.scores.size:
+            return
+
+        size = max(maxnode + 1, 2*self.scores.size)
+        scores = np.zeros(size, dtype=np.float64)
+        scores[:self.scores.size] = self.scores
+        seen = np.zeros(size, dtype=bool)
+        seen[:self.seen.size] = self.seen
+
+        self.scores = scores
+        self.seen = seen
+
+    def add(self, nodes, lengths, weights):
+        if nodes.size == 0:
+            return
+
+        self._grow(int(nodes.max()))
+        node_weights = np.repeat(weights[lengths], lengths)
+        np.add.at(self.scores, nodes, node_weights)
+        self.seen[nodes] = True
+
+    def items(self):
+        nids = np.flatnonzero(self.seen)
+        return zip(nids.tolist(), self.scores[nids].tolist())
+
+
+class CycleProfile:
+    """
+    Per-node cycle-length profile: counts[i, n] is the number of cycles of
+    length n that node nodes[i] belongs to (nodes is sorted).
+
+    Every scoring function only depends on these counts, so once the profile
+    is known any function, and any maxloop up to the longest cycle, can be
+    computed in O(nodes x K) without reading the cycles again.
+    """
+
+    def __init__(self, nodes=None, counts=None):
+        if nodes is None:
+            nodes = np.empty(0, dtype=np.int64)
+        if counts is None:
+            counts = np.zeros((0, 1), dtype=np.int64)
+
+        self._nodes = nodes
+        self._counts = counts
+
+        # per-block profiles not merged yet, they are merged all at once
+        # when they are larger than the merged profile (and when the profile
+        # is read), so the merges cost is amortized over the blocks
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def nodes(self):
+        self._merge()
+        return self._nodes
+
+    @property
+    def counts(self):
+        self._merge()
+        return self._counts
+
+    def add(self, nodes, lengths):
+        if nodes.size == 0:
+            return
+
+        ncols = int(lengths.max()) + 1
+        cyclelen = np.repeat(lengths, lengths)
+
+        block_nodes, inverse = np.unique(nodes, return_inverse=True)
+        block_counts = np.bincount(inverse*ncols + cyclelen,
+                                   minlength=block_nodes.size*ncols)
+        block_counts = block_counts.reshape(block_nodes.size, ncols)
+
+        self._pending.append((block_nodes, block_counts))
+        self._pending_size += block_nodes.size
+        if self._pending_size > self._nodes.size:
+            self._merge()
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        parts = [(self._nodes, self._counts)] + self._pending
+        ncols = max(counts.shape[1] for _, counts in parts)
+
+        nodes = np.concatenate([part_nodes for part_nodes, _ in parts])
+        counts = np.zeros((nodes.size, ncols), dtype=np.int64)
+        start = 0
+        for _, part_counts in parts:
+            end = start + part_counts.shape[0]
+            counts[start:end, :part_counts.shape[1]] = part_counts
+            start = end
+
+        order = np.argsort(nodes, kind='stable')
+        nodes = nodes[order]
+        starts = np.flatnonzero(np.r_[True, nodes[1:] != nodes[:-1]])
+
+        self._nodes = nodes[starts]
+        self._counts = np.add.reduceat(counts[order], starts, axis=0)
+        self._pending = []
+        self._pending_size = 0
+
+    def scores(self, scoring_function, K=None):
+        """
+        Return an iterable of (node, score) sorted by node, only nodes in at
+        least one cycle of length <= K are reported.
+        """
+        maxlen = self.counts.shape[1] - 1
+        if K is not None:
+            maxlen = min(maxlen, K)
+
+        counts = self.counts[:, :maxlen+1]
+        lengths = np.flatnonzero(counts.sum(axis=0))
+        if lengths.size == 0:
+            return zip([], [])
+
+        weights = update_weight_table(np.empty(0, dtype=np.float64),
+                                      scoring_function,
+                                      lengths)
+
+        scores = np.zeros(self.nodes.size, dtype=np.float64)
+        for csize in lengths.tolist():
+            scores += counts[:, csize] * weights[csize]
+
+        keep = counts.sum(axis=1) > 0
+        return zip(self.nodes[keep].tolist(), scores[keep].tolist())
+
+    def save(self, path, source):
+        """
+        Save the profile to path (.npz), recording size and modification
+        time of the source cycle file (-1 if it was read from stdin).
+        """
+        source_size = -1
+        source_mtime = -1
+        if not is_stdin(source):
+            stat = safe_path(source).stat()
+            source_size = stat.st_size
+            source_mtime = stat.st_mtime_ns
+
+        with safe_path(path).open('wb') as outfp:
+            np.savez(outfp,
+                     nodes=self.nodes,
+                     counts=self.counts,
+                     source_size=np.int64(source_size),
+                     source_mtime=np.int64(source_mtime))
+
+    @classmethod
+    def load(cls, path, source=None):
+        """
+        Load the profile in path. If source is given and exists, return None
+        when the profile was not computed from its current content.
+        """
+        with np.load(safe_path(path).as_posix()) as data:
+            if source is not None and safe_path(source).exists():
+                stat = safe_path(source).stat()
+                if int(data['source_size']) != stat.st_size or \
+                        int(data['source_mtime']) != stat.st_mtime_ns:
+                    return None
+
+            return cls(data['nodes'], data['counts'])
+
+
+def build_profile(infile, njobs=1):
+    profile = CycleProfile()
+    for nodes, lengths in read_cycles_parallel(infile, njobs):
+        profile.add(nodes, lengths)
+
+    return profile
+
+
+def score_profile(profile, scoring_functions, maxloops=(None,)):
+    return {(name, K): profile.scores(scoring_function, K)
+            for name, scoring_function in scoring_functions.items()
+            for K in maxloops}
+
+
+def score_numpy(infile, scoring_functions, maxloops=(None,), njobs=1):
+    """
+    Score the cycles in infile with every function in scoring_functions
+    (a dict name -> per-cycle scoring function) and every maxloop K in
+    maxloops (None means no limit), reading the file once.
+
+    With njobs > 1 the file is parsed by a pool of processes, the parsed
+    blocks are still accumulated in file order, so the result does not
+    depend on njobs.
+
+    Returns a dict (name, K) -> iterable of (node, score) sorted by node.
+    """
+    accs = {(name, K): ScoreAccumulator()
+            for name in scoring_functions
+            for K in maxloops}
+    weights = {name: np.empty(0, dtype=np.float64)
+               for name in scoring_functions}
+
+    for nodes, lengths in read_cycles_parallel(infile, njobs):
+        if lengths.size == 0:
+            continue
+
+        for name, scoring_function in scoring_functions.items():
+            weights[name] = update_weight_table(weights[name],
+                                                scoring_function,
+                                                lengths)
+
+        for K in maxloops:
+            knodes = nodes
+            klengths = lengths
+            if K is not None:
+                keep = lengths <= K
+                knodes = nodes[np.repeat(keep, lengths)]
+                klengths = lengths[keep]
+
+            for name in scoring_functions:
+                accs[(name, K)].add(knodes, klengths, weights[name])
+
+    return {key: acc.items() for key, acc in accs.items()}
+
+
+def score_python(infile, scoring_functions, maxloops=(None,)):
+    results = {(name, K): defaultdict(float)
+               for name in scoring_functions
+               for K in maxloops}
+
+    with open_cycles(infile) as infp:
+        if is_binary(infile):
+            cycles = iter_cycles(infile)
+        else:
+            infp = io.TextIOWrapper(infp, encoding='UTF-8')
+            reader = csv.reader(infp, delimiter=' ')
+            cycles = ([int(node) for node in cycle] for cycle in reader)
+
+        for cycle in cycles:
+            csize = len(cycle)
+
+            for (name, K), scores in results.items():
+                if K is not None and csize > K: continue
+
+                score_cycle(scores, cycle, scoring_functions[name])
+
+    return {key: sorted(scores.items()) for key, scores in results.items()}
+
+
+def scoring_function_list(value):
+    """
+    Parse a comma-separated list of scoring functions, "all" selects all of
+    them.
+    """
+    if value == 'all':
+        return list(SCORING_FUNCTIONS.keys())
+
+    names = [name.strip() for name in value.split(',')]
+    for name in names:
+        if name not in SCORING_FUNCTIONS:
+            raise argparse.ArgumentTypeError(
+                'invalid scoring function: {} (choose from {}, all)'
+                .format(name, ', '.join(SCORING_FUNCTIONS.keys())))
+
+    return names
+
+
+def weight_function(value):
+    """
+    Build a scoring function from a Python expression in n (the cycle
+    length), e.g. "n**-2.5" or "exp(-n)/n" (the names in the math module are
+    available), or from a "module:function" entry point taking n.
+    """
+    if regex_entry_point.match(value):
+        module_name, attrs = value.split(':')
+        try:
+            weight = importlib.import_module(module_name)
+            for attr in attrs.split('.'):
+                weight = getattr(weight, attr)
+        except (ImportError, AttributeError) as err:
+            raise argparse.ArgumentTypeError(
+                'invalid weight entry point {}: {}'.format(value, err))
+    else:
+        try:
+            code = compile(value, '<weight>', 'eval')
+        except SyntaxError as err:
+            raise argparse.ArgumentTypeError(
+                'invalid weight expression {}: {}'.format(value, err))
+
+        def weight(csize):
+            namespace = dict(WEIGHT_NAMESPACE, n=csize)
+            return eval(code, {'__builtins__': {}}, namespace)
+
+    if not callable(weight):
+        raise argparse.ArgumentTypeError(
+            'invalid weight entry point {}: not callable'.format(value))
+
+    return weight
+
+
+def maxloop_list(value):
+    """
+    Parse a comma-separated list of positive maxloop values.
+    """
+    try:
+        maxloops = [int(K) for K in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'invalid maxloop list: {}'.format(value))
+
+    if any(K <= 0 for K in maxloops):
+        raise argparse.ArgumentTypeError(
+            'maxloop values must be positive, got: {}'.format(value))
+
+    return sorted(set(maxloops))
+
+
+def output_path(output, scoring_function, maxloop):
+    if maxloop is None:
+        maxloop = 'nolimit'
+
+    return pathlib.Path(output.as_posix()
+                        .replace(OUTPUT_PLACEHOLDER, scoring_function)
+                        .replace(MAXLOOP_PLACEHOLDER, str(maxloop)))
+
+
+def rank_scores(scores, order='id', top=None):
+    """
+    Round the (node, score) pairs in scores (sorted by node) to NDIGITS and
+    return them sorted by node (order='id') or by descending rounded score,
+    ties broken by ascending node (order='score').
+
+    If top is given only the top best nodes, with the same ordering, are
+    kept; they are selected with a partition, without sorting all the
+    scores.
+    """
+    scores = list(scores)
+    nids = np.array([nid for nid, _ in scores], dtype=np.int64)
+    rounded = np.array([round(score, NDIGITS) for _, score in scores],
+                       dtype=np.float64)
+    del scores
+
+    if top is not None and top <= 0:
+        nids = nids[:0]
+        rounded = rounded[:0]
+    elif top is not None and top < nids.size:
+        kth = nids.size - top
+        threshold = np.partition(rounded, kth)[kth]
+
+        better = np.flatnonzero(rounded > threshold)
+        tied = np.flatnonzero(rounded == threshold)
+        keep = np.sort(np.concatenate((better, tied[:top-better.size])))
+
+        nids = nids[keep]
+        rounded = rounded[keep]
+
+    if order == 'score':
+        idx = np.lexsort((nids, -rounded))
+        nids = nids[idx]
+        rounded = rounded[idx]
+
+    return zip(nids.tolist(), rounded.tolist())
+
+
+def write_scores(outfile, scores):
+    for nid, rounded_score in scores:
+        outfile.write("score({}): {}\n".format(nid, rounded_score))
+
+
+def write_binary(outpath, scores, scoring_function, K=None, source=None):
+    nids, rounded = zip(*scores) if scores else ((), ())
+    write_binary_scores(outpath,
+                        np.array(nids, dtype=np.int64),
+                        np.array(rounded, dtype=np.float64),
+                        algorithm='looprank.f{}'.format(scoring_function),
+                        K=K,
+                        source=source)
+
+
 if __name__ == '__main__':
     desc = 'Assign score to pageloop cyles.'
     parser = argparse.ArgumentParser(description=desc)
 
     parser.add_argument('FILE',
                         type=pathlib.Path,
-                        help='Input file (w/ pageloop cycles).')
-    parser.add_argument('-k', '--maxloop',
+                        help='Input file (w/ pageloop cycles), in text or '
+                             'binary (see cyclefile.py) format. "-" reads '
+                             'text cycles from stdin, e.g. piped from the '
+                             'pageloop engine.')
+    parser.add_argument('-b', '--backend',
+                        choices=BACKENDS,
+                        default='numpy',
+                        help='Scoring backend, "python" is the original '
+                             'per-cycle implementation [default: numpy].')
+    parser.add_argument('--format',
+                        choices=FORMATS,
+                        default='text',
+                        help='Output format, binary files (see '
+                             'scorefile.py) are always sorted by node id '
+                             '[default: text].')
+    parser.add_argument('-j', '--jobs',
                         type=int,
+                        default=1,
+                        help='Number of processes used to parse a text '
+                             'input file, the output does not depend on '
+                             'it. Only for the numpy backend '
+                             '[default: 1].')
+    parser.add_argument('-k', '--maxloop',
+                        type=maxloop_list,
                         dest='K',
-                        help='Limit cycles to this length (K) '
-                             '[default: No limit].')
+                        help='Limit cycles to this length (K), a '
+                             'comma-separated list of values computes one '
+                             'output for each of them with one read of the '
+                             'input [default: No limit].')
     parser.add_argument('-o', '--output',
                         type=pathlib.Path,
-                        help='output file name [default: stdout].')
+                        help='output file name, with more than one scoring '
+                             'function (maxloop) it must contain "{}" ("{}") '
+                             'which is replaced by the function name '
+                             '(maxloop value) [default: stdout].'
+                             .format(OUTPUT_PLACEHOLDER, MAXLOOP_PLACEHOLDER))
+    parser.add_argument('-p', '--profile',
+                        type=pathlib.Path,
+                        help='Per-node cycle-length profile (.npz). If it '
+                             'exists and was computed from FILE, scores are '
+                             'computed from it without reading FILE (which '
+                             'may then be missing), otherwise it is created '
+                             'from FILE. With stdin it is always created. '
+                             'Scores from the profile may differ from the '
+                             'ones computed on the cycles only in floating '
+                             'point rounding. Only for the numpy backend.')
+    parser.add_argument('--order',
+                        choices=ORDERS,
+                        default='id',
+                        help='Sort the output by node id or by descending '
+                             'score (ties sorted by node id) [default: id].')
+    parser.add_argument('--top',
+                        type=int,
+                        help='Output only the TOP nodes with the highest '
+                             'score [default: all].')
     parser.add_argument('-f', '--scoring-function',
-                        choices=list(SCORING_FUNCTIONS.keys()),
-                        default='linear',
-                        help='Scoring function [default: linear]')
+                        type=scoring_function_list,
+                        help='Scoring function, a comma-separated list of '
+                             'functions or "all" to compute all of them '
+                             'with one read of the input. '
+                             'Choices: {{{}}} [default: linear, unless '
+                             '--weight is given]'
+                             .format(', '.join(SCORING_FUNCTIONS.keys())))
+    parser.add_argument('-w', '--weight',
+                        type=weight_function,
+                        help='Custom scoring function: a Python expression '
+                             'in the cycle length n (e.g. "n**-2.5", math '
+                             'functions are available) or a '
+                             '"module:function" entry point called with n. '
+                             'It is evaluated once for each cycle length.')
+    parser.add_argument('--weight-name',
+                        default='custom',
+                        help='Name of the --weight scoring function in the '
+                             'output file name [default: custom].')
 
     args = parser.parse_args()
 
     infile = args.FILE
     output = args.output
-    K = args.K
-    scoring_function = SCORING_FUNCTIONS[args.scoring_function]
+    maxloops = args.K if args.K is not None else [None]
+    scoring_function_names = args.scoring_function
+    if scoring_function_names is None:
+        scoring_function_names = [] if args.weight is not None else ['linear']
 
-    scores = defaultdict(float)
-    with safe_path(infile).open('r', encoding='UTF-8') as infp:
-        reader = csv.reader(infp, delimiter=' ')
+    scoring_functions = {name: SCORING_FUNCTIONS[name]
+                         for name in scoring_function_names}
+    if args.weight is not None:
+        if args.weight_name in scoring_functions:
+            parser.error('--weight-name {} clashes with a scoring function.'
+                         .format(args.weight_name))
+        scoring_functions[args.weight_name] = args.weight
 
-        for cycle in reader:
-            csize = len(cycle)
-            if K is not None and csize > K: continue
+    for values, placeholder, what in \
+            ((scoring_functions, OUTPUT_PLACEHOLDER, 'scoring function'),
+             (maxloops, MAXLOOP_PLACEHOLDER, 'maxloop')):
+        if len(values) > 1 and \
+                (output is None or placeholder not in output.as_posix()):
+            parser.error('with more than one {} the output file name must '
+                         'contain "{}".'.format(what, placeholder))
 
-            cycle = [int(node) for node in cycle]
+    if args.top is not None and args.top < 1:
+        parser.error('--top must be positive.')
 
-            scoring_function(scores, cycle)
+    njobs = args.jobs
+    if njobs < 1:
+        parser.error('the number of jobs must be positive.')
+    if njobs > 1 and args.backend == 'python':
+        parser.error('-j/--jobs is supported only by the numpy backend.')
+    if args.profile is not None and args.backend == 'python':
+        parser.error('-p/--profile is supported only by the numpy backend.')
 
-    outfile = None
-    if output is None:
-        outfile = sys.stdout
+    if args.profile is not None:
+        profile = None
+        if not is_stdin(infile) and safe_path(args.profile).exists():
+            profile = CycleProfile.load(args.profile, source=infile)
+        if profile is None:
+            profile = build_profile(infile, njobs)
+            profile.save(args.profile, source=infile)
+
+        results = score_profile(profile, scoring_functions, maxloops)
+    elif args.backend == 'numpy':
+        results = score_numpy(infile, scoring_functions, maxloops, njobs)
     else:
-        outfile = safe_path(output).open('w+', encoding='UTF-8')
+        results = score_python(infile, scoring_functions, maxloops)
 
-    for nid, score in sorted(scores.items()):
-        rounded_score = round(score, NDIGITS)
-        outfile.write("score({}): {}\n".format(nid, rounded_score))
+    source = None
+    if args.format == 'binary' and not is_stdin(infile) and \
+            safe_path(infile).exists() and is_binary(infile):
+        source = CycleFile(infile).source
+
+    for (name, K), scores in results.items():
+        scores = rank_scores(scores, order=args.order, top=args.top)
+        if args.format == 'binary':
+            outpath = STDIN
+            if output is not None:
+                outpath = output_path(output, name, K)
+            write_binary(outpath, list(scores), name, K=K, source=source)
+        elif output is None:
+            write_scores(sys.stdout, scores)
+        else:
+            outpath = output_path(output, name, K)
+            with safe_path(outpath).open('w+', encoding='UTF-8') as outfile:
+                write_scores(outfile, scores)
 
     exit(0)
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 
 import os
-import re
 import sys
 import csv
-import tqdm
 import math
 import pathlib
 import argparse
-import subprocess
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from evaluation import CONFIG_HEADER, DEFAULT_NDCG_K, POSITION_METRICS, \
+    SCORING_FUNCTIONS, Ranking, comparison_configs, evaluate, \
+    format_filename, metric_columns, position_scores, read_comparison_file
 
 COMPARE_FILENAMES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{maxloop}.2018-03-01.compare.toppr.txt',
                      'ssppr': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.2018-03-01.compare.toppr.txt',
@@ -21,22 +26,6 @@ COMPARISON_FILE_HEADER = ('pos', 'title', 'page_id', 'score')
 OUTPUT_FILENAME = 'enwiki.comparison.{algo}.{title}.{maxloop}.2018-03-01.toppr.txt'
 
 
-# sanitize regex
-sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
-sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
-                     re.IGNORECASE)
-sanre03 = re.compile(r'^\.*$')
-sanre04 = re.compile(r'^$')
-
-def sanitize(filename: str) -> str:
-    res = sanre01.sub('', filename)
-    res = sanre02.sub('', res)
-    res = sanre03.sub('', res)
-    res = sanre04.sub('', res)
-
-    return res
-
-
 # Processing non-UTF-8 Posix filenames using Python pathlib?
 # https://stackoverflow.com/a/45724695/2377454
 def safe_path(path: pathlib.Path) -> pathlib.Path:
@@ -44,101 +33,95 @@ def safe_path(path: pathlib.Path) -> pathlib.Path:
     return pathlib.Path(os.fsdecode(encoded_path))
 
 
-# How to get line count cheaply in Python?
-# https://stackoverflow.com/a/45334571/2377454
-def count_file_lines(file_path: pathlib.Path) -> int:
+def read_toppr_positions(toppr_file, limit):
     """
-    Counts the number of lines in a file using wc utility.
-    :param file_path: path to file
-    :return: int, no of lines
+    Return the position of each page id in the first limit lines of the top
+    list (the first one if it is listed more than once).
     """
+    toppr_pos = dict()
+    with safe_path(toppr_file).open('r', encoding='utf-8') as topprfp:
+        reader = csv.reader(topprfp, delimiter='\t')
+        for pos, line in enumerate(itertools.islice(reader, limit), start=1):
+            toppr_pos.setdefault(int(line[1]), pos)
 
-    num = subprocess.check_output(
-        ['wc', '-l', safe_path(file_path).as_posix()])
-    num = num.decode('utf-8').strip().split(' ')
-    return int(num[0])
-
-
-def read_comparison_file(algo,
-                         alpha,
-                         scoring_function,
-                         title,
-                         maxloop,
-                         wholenetwork,
-                         comparison_dir):
-
-    if algo != 'looprank' and wholenetwork:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  alpha=alpha,
-                                  title=title,
-                                  maxloop='wholenetwork'
-                                  )
-                          )
-    else:
-        input_filename = (COMPARE_FILENAMES[algo]
-                          .format(algo=algo,
-                                  alpha=alpha,
-                                  title=title,
-                                  maxloop=maxloop,
-                                  scoring_function=scoring_function
-                                  )
-                          )
-
-    input_file = comparison_dir/input_filename
-
+    return toppr_pos
 
-    links = {}
-    try:
-        with input_file.open('r') as infp:
-            reader = csv.reader(infp, delimiter='\t')
 
-            # ['5', 'Bijbehara railway station', '11119524', '2.41667']
-            for line in reader:
-                data = dict()
-                data['pos'] = int(line[0])
-                data['title'] = line[1]
-                data['score'] = float(line[3])
+# per-link output table header
+LINKS_HEADER = (('title',) + CONFIG_HEADER +
+                ('link_title', 'page_id', 'pos', 'linear', 'log',
+                 'toppr_pos'))
 
-                page_id = int(line[2])
 
-                links[page_id] = data
-    except FileNotFoundError:
-        print("File {} not found.".format(input_file), file=sys.stderr)
+def results_header(options):
+    return (('title',) + CONFIG_HEADER +
+            metric_columns(options.metric, k=options.ndcg_k) +
+            ('n',))
 
-    return links
 
+def evaluate_title(title, configs, options, toppr_pos):
+    """
+    Evaluate the links of title in the comparison file of each
+    configuration that are in the top PageRank list (toppr_pos, page id ->
+    position) and at most at position options.limit_algo, every file is
+    read once.
 
-def compute_score(links, use_log=False):
-    pos = 0
-    score = 0.0
-    title = ''
-    try:
-        pos = links[lid]['pos']
-        title = links[lid]['title']
-    except KeyError:
-        pass
-
-    if use_log:
-
-      try:
-        score = 1.0/(1+math.log(pos))
-      except ValueError:
-        score = 0.0
-
-    else:
-
-      try:
-          score = 1.0/pos
-      except ZeroDivisionError:
-          score = 0.0
-
-    return pos, score, title
+    Return a list of (config, row, link rows, error).
+    """
+    results = []
+    for config in configs:
+        input_file = (options.comparison_dir /
+                      format_filename(COMPARE_FILENAMES, config, title))
+        try:
+            ids, positions, scores, link_titles = \
+                read_comparison_file(input_file)
+        except (OSError, ValueError, IndexError) as err:
+            results.append((config, None, None, str(err)))
+            continue
+
+        intop = np.array([lid in toppr_pos for lid in ids.tolist()],
+                         dtype=bool)
+        selected = intop & (positions <= options.limit_algo)
+        ids = ids[selected]
+        positions = positions[selected]
+        scores = scores[selected]
+        link_titles = [link_title
+                       for link_title, keep in zip(link_titles, selected)
+                       if keep]
+
+        ranking = Ranking.from_comparison(ids, positions, scores)
+        row = ((title,) + config +
+               evaluate(ranking, options.metric, k=options.ndcg_k) +
+               (len(ranking),))
+
+        link_rows = None
+        if options.links_output is not None:
+            link_rows = [(title,) + config + link
+                         for link in zip(link_titles,
+                                         ids.tolist(),
+                                         positions.tolist(),
+                                         position_scores(positions).tolist(),
+                                         position_scores(positions,
+                                                         use_log=True)
+                                         .tolist(),
+                                         [toppr_pos[lid]
+                                          for lid in ids.tolist()])]
+
+        results.append((config, row, link_rows, None))
+
+    return results
+
+
+def evaluate_title_safe(task):
+    title, configs, options, toppr_pos = task
+    return title, evaluate_title(title, configs, options, toppr_pos)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
-        description='Compute comparison score between LR and SSPPR.')
+        description='Compute the evaluation scores of the top PageRank '
+                    'links for a list of titles, algorithms and '
+                    'parameters.')
     parser.add_argument('-t', '--toppr',
                         type=pathlib.Path,
                         required=True,
@@ -158,24 +141,27 @@ if __name__ == '__main__':
                         type=str,
                         choices=ALLOWED_ALGOS,
                         metavar='ALGO',
-                        default='looprank',
-                        help=('Name of the  algorithm to use. '
+                        nargs='+',
+                        default=['looprank'],
+                        help=('Name of the algorithms to evaluate. '
                               'Choices: {{{}}}. '
                               '[default: looprank].'
                               ).format(', '.join(ALLOWED_ALGOS))
                         )
     parser.add_argument('--alpha',
                         type=float,
-                        default=0.85,
-                        help='Alpha PageRank damping factor '
+                        nargs='+',
+                        default=[0.85],
+                        help='Alpha PageRank damping factors, for the '
+                             'algorithms other than LoopRank '
                              '[default: 0.85].'
                         )
     parser.add_argument('-f', '--scoring-function',
                         type=str,
-                        default='linear',
-                        choices=['linear', 'square', 'cube', 'nlogn',
-                                 'expe', 'exp10'],
-                        help='LoopRank scoring function '
+                        nargs='+',
+                        default=['linear'],
+                        choices=SCORING_FUNCTIONS,
+                        help='LoopRank scoring functions '
                              '[default: linear].'
                         )
     parser.add_argument('-i', '--input',
@@ -183,20 +169,56 @@ if __name__ == '__main__':
                         help='File with page titles '
                              '[default: read from stdin].'
                         )
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of titles processed in parallel '
+                             '[default: 1].'
+                        )
     parser.add_argument('-k', '--maxloop',
                         type=int,
-                        default=4,
-                        help='Max loop length [default: 4].'
+                        nargs='+',
+                        default=[4],
+                        help='Max loop lengths [default: 4].'
                         )
-    parser.add_argument('--log',
-                        action='store_true',
-                        help='Use 1/log(n) to compute the comparison score instead of 1/n.'
+    parser.add_argument('-m', '--metric',
+                        type=str,
+                        choices=POSITION_METRICS,
+                        metavar='METRIC',
+                        nargs='+',
+                        default=['linear', 'log'],
+                        help=('Metrics to compute (see evaluation.py), '
+                              'linear is the sum of 1/n and log the sum of '
+                              '1/(1+log(n)) over the positions n of the '
+                              'links. Choices: {{{}}}. '
+                              '[default: linear log].'
+                              ).format(', '.join(POSITION_METRICS))
+                        )
+    parser.add_argument('--ndcg-k',
+                        type=int,
+                        default=DEFAULT_NDCG_K,
+                        help='Number of top positions for NDCG '
+                             '[default: {}].'.format(DEFAULT_NDCG_K)
                         )
     parser.add_argument('--comparison-dir',
                         type=pathlib.Path,
                         default=pathlib.Path('.'),
-                        help='File with page titles '
-                             '[default: read from stdin].'
+                        help='Directory with the comparison files '
+                             '[default: .].'
+                        )
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        help='Output file with the results table, one row '
+                             'per title and configuration: title, {}, the '
+                             'columns of each metric, n (number of links) '
+                             '[default: stdout].'
+                             .format(', '.join(CONFIG_HEADER))
+                        )
+    parser.add_argument('--links-output',
+                        type=pathlib.Path,
+                        help='Also write the score of each link to this '
+                             'file, one row per title, configuration and '
+                             'link: {}.'.format(', '.join(LINKS_HEADER))
                         )
     parser.add_argument('-w', '--wholenetwork',
                         action='store_true',
@@ -205,8 +227,17 @@ if __name__ == '__main__':
                         )
 
     args = parser.parse_args()
-    comparison_dir = args.comparison_dir
-    algo = args.algo
+
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
+    if args.ndcg_k < 1:
+        parser.error('--ndcg-k must be positive.')
+    if args.limit_toppr < 1:
+        parser.error('--limit-toppr must be positive.')
+
+    configs = comparison_configs(args.algo, args.scoring_function,
+                                 args.alpha, args.maxloop,
+                                 wholenetwork=args.wholenetwork)
 
     print('* Read input. ', file=sys.stderr)
     infile = None
@@ -216,80 +247,67 @@ if __name__ == '__main__':
         infile = sys.stdin
 
     titles = [_.strip() for _ in infile.readlines()]
+    titles = [title for title in titles if title]
 
-    # print('* Read the "top indegree" file: ', file=sys.stderr)
-    toppr_file = args.toppr
-    topprlen = count_file_lines(toppr_file)
-    toppr = list()
-    with tqdm.tqdm(total=topprlen) as pbar:
-        with safe_path(toppr_file).open('r', encoding='utf-8') as topprfp:
-            reader = csv.reader(topprfp, delimiter='\t')
-            for l in reader:
-                title = l[0].replace('_', ' ')
-                pageid = int(l[1])
-
-                toppr.append((title,pageid))
-                pbar.update(1)
-
-    limit_toppr = args.limit_toppr
-    assert limit_toppr > 0, '--limit-toppr must be positive'
-    # toppr_limit_set = set([el[0] for el in toppr[:limit_toppr]])
-    toppr_limit_set = set([el[1] for el in toppr[:limit_toppr]])
-    toppr_pos = dict([(el[1][0],el[0]+1) for el in enumerate(toppr[:limit_toppr])])
-
-    limit_algo = args.limit_algo
+    print('* Read the "top indegree" file. ', file=sys.stderr)
+    toppr_pos = read_toppr_positions(args.toppr, args.limit_toppr)
 
     print('* Processing titles: ', file=sys.stderr)
-    for title in titles:
-        score = 0.0
-
-        scores = dict()
-        pos = dict()
-        print('-'*80)
-        print('    - {}'.format(title), file=sys.stderr)
-
-        links_algo = read_comparison_file(algo=algo,
-                                           alpha=args.alpha,
-                                           scoring_function=args.scoring_function,
-                                           title=title,
-                                           maxloop=args.maxloop,
-                                           wholenetwork=args.wholenetwork,
-                                           comparison_dir=comparison_dir
-                                           )
-
-        links_set = set(links_algo.keys())
-        for lid in links_set:
-            pos_algo, score_algo, title_algo = compute_score(links_algo, use_log=args.log)
-
-            # if pos_algo <= limit_algo and title_algo in toppr_limit_set:
-            if pos_algo <= limit_algo and lid in toppr_limit_set:
-                score += score_algo
-
-                title_link = title_algo
-                scores[title_link] = score_algo
-                pos[title_link] = pos_algo
-
-        function='linear'
-        if args.log:
-          function='log'
-
-        outfile = sanitize(
-            'enwiki.evaluate.{algo}.{title}.2018-03-01.scores.{function}.txt'
-            .format(title=title.replace(' ', '_'),
-                    algo=algo,
-                    function=function
-                    )
-            )
-
-        with open(outfile, 'w+') as outfp:
-            writer = csv.writer(outfp, delimiter='\t')
-            writer.writerow((score,))
-            for link_title in scores:
-                writer.writerow((scores[link_title],
-                                 link_title,
-                                 pos[link_title],
-                                 toppr_pos[link_title]
-                                 )
-                                )
-
-    exit(0)
+    tasks = [(title, configs, args, toppr_pos) for title in titles]
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        # imap keeps the rows in the order of the titles
+        results = pool.imap(evaluate_title_safe, tasks)
+    else:
+        pool = None
+        results = map(evaluate_title_safe, tasks)
+
+    outfile = sys.stdout
+    if args.output is not None:
+        outfile = args.output.open('w+')
+
+    writer = csv.writer(outfile, delimiter='\t')
+    writer.writerow(results_header(args))
+
+    links_writer = None
+    if args.links_output is not None:
+        linksfile = args.links_output.open('w+')
+        links_writer = csv.writer(linksfile, delimiter='\t')
+        links_writer.writerow(LINKS_HEADER)
+
+    failures = []
+    for count, (title, title_results) in enumerate(results, start=1):
+        for config, row, link_rows, error in title_results:
+            if error is None:
+                writer.writerow(row)
+                if links_writer is not None:
+                    links_writer.writerows(link_rows)
+            else:
+                failures.append((title, config, error))
+
+        print('[{}/{}] {}'.format(count, len(titles), title),
+              file=sys.stderr)
+
+    if args.output is not None:
+        outfile.close()
+    if links_writer is not None:
+        linksfile.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    ntasks = len(titles)*len(configs)
+    print('Processed {} titles x {} configurations: {} done, {} failed.'
+          .format(len(titles), len(configs), ntasks-len(failures),
+                  len(failures)),
+          file=sys.stderr)
+
+    for title, config, error in failures:
+        print('Error: could not process {} ({}): {}'
+              .format(title, ', '.join(str(field) for field in config
+                                       if field is not None),
+                      error),
+              file=sys.stderr)
+
+    exit(1 if failures else 0)
@@ -1,38 +1,191 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import csv
 import argparse
 import pathlib
-from itertools import groupby
+import multiprocessing
+
+import numpy as np
+
+from cyclefile import read_cycles
+
+# per-node output file suffix and header
+NODES_SUFFIX = '.nodes.tsv'
+NODES_HEADER = ('node', 'cycles')
+
+
+# Processing non-UTF-8 Posix filenames using Python pathlib?
+# https://stackoverflow.com/a/45724695/2377454
+def safe_path(path: pathlib.Path) -> pathlib.Path:
+    encoded_path = path.as_posix().encode('utf-8')
+    return pathlib.Path(os.fsdecode(encoded_path))
+
+
+def add_counts(total, counts):
+    """
+    Add the array counts to the array total, growing it if needed.
+    """
+    if counts.size > total.size:
+        counts = counts.copy()
+        counts[:total.size] += total
+        return counts
+
+    total[:counts.size] += counts
+    return total
+
+
+def merge_node_counts(nodes, counts, blocks):
+    """
+    Add one to the count of each node in the arrays in blocks, nodes is
+    sorted and counts[i] is the count of nodes[i]. Return the merged nodes
+    and counts.
+    """
+    block_nodes = np.concatenate([nodes] + blocks)
+    if block_nodes.size == 0:
+        return nodes, counts
+
+    block_counts = np.concatenate(
+        [counts, np.ones(block_nodes.size - nodes.size, dtype=np.int64)])
+
+    order = np.argsort(block_nodes, kind='stable')
+    block_nodes = block_nodes[order]
+    starts = np.flatnonzero(np.r_[True, block_nodes[1:] != block_nodes[:-1]])
+
+    return (block_nodes[starts],
+            np.add.reduceat(block_counts[order], starts))
+
+
+def count_file(infile, nodes_dir=None):
+    """
+    Stream the cycles in infile and return the histogram of their lengths.
+
+    If nodes_dir is given, write there a TSV file with the number of cycles
+    each node is part of.
+    """
+    histogram = np.zeros(0, dtype=np.int64)
+    nodes = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+
+    # blocks not counted yet, they are merged all at once when they are
+    # larger than the merged counts (and at the end), so the merges cost is
+    # amortized over the blocks
+    pending = []
+    pending_size = 0
+
+    for block_nodes, lengths in read_cycles(infile):
+        histogram = add_counts(histogram, np.bincount(lengths))
+        if nodes_dir is not None:
+            pending.append(block_nodes)
+            pending_size += block_nodes.size
+            if pending_size > nodes.size:
+                nodes, counts = merge_node_counts(nodes, counts, pending)
+                pending = []
+                pending_size = 0
+
+    if nodes_dir is not None:
+        nodes, counts = merge_node_counts(nodes, counts, pending)
+
+        nodes_file = nodes_dir/(infile.name + NODES_SUFFIX)
+        with safe_path(nodes_file).open('w+', encoding='UTF-8') as outfp:
+            writer = csv.writer(outfp, delimiter='\t')
+            writer.writerow(NODES_HEADER)
+            writer.writerows(zip(nodes.tolist(), counts.tolist()))
+
+    return histogram
+
+
+def count_file_safe(infile, nodes_dir=None):
+    try:
+        return infile, count_file(infile, nodes_dir), None
+    except (OSError, ValueError) as err:
+        return infile, None, str(err)
 
 
 if __name__ == '__main__':
 
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        description='Count pageloop cycles by length.')
     parser.add_argument("file",
                         type=pathlib.Path,
-                        help='Input file.')
+                        nargs='*',
+                        help='Input files (w/ pageloop cycles), in text or '
+                             'binary (see cyclefile.py) format.')
+    parser.add_argument('-i', '--input',
+                        type=pathlib.Path,
+                        help='File with the list of input files, one per '
+                             'line ("-" reads it from stdin).')
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=1,
+                        help='Number of files processed in parallel '
+                             '[default: 1].')
+    parser.add_argument('-n', '--nodes-dir',
+                        type=pathlib.Path,
+                        help='Write for each input file a TSV file '
+                             '<file>{} with the number of cycles each node '
+                             'is part of in this directory.'
+                             .format(NODES_SUFFIX))
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        help='Output file [default: stdout].')
 
     args = parser.parse_args()
 
-    with args.file.open('r') as infile:
-        loops = []
-        for line in infile.readlines():
-            data = [int(el) for el in line.strip().split()]
-            loops.append(data)
+    files = list(args.file)
+    if args.input is not None:
+        if args.input.as_posix() == '-':
+            listfp = sys.stdin
+        else:
+            listfp = safe_path(args.input).open('r', encoding='UTF-8')
+        with listfp:
+            files.extend(pathlib.Path(line.strip())
+                         for line in listfp
+                         if line.strip())
+
+    if not files:
+        parser.error('no input files.')
+    if args.jobs < 1:
+        parser.error('the number of jobs must be positive.')
+
+    tasks = [(infile, args.nodes_dir) for infile in files]
+    if args.jobs > 1:
+        with multiprocessing.Pool(args.jobs) as pool:
+            results = pool.starmap(count_file_safe, tasks)
+    else:
+        results = [count_file_safe(*task) for task in tasks]
+
+    maxlen = max([histogram.size - 1
+                  for _, histogram, _ in results
+                  if histogram is not None] + [0])
+
+    outfile = sys.stdout
+    if args.output is not None:
+        outfile = safe_path(args.output).open('w+', encoding='UTF-8')
+
+    # one row per file: file, total number of cycles, number of cycles of
+    # length 1, 2, ..., maxlen
+    writer = csv.writer(outfile, delimiter='\t')
+    writer.writerow(['file', 'total'] +
+                    ['len{}'.format(csize)
+                     for csize in range(1, maxlen+1)])
 
-    loopslen = [len(loop) for loop in loops]
+    failed = 0
+    for infile, histogram, error in results:
+        if histogram is None:
+            print('Error: could not process file {}: {}'
+                  .format(infile, error),
+                  file=sys.stderr)
+            failed += 1
+            continue
 
-    # How to count the frequency of the elements in a list?
-    # https://stackoverflow.com/a/55437321/2377454
-    results = {value: len(list(freq))
-               for value, freq in groupby(sorted(loopslen))}
+        histogram = add_counts(np.zeros(maxlen+1, dtype=np.int64),
+                               histogram)
+        writer.writerow([infile, int(histogram.sum())] +
+                        histogram[1:].tolist())
 
+    if args.output is not None:
+        outfile.close()
 
-    print('{two}\t{three}\t{four}\t{file}'
-          .format(two=results.get(2, 0),
-                  three=results.get(3, 0),
-                  four=results.get(4, 0),
-                  file=args.file
-                  )
-          )
-    exit(0)
+    exit(1 if failed else 0)
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Read and write pageloop cycle files.
+#
+# The pageloop engines write one cycle per line, as space-separated node ids
+# (text format). This module also defines a compact binary format:
+#
+#   header   <8s I i q Q Q>: magic, version, K (-1 if unknown),
+#                            source node (-1 if unknown), number of cycles,
+#                            number of node ids
+#   nodes    uint32[number of node ids], the cycles one after the other
+#   lengths  uint32[number of cycles], the length of each cycle
+#
+# all values are little-endian. The lengths are stored after the nodes so
+# that a file can be written in a single pass and the header updated at the
+# end; the cycle offsets are obtained with one cumulative sum, so the
+# reader can memory-map the file and expose every cycle as a view.
+#
+# Usage (text to binary conversion):
+#   cyclefile.py CYCLES.txt -o CYCLES.bin [-s SOURCE] [-k K]
+
+import os
+import sys
+import struct
+import argparse
+import pathlib
+import contextlib
+import collections
+import multiprocessing
+
+import numpy as np
+
+MAGIC = b'PLCYCLES'
+VERSION = 1
+HEADER = struct.Struct('<8sIiqQQ')
+HEADER_SIZE = HEADER.size
+
+NODE_DTYPE = np.dtype('<u4')
+LENGTH_DTYPE = np.dtype('<u4')
+
+# size (in bytes) of the blocks read from text cycle files
+CHUNK_SIZE = 64*1024*1024
+
+# number of cycles in each block read from binary cycle files
+CHUNK_CYCLES = 4*1024*1024
+
+# cycle file name for the standard input
+STDIN = '-'
+
+SPACE = ord(' ')
+NEWLINE = ord('\n')
+
+
+# Processing non-UTF-8 Posix filenames using Python pathlib?
+# https://stackoverflow.com/a/45724695/2377454
+def safe_path(path: pathlib.Path) -> pathlib.Path:
+    encoded_path = path.as_posix().encode('utf-8')
+    return pathlib.Path(os.fsdecode(encoded_path))
+
+
+def is_stdin(infile):
+    return infile.as_posix() == STDIN
+
+
+def is_binary(infile):
+    """
+    Tell if infile is a binary cycle file, stdin is always read as text.
+    """
+    if is_stdin(infile):
+        return False
+
+    with safe_path(infile).open('rb') as infp:
+        return infp.read(len(MAGIC)) == MAGIC
+
+
+def parse_cycles(buf):
+    """
+    Parse a block of complete lines from a text cycle file.
+
+    Returns a flat array with the nodes of all the cycles and an array with
+    the length of each cycle, so that the nodes of the i-th cycle are
+    nodes[offsets[i]:offsets[i+1]] with offsets = [0, *cumsum(lengths)].
+    Empty lines are skipped.
+    """
+    if not buf:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    if buf[-1] != NEWLINE:
+        buf = buf + b'\n'
+
+    data = np.frombuffer(buf, dtype=np.uint8)
+    newlines = np.flatnonzero(data == NEWLINE)
+    spaces = np.flatnonzero(data == SPACE)
+
+    starts = np.empty_like(newlines)
+    starts[0] = 0
+    starts[1:] = newlines[:-1] + 1
+
+    # a line with s separators has s+1 nodes
+    nspaces = np.diff(np.searchsorted(spaces, newlines), prepend=0)
+    lengths = nspaces + 1
+    lengths = lengths[newlines > starts]
+    if lengths.size == 0:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    nodes = np.fromstring(buf, dtype=np.int64, sep=' ')
+    if nodes.size != lengths.sum():
+        raise ValueError('Malformed cycle file: expected {} nodes, '
+                         'parsed {}.'.format(lengths.sum(), nodes.size))
+
+    return nodes, lengths
+
+
+def read_text_cycles(infp, chunk_size=CHUNK_SIZE, size=None):
+    """
+    Read a binary file object with text pageloop cycles in blocks of about
+    chunk_size bytes, splitting on line boundaries, and yield the parsed
+    (nodes, lengths) for each block. If size is given, at most size bytes
+    are read.
+    """
+    rest = b''
+    while True:
+        toread = chunk_size
+        if size is not None:
+            toread = min(chunk_size, size)
+            size -= toread
+
+        block = infp.read(toread) if toread > 0 else b''
+        if not block:
+            break
+
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        rest = block[cut:]
+
+        if cut > 0:
+            yield parse_cycles(block[:cut])
+
+    if rest:
+        yield parse_cycles(rest)
+
+
+class CycleFile:
+    """
+    Memory-mapped binary cycle file.
+
+    nodes and lengths are read-only views on the file, cycle i is
+    cycles[i] == nodes[offsets[i]:offsets[i+1]] and is not copied.
+    """
+
+    def __init__(self, path):
+        path = pathlib.Path(path)
+        with safe_path(path).open('rb') as infp:
+            header = infp.read(HEADER_SIZE)
+
+        if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a binary cycle file.'.format(path))
+
+        (_, version, K, source, ncycles, nnodes) = HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('Unsupported cycle file version {} in {}.'
+                             .format(version, path))
+
+        self.path = path
+        self.K = K if K >= 0 else None
+        self.source = source if source >= 0 else None
+        self.ncycles = ncycles
+        self.nnodes = nnodes
+
+        data = np.memmap(safe_path(path).as_posix(), dtype=np.uint8,
+                         mode='r')
+        nodes_end = HEADER_SIZE + nnodes*NODE_DTYPE.itemsize
+        lengths_end = nodes_end + ncycles*LENGTH_DTYPE.itemsize
+        if data.size != lengths_end:
+            raise ValueError('Truncated or corrupted cycle file {}.'
+                             .format(path))
+
+        self.nodes = data[HEADER_SIZE:nodes_end].view(NODE_DTYPE)
+        self.lengths = data[nodes_end:lengths_end].view(LENGTH_DTYPE)
+        self._offsets = None
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            offsets = np.zeros(self.ncycles + 1, dtype=np.int64)
+            np.cumsum(self.lengths, out=offsets[1:])
+            self._offsets = offsets
+
+        return self._offsets
+
+    def __len__(self):
+        return self.ncycles
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+        return self.nodes[offsets[i]:offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(self.ncycles):
+            yield self[i]
+
+    def blocks(self, chunk_cycles=CHUNK_CYCLES, first=0, last=None):
+        """
+        Yield (nodes, lengths) views for blocks of chunk_cycles cycles,
+        for the cycles in [first, last).
+        """
+        if last is None:
+            last = self.ncycles
+
+        offsets = self.offsets
+        for start in range(first, last, chunk_cycles):
+            end = min(start + chunk_cycles, last)
+            yield (self.nodes[offsets[start]:offsets[end]],
+                   self.lengths[start:end])
+
+
+@contextlib.contextmanager
+def open_cycles(infile):
+    """
+    Open the text cycle file infile in binary mode, "-" is the standard
+    input.
+    """
+    if is_stdin(infile):
+        yield sys.stdin.buffer
+    else:
+        with safe_path(infile).open('rb') as infp:
+            yield infp
+
+
+def split_cycles(infile, nparts):
+    """
+    Split a text or binary cycle file in (at most) nparts spans of whole
+    cycles of about the same size. A span is a (start, end) range of byte
+    offsets for text files and of cycle indexes for binary files.
+    """
+    if is_binary(infile):
+        ncycles = len(CycleFile(infile))
+        bounds = [ncycles*i//nparts for i in range(nparts+1)]
+    else:
+        size = safe_path(infile).stat().st_size
+        bounds = [0]
+        with safe_path(infile).open('rb') as infp:
+            for i in range(1, nparts):
+                pos = max(size*i//nparts, bounds[-1])
+                if pos == 0:
+                    continue
+                # move to the start of the next line
+                infp.seek(pos-1)
+                infp.readline()
+                bounds.append(min(infp.tell(), size))
+        bounds.append(size)
+
+    return [(start, end)
+            for start, end in zip(bounds[:-1], bounds[1:])
+            if end > start]
+
+
+def read_cycles(infile, span=None):
+    """
+    Yield (nodes, lengths) blocks from a text or binary cycle file, "-" is
+    the standard input. If span is given (see split_cycles) only the cycles
+    in that span are read.
+    """
+    if is_binary(infile):
+        first, last = span if span is not None else (0, None)
+        yield from CycleFile(infile).blocks(first=first, last=last)
+    elif span is not None:
+        start, end = span
+        with safe_path(infile).open('rb') as infp:
+            infp.seek(start)
+            yield from read_text_cycles(infp, size=end-start)
+    else:
+        with open_cycles(infile) as infp:
+            yield from read_text_cycles(infp)
+
+
+def _parse_span(infile, span):
+    blocks = list(read_cycles(infile, span))
+    if not blocks:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    nodes, lengths = zip(*blocks)
+    return np.concatenate(nodes), np.concatenate(lengths)
+
+
+def read_cycles_parallel(infile, njobs, chunk_size=CHUNK_SIZE):
+    """
+    Like read_cycles, but text files are split in spans of about chunk_size
+    bytes that are parsed by a pool of njobs processes.
+
+    Blocks are yielded in file order and at most 2*njobs spans are in flight,
+    so memory stays bounded. Binary files need no parsing and stdin cannot
+    be split, both are read as with read_cycles.
+    """
+    if njobs <= 1 or is_stdin(infile) or is_binary(infile):
+        yield from read_cycles(infile)
+        return
+
+    size = safe_path(infile).stat().st_size
+    nspans = max(njobs, -(-size // chunk_size))
+    spans = split_cycles(infile, nspans)
+
+    with multiprocessing.Pool(njobs) as pool:
+        pending = collections.deque()
+        for span in spans:
+            pending.append(pool.apply_async(_parse_span, (infile, span)))
+            if len(pending) >= 2*njobs:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def iter_cycles(infile):
+    """
+    Yield each cycle of a text or binary cycle file as a list of ints.
+    """
+    for nodes, lengths in read_cycles(infile):
+        offsets = np.zeros(lengths.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        nodes = nodes.tolist()
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            yield nodes[start:end]
+
+
+def write_cycles(outpath, blocks, source=None, K=None):
+    """
+    Write the (nodes, lengths) blocks to the binary cycle file outpath.
+    """
+    ncycles = 0
+    nnodes = 0
+
+    lengths_path = safe_path(outpath).with_name(
+        safe_path(outpath).name + '.lengths.tmp')
+
+    try:
+        with safe_path(outpath).open('wb') as outfp, \
+                lengths_path.open('w+b') as lenfp:
+            outfp.write(b'\0'*HEADER_SIZE)
+
+            for nodes, lengths in blocks:
+                if nodes.size > 0 and \
+                        (nodes.min() < 0 or
+                         nodes.max() > np.iinfo(NODE_DTYPE).max):
+                    raise ValueError('Node id out of the uint32 range.')
+
+                outfp.write(np.ascontiguousarray(nodes, dtype=NODE_DTYPE)
+                            .tobytes())
+                lenfp.write(np.ascontiguousarray(lengths, dtype=LENGTH_DTYPE)
+                            .tobytes())
+                ncycles += lengths.size
+                nnodes += nodes.size
+
+            lenfp.seek(0)
+            while True:
+                buf = lenfp.read(CHUNK_SIZE)
+                if not buf:
+                    break
+                outfp.write(buf)
+
+            outfp.seek(0)
+            outfp.write(HEADER.pack(MAGIC,
+                                    VERSION,
+                                    K if K is not None else -1,
+                                    source if source is not None else -1,
+                                    ncycles,
+                                    nnodes))
+    finally:
+        if lengths_path.exists():
+            lengths_path.unlink()
+
+    return ncycles, nnodes
+
+
+if __name__ == '__main__':
+    desc = 'Convert a text pageloop cycle file to the binary cycle format.'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('FILE',
+                        type=pathlib.Path,
+                        help='Input file (w/ pageloop cycles), "-" reads '
+                             'from stdin.')
+    parser.add_argument('-k', '--maxloop',
+                        type=int,
+                        dest='K',
+                        help='Max loop length (K) used to enumerate the '
+                             'cycles [default: unknown].')
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        required=True,
+                        help='Output file name.')
+    parser.add_argument('-s', '--source',
+                        type=int,
+                        help='Source node of the cycles [default: unknown].')
+
+    args = parser.parse_args()
+
+    if is_binary(args.FILE):
+        print('Error: {} is already a binary cycle file.'.format(args.FILE),
+              file=sys.stderr)
+        exit(1)
+
+    ncycles, nnodes = write_cycles(args.output,
+                                   read_cycles(args.FILE),
+                                   source=args.source,
+                                   K=args.K)
+
+    print('Written {} cycles ({} nodes) to {}.'
+          .format(ncycles, nnodes, args.output),
+          file=sys.stderr)
+
+    exit(0)
@@ -6,6 +6,8 @@ import csv
 import argparse
 import pathlib
 
+from snapshotindex import load_snapshot
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
     description='Map wikipedia page ids to page titles.')
@@ -17,7 +19,9 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
     parser.add_argument('-o', '--output',
                         type=pathlib.Path,
@@ -26,16 +30,7 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    snapshotname = args.snapshot
-    id2title = {}
-    title2id = {}
-    with snapshotname.open('r') as snapshotfile:
-        reader = csv.reader(snapshotfile, delimiter='\t')
-        for l in reader:
-            pageid = int(l[0])
-            title = l[1]
-            id2title[pageid] = title
-            title2id[title] = pageid
+    id2title, _ = load_snapshot(args.snapshot)
 
     output = pathlib.Path('degree_map.output.dat')
     if args.output is not None:
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Find files by their sanitized name.
+#
+# Output files are named after page titles passed through sanitize(), so
+# the file of a title is found by sanitizing the name of every file in a
+# directory. A DirectoryIndex scans a directory once and maps each
+# sanitized name to the real file name; get_index() keeps one index per
+# directory for the whole process.
+#
+# An index can be saved to a sidecar file (SIDECAR_NAME) in the directory
+# itself, it is used by later processes as long as the modification time of
+# the directory does not change (i.e. no file is added, removed or renamed).
+
+import os
+import re
+import json
+import pathlib
+
+SIDECAR_NAME = '.sanitized-index.json'
+SIDECAR_VERSION = 1
+
+# sanitize regex
+sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
+sanre02 = re.compile(r'^\(nul\|prn\|con\|lpt[0-9]\|com[0-9]\|aux\)\(\.\|$\)',
+                     re.IGNORECASE)
+sanre03 = re.compile(r'^\.*$')
+sanre04 = re.compile(r'^$')
+
+def sanitize(filename: str) -> str:
+    res = sanre01.sub('', filename)
+    res = sanre02.sub('', res)
+    res = sanre03.sub('', res)
+    res = sanre04.sub('', res)
+
+    return res
+
+
+# Processing non-UTF-8 Posix filenames using Python pathlib?
+# https://stackoverflow.com/a/45724695/2377454
+def safe_path(path: pathlib.Path) -> pathlib.Path:
+    encoded_path = path.as_posix().encode('utf-8')
+    return pathlib.Path(os.fsdecode(encoded_path))
+
+
+class DirectoryIndex:
+    """
+    Map the sanitized names of the files in a directory to their real
+    names. Hidden files are skipped, if two files have the same sanitized
+    name the first one in sorted order is used.
+    """
+
+    def __init__(self, directory, sidecar=False):
+        self.directory = pathlib.Path(directory)
+        self.names = None
+
+        if sidecar:
+            self.names = self._load_sidecar()
+
+        if self.names is None:
+            mtime = self._mtime()
+            self.names = self._scan()
+            if sidecar:
+                self._save_sidecar(mtime)
+
+    def _mtime(self):
+        return os.stat(safe_path(self.directory).as_posix()).st_mtime_ns
+
+    def _scan(self):
+        names = {}
+        with os.scandir(safe_path(self.directory).as_posix()) as entries:
+            filenames = sorted(entry.name for entry in entries
+                               if not entry.name.startswith('.'))
+
+        for filename in filenames:
+            names.setdefault(sanitize(filename), filename)
+
+        return names
+
+    @property
+    def sidecar_path(self):
+        return safe_path(self.directory/SIDECAR_NAME)
+
+    def _load_sidecar(self):
+        try:
+            with self.sidecar_path.open('r', encoding='UTF-8') as infp:
+                data = json.load(infp)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(data, dict) or \
+                data.get('version') != SIDECAR_VERSION or \
+                data.get('mtime_ns') != self._mtime():
+            return None
+
+        return data.get('names')
+
+    def _save_sidecar(self, mtime):
+        # creating the sidecar changes the mtime of the directory: it is
+        # created empty, then the directory is checked again and the index
+        # is written in place, which does not change the mtime.
+        try:
+            existed = self.sidecar_path.exists()
+            self.sidecar_path.touch()
+
+            new_mtime = self._mtime()
+            if existed and new_mtime != mtime:
+                return
+            if not existed and self._scan() != self.names:
+                return
+
+            with self.sidecar_path.open('w', encoding='UTF-8') as outfp:
+                json.dump({'version': SIDECAR_VERSION,
+                           'mtime_ns': new_mtime,
+                           'names': self.names},
+                          outfp)
+        except OSError:
+            # the index is just not persisted, e.g. on read-only directories
+            pass
+
+    def lookup(self, sanitized_name):
+        """
+        Return the path of the file with the given sanitized name, None if
+        there is no such file.
+        """
+        filename = self.names.get(sanitized_name)
+        if filename is None:
+            return None
+
+        return self.directory/filename
+
+    def __contains__(self, sanitized_name):
+        return sanitized_name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+
+_indexes = {}
+
+
+def get_index(directory, sidecar=False):
+    """
+    Return the DirectoryIndex of directory, scanning it only the first time
+    it is requested in the process.
+    """
+    key = pathlib.Path(directory).resolve()
+    if key not in _indexes:
+        _indexes[key] = DirectoryIndex(directory, sidecar=sidecar)
+
+    return _indexes[key]
+
+
+def find_sanitized(directory, sanitized_name, sidecar=False):
+    """
+    Return the path of the file in directory whose sanitized name is
+    sanitized_name, None if there is none.
+    """
+    return get_index(directory, sidecar=sidecar).lookup(sanitized_name)
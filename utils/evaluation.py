@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Ranking evaluation metrics.
+#
+# A Ranking holds, for the reference links of a title (e.g. its "See also"
+# links or its clickstream links), their relevance (gain) and their
+# position and score in the ranking computed by an algorithm, as read from
+# the comparison files written by compare_seealso.py. It is built once per
+# (title, algorithm) and all the metrics are computed from its arrays, the
+# orderings they need are computed once and shared.
+#
+# Metrics (METRICS), each one gives the columns in METRIC_COLUMNS:
+#   kendall   Kendall's tau-b between gains and scores (and its p-value)
+#   kendall_top_k
+#             Kendall's tau-b between gains and positions over the links
+#             and the top k pages of the full ranking of the algorithm,
+#             pages after the top k are tied (and the number of pages)
+#   spearman  Spearman's rho between gains and scores (and its p-value)
+#   ndcg      normalized discounted cumulative gain of the top k positions
+#   rbo       rank-biased overlap (extrapolated, with persistence p) of the
+#             links ordered by gain and by position
+#   mrr       reciprocal rank of the first link (its mean over the titles
+#             is the MRR)
+#   linear    sum of 1/pos over the links
+#   log       sum of 1/(1+log(pos)) over the links
+#
+# links that are not in the ranking of the algorithm have position 0 and
+# score 0.
+
+import csv
+import math
+
+import numpy as np
+from scipy.special import ndtr
+from scipy.stats import spearmanr
+
+from dirindex import sanitize
+
+DEFAULT_NDCG_K = 10
+DEFAULT_RBO_P = 0.9
+DEFAULT_TOP_K = 1000
+
+SCORING_FUNCTIONS = ['linear', 'square', 'cube', 'nlogn', 'expe', 'exp10']
+
+# metrics that only need the positions of the links
+POSITION_METRICS = ['linear', 'log', 'mrr', 'ndcg']
+
+# configuration of an evaluated ranking, fields that do not apply to the
+# algorithm are None
+CONFIG_HEADER = ('algo', 'scoring_function', 'alpha', 'maxloop')
+
+
+def position_scores(positions, use_log=False):
+    """
+    Return 1/pos (1/(1+log(pos)) if use_log) for each position, 0 for
+    position 0.
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    ranked = positions > 0
+
+    scores = np.zeros(positions.size, dtype=np.float64)
+    if use_log:
+        scores[ranked] = 1.0/(1.0 + np.log(positions[ranked]))
+    else:
+        scores[ranked] = 1.0/positions[ranked]
+
+    return scores
+
+
+def comparison_configs(algos, scoring_functions, alphas, maxloops,
+                       wholenetwork=False):
+    """
+    Return the list of the configurations (see CONFIG_HEADER) to evaluate,
+    without duplicates: the scoring functions apply to LoopRank, the
+    damping factors to the other algorithms, whose maxloop is
+    'wholenetwork' if wholenetwork is set.
+    """
+    configs = []
+    for algo in algos:
+        if algo == 'looprank':
+            candidates = [(algo, scoring_function, None, maxloop)
+                          for scoring_function in scoring_functions
+                          for maxloop in maxloops]
+        else:
+            if wholenetwork:
+                maxloops_algo = ['wholenetwork']
+            else:
+                maxloops_algo = maxloops
+
+            # alpha has two decimal places in the file names
+            candidates = [(algo, None, round(alpha, 2), maxloop)
+                          for alpha in alphas
+                          for maxloop in maxloops_algo]
+
+        for config in candidates:
+            if config not in configs:
+                configs.append(config)
+
+    return configs
+
+
+def format_filename(templates, config, title):
+    """
+    Return the name of the file of title for config, from the file name
+    templates of each algorithm. Spaces in the title become underscores and
+    the name is sanitized, as compare_seealso.py names the files it writes.
+    """
+    algo, scoring_function, alpha, maxloop = config
+    return sanitize(templates[algo]
+                    .format(algo=algo,
+                            scoring_function=scoring_function,
+                            alpha=alpha,
+                            title=title.replace(' ', '_'),
+                            maxloop=maxloop
+                            )
+                    )
+
+
+def read_comparison_file(input_file):
+    """
+    Read a comparison file (pos, title, page id, score), return the page
+    ids (sorted) and their positions, scores and titles. If a page id
+    appears more than once, its last line is used.
+    """
+    links = {}
+    with input_file.open('r', encoding='utf-8') as infp:
+        reader = csv.reader(infp, delimiter='\t')
+
+        # ['5', 'Bijbehara railway station', '11119524', '2.41667']
+        for line in reader:
+            links[int(line[2])] = (int(line[0]), float(line[3]), line[1])
+
+    ids = sorted(links)
+    positions = np.array([links[lid][0] for lid in ids], dtype=np.int64)
+    scores = np.array([links[lid][1] for lid in ids], dtype=np.float64)
+    titles = [links[lid][2] for lid in ids]
+
+    return np.array(ids, dtype=np.int64), positions, scores, titles
+
+
+class Ranking:
+    """
+    Reference links of a title (ids, sorted) with their gains and their
+    positions and scores in the ranking of an algorithm.
+    """
+
+    def __init__(self, ids, gains, positions, scores, full=None):
+        self.ids = ids
+        self.gains = gains
+        self.positions = positions
+        self.scores = scores
+
+        # full ranking of the algorithm, if known: all the ranked page ids
+        # (sorted) and their positions
+        self.full = full
+
+        self.ranked = positions > 0
+
+        # indexes of the links by decreasing gain (ties by id)
+        self.reference_order = np.lexsort((ids, -gains))
+
+        # indexes of the ranked links by position (ties by id)
+        ranked = np.flatnonzero(self.ranked)
+        self.algo_order = ranked[np.lexsort((ids[ranked],
+                                             positions[ranked]))]
+
+    @classmethod
+    def from_links(cls, ref_ids, gains, algo_ids, algo_positions,
+                   algo_scores):
+        """
+        Align the links of an algorithm to the reference links, both ids
+        arrays are sorted. Raise ValueError if the algorithm has links that
+        are not in the reference.
+        """
+        idx = np.searchsorted(ref_ids, algo_ids)
+        idx = np.minimum(idx, max(ref_ids.size - 1, 0))
+        if algo_ids.size and not np.all(ref_ids[idx] == algo_ids):
+            raise ValueError('unexpected key in the comparison results')
+
+        positions = np.zeros(ref_ids.size, dtype=np.int64)
+        positions[idx] = algo_positions
+        scores = np.zeros(ref_ids.size, dtype=np.float64)
+        scores[idx] = algo_scores
+
+        return cls(ref_ids, np.asarray(gains, dtype=np.float64), positions,
+                   scores)
+
+    @classmethod
+    def from_comparison(cls, ids, positions, scores):
+        """
+        Ranking whose reference are the links of a comparison file, all
+        with gain 1.
+        """
+        return cls(ids, np.ones(ids.size, dtype=np.float64),
+                   np.asarray(positions, dtype=np.int64),
+                   np.asarray(scores, dtype=np.float64))
+
+    def __len__(self):
+        return self.ids.size
+
+
+def count_inversions(values):
+    """
+    Return the number of pairs i < j with values[i] > values[j], values are
+    non-negative integers.
+
+    Radix sort from the most significant bit: at each bit the values are
+    grouped by their higher bits (keeping their order), in a group a value
+    with the bit unset is inverted with each value before it with the bit
+    set, then each group is split (stable) by the bit. Every step is linear
+    and there are log2(max(values)) of them.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    size = values.size
+    if size < 2:
+        return 0
+
+    # sorted in place
+    values = values.copy()
+    index = np.arange(size, dtype=np.int64)
+    moved = np.empty(size, dtype=np.int64)
+
+    inversions = 0
+    for bit in reversed(range(int(values.max()).bit_length())):
+        key = values >> bit
+        ones = key & 1
+
+        # first position of each key once sorted, a group starts at the key
+        # with the bit unset
+        counts = np.bincount(key)
+        first = np.cumsum(counts) - counts
+        start = first[key - ones]
+
+        # set bits before each value in its group
+        ones_before = np.cumsum(ones) - ones
+        ones_before -= ones_before[start]
+        inversions += int(np.dot(ones_before, 1 - ones))
+
+        # zeros first, then ones, in the same order
+        position = np.where(ones, first[key] + ones_before,
+                            index - ones_before)
+        moved[position] = values
+        values, moved = moved, values
+
+    return inversions
+
+
+def dense_ranks(values):
+    """
+    Return the dense ranks (from 1) of values.
+    """
+    order = np.argsort(values)
+    ranks = np.empty(values.size, dtype=np.int64)
+    ranks[order] = np.cumsum(np.r_[True, values[order][1:] !=
+                                   values[order][:-1]])
+
+    return ranks
+
+
+def _tie_counts(ranks):
+    counts = np.bincount(ranks)
+    counts = counts[counts > 1].astype(np.int64)
+
+    return (int((counts*(counts - 1)//2).sum()),
+            int((counts*(counts - 1.)*(counts - 2)).sum()),
+            int((counts*(counts - 1.)*(2*counts + 5)).sum()))
+
+
+def _kendall_p_exact(size, c):
+    """
+    Exact two-sided p-value of Kendall's tau without ties, c is the number
+    of concordant (or discordant) pairs, see M. G. Kendall, "Rank
+    Correlation Methods", 1970.
+    """
+    c = min(c, size*(size - 1)//2 - c)
+    if size <= 2:
+        return 1.0
+    if c == 0:
+        return 2.0/math.factorial(size) if size < 171 else 0.0
+    if c == 1:
+        return 2.0/math.factorial(size - 1) if size < 172 else 0.0
+    if 4*c == size*(size - 1):
+        return 1.0
+
+    # number of permutations with k inversions, for k <= c
+    counts = np.zeros(c + 1)
+    counts[0:2] = 1.0
+    for j in range(3, size + 1):
+        counts = np.cumsum(counts)
+        if j <= c:
+            counts[j:] -= counts[:c + 1 - j]
+
+    return min(2.0*np.sum(counts)/math.factorial(size), 1.0)
+
+
+def kendall_tau_b(x, y):
+    """
+    Kendall's tau-b between x and y and its two-sided p-value as
+    scipy.stats.kendalltau: the same handling of ties and NaNs (propagated)
+    and the same choice between the exact and the asymptotic p-value. The
+    discordant pairs are counted as the inversions of y sorted by x, in
+    O(n log n).
+    """
+    x = np.asarray(x).ravel()
+    y = np.asarray(y).ravel()
+    if x.size != y.size:
+        raise ValueError('x and y must have the same size')
+
+    nan = float('nan')
+    size = x.size
+    if not size:
+        return nan, nan
+    for values in (x, y):
+        if values.dtype.kind == 'f' and np.isnan(values).any():
+            return nan, nan
+
+    # sort by x, then by y, as dense ranks (both at most size)
+    rank_y = dense_ranks(y)
+    rank_x = dense_ranks(x)
+    order = np.argsort(rank_x*(size + 1) + rank_y)
+    rank_x = rank_x[order]
+    rank_y = rank_y[order]
+
+    # with ties in x sorted by y, the inversions of y are the discordant
+    # pairs
+    dis = count_inversions(rank_y)
+
+    joint = np.r_[True, (rank_x[1:] != rank_x[:-1]) |
+                        (rank_y[1:] != rank_y[:-1]), True]
+    counts = np.diff(np.flatnonzero(joint)).astype(np.int64)
+    ntie = int((counts*(counts - 1)//2).sum())
+    xtie, x0, x1 = _tie_counts(rank_x)
+    ytie, y0, y1 = _tie_counts(rank_y)
+
+    tot = (size*(size - 1))//2
+    if xtie == tot or ytie == tot:
+        return nan, nan
+
+    con_minus_dis = tot - xtie - ytie + ntie - 2*dis
+    tau = con_minus_dis/np.sqrt(tot - xtie)/np.sqrt(tot - ytie)
+    tau = float(min(1.0, max(-1.0, tau)))
+
+    if xtie == 0 and ytie == 0 and (size <= 33 or min(dis, tot - dis) <= 1):
+        pvalue = _kendall_p_exact(size, tot - dis)
+    else:
+        m = size*(size - 1.)
+        var = ((m*(2*size + 5) - x1 - y1)/18 +
+               (2*xtie*ytie)/m + x0*y0/(9*m*(size - 2)))
+        pvalue = float(2*ndtr(-abs(con_minus_dis/np.sqrt(var))))
+
+    return tau, pvalue
+
+
+def top_k_arrays(ref_ids, gains, ranked_ids, positions, k):
+    """
+    Return the gains and the (negated) positions of the union of the
+    reference links and of the top k pages of a ranking (ranked_ids sorted,
+    with their positions): pages that are not reference links have gain 0,
+    pages after position k are all tied at position k+1.
+    """
+    top = positions <= k
+    ids = np.union1d(ref_ids, ranked_ids[top])
+
+    all_gains = np.zeros(ids.size, dtype=np.float64)
+    all_gains[np.searchsorted(ids, ref_ids)] = gains
+
+    all_positions = np.full(ids.size, k + 1, dtype=np.int64)
+    idx = np.searchsorted(ids, ranked_ids[top])
+    all_positions[idx] = positions[top]
+
+    return all_gains, -all_positions
+
+
+def kendall(ranking, params):
+    return kendall_tau_b(ranking.gains, ranking.scores)
+
+
+def kendall_top_k(ranking, params):
+    if ranking.full is None:
+        raise ValueError('the full ranking is needed for kendall_top_k')
+
+    ranked_ids, positions = ranking.full
+    gains, ranks = top_k_arrays(ranking.ids, ranking.gains,
+                                ranked_ids, positions, params['top_k'])
+
+    return kendall_tau_b(gains, ranks) + (gains.size,)
+
+
+def spearman(ranking, params):
+    rho = spearmanr(ranking.gains, ranking.scores)
+    return rho.correlation, rho.pvalue
+
+
+def ndcg(ranking, params):
+    k = params['k']
+
+    positions = ranking.positions
+    top = ranking.ranked & (positions <= k)
+    dcg = np.sum(ranking.gains[top]/np.log2(positions[top] + 1.0))
+
+    ideal = ranking.gains[ranking.reference_order][:k]
+    idcg = np.sum(ideal/np.log2(np.arange(2, ideal.size + 2)))
+    if idcg <= 0:
+        return (float('nan'),)
+
+    return (float(dcg/idcg),)
+
+
+def rbo(ranking, params):
+    """
+    Extrapolated rank-biased overlap of two lists of different lengths, see
+    eq. (32) in W. Webber, A. Moffat, J. Zobel, "A similarity measure for
+    indefinite rankings", ACM TOIS 28(4), 2010.
+    """
+    p = params['p']
+
+    nref = len(ranking)
+    nalgo = ranking.algo_order.size
+    if not nref:
+        return (float('nan'),)
+    if not nalgo:
+        return (0.0,)
+
+    # depth of each link in the two lists, the overlap at depth d is the
+    # number of links whose depth is at most d in both of them
+    depth_ref = np.empty(nref, dtype=np.int64)
+    depth_ref[ranking.reference_order] = np.arange(1, nref + 1)
+    depth_algo = np.full(nref, nref + 1, dtype=np.int64)
+    depth_algo[ranking.algo_order] = np.arange(1, nalgo + 1)
+
+    longest = max(nref, nalgo)
+    shortest = min(nref, nalgo)
+    depth = np.maximum(depth_ref, depth_algo)
+    depth = depth[depth <= longest]
+    overlap = np.cumsum(np.bincount(depth, minlength=longest + 1))[1:]
+
+    d = np.arange(1, longest + 1, dtype=np.float64)
+    weights = p**d
+    x_s = overlap[shortest - 1]
+    x_l = overlap[longest - 1]
+
+    tail = d > shortest
+    total = np.sum(overlap/d*weights) + \
+        np.sum(x_s*(d[tail] - shortest)/(shortest*d[tail])*weights[tail])
+
+    return (float((1 - p)/p*total +
+                  ((x_l - x_s)/longest + x_s/shortest)*p**longest),)
+
+
+def mrr(ranking, params):
+    if not ranking.algo_order.size:
+        return (0.0,)
+
+    return (1.0/float(ranking.positions[ranking.algo_order[0]]),)
+
+
+def linear(ranking, params):
+    return (float(np.sum(position_scores(ranking.positions))),)
+
+
+def log(ranking, params):
+    return (float(np.sum(position_scores(ranking.positions, use_log=True))),)
+
+
+METRICS = {'kendall': kendall,
+           'kendall_top_k': kendall_top_k,
+           'spearman': spearman,
+           'ndcg': ndcg,
+           'rbo': rbo,
+           'mrr': mrr,
+           'linear': linear,
+           'log': log,
+           }
+
+METRIC_COLUMNS = {'kendall': ('tau', 'pvalue'),
+                  'kendall_top_k': ('tau@{top_k}', 'pvalue@{top_k}',
+                                    'n@{top_k}'),
+                  'spearman': ('rho', 'rho_pvalue'),
+                  'ndcg': ('ndcg@{k}',),
+                  'rbo': ('rbo@{p}',),
+                  'mrr': ('rr',),
+                  'linear': ('linear',),
+                  'log': ('log',),
+                  }
+
+
+def metric_columns(metrics, k=DEFAULT_NDCG_K, p=DEFAULT_RBO_P,
+                   top_k=DEFAULT_TOP_K):
+    """
+    Return the names of the columns of the given metrics.
+    """
+    return tuple(column.format(k=k, p=p, top_k=top_k)
+                 for metric in metrics
+                 for column in METRIC_COLUMNS[metric])
+
+
+def evaluate(ranking, metrics, k=DEFAULT_NDCG_K, p=DEFAULT_RBO_P,
+             top_k=DEFAULT_TOP_K):
+    """
+    Return the values of the given metrics for ranking, in the order of
+    metric_columns().
+    """
+    params = {'k': k, 'p': p, 'top_k': top_k}
+
+    values = ()
+    for metric in metrics:
+        values += tuple(METRICS[metric](ranking, params))
+
+    return values
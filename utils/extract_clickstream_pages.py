@@ -6,8 +6,15 @@ import sys
 import csv
 import tqdm
 import pathlib
+import heapq
 import argparse
+import tempfile
+import itertools
+import contextlib
 import subprocess
+import collections
+
+from snapshotindex import load_snapshot
 
 SPECIAL_SOURCES = [
 'other-empty',
@@ -22,6 +29,10 @@ OUTPUT_HEADER = [
 'link_id',
 'click_count'
 ]
+OUTPUT_FILENAME = 'enwiki.comparison.{}.clickstream.txt'
+
+# rows kept in memory before they are spilled to a temporary file
+DEFAULT_BUFFER_ROWS = 1000000
 
 # sanitize regex
 sanre01 = re.compile(r'[\\/:&\*\?"<>\|\x01-\x1F\x7F]')
@@ -61,6 +72,66 @@ def count_file_lines(file_path: pathlib.Path) -> int:
     return int(num[0])
 
 
+def buffered_rows(rows):
+    """
+    Return the buffered rows as (output file, row) pairs sorted by output
+    file, the rows of a file are in the order of the input.
+    """
+    return ((outfile, row)
+            for outfile in sorted(rows)
+            for row in rows[outfile])
+
+
+def spill_rows(rows, spill_dir):
+    """
+    Write the buffered rows, sorted by output file, to a new file in
+    spill_dir (a run) and empty the buffer. Return the path of the run.
+    """
+    fd, runfile = tempfile.mkstemp(suffix='.tsv', dir=spill_dir.as_posix())
+    with open(fd, 'w', encoding='utf-8', newline='') as runfp:
+        writer = csv.writer(runfp, delimiter='\t')
+        writer.writerows((outfile,) + row
+                         for outfile, row in buffered_rows(rows))
+
+    rows.clear()
+    return pathlib.Path(runfile)
+
+
+def read_run(runfp):
+    reader = csv.reader(runfp, delimiter='\t')
+    return ((line[0], tuple(line[1:])) for line in reader)
+
+
+def write_outputs(rows, runfiles):
+    """
+    Merge the runs and the buffered rows (the last run) by output file and
+    write each output file in one go, the rows of a file are in the order of
+    the input. A file is opened for appending, the header is written if it
+    is new.
+    """
+    with contextlib.ExitStack() as stack:
+        runs = [read_run(stack.enter_context(
+                    runfile.open('r', encoding='utf-8', newline='')))
+                for runfile in runfiles]
+        runs.append(buffered_rows(rows))
+
+        # heapq.merge is stable: with the same output file, the rows of
+        # earlier runs come first
+        merged = heapq.merge(*runs, key=lambda item: item[0])
+        for outfile, items in itertools.groupby(merged,
+                                                key=lambda item: item[0]):
+            with safe_path(pathlib.Path(outfile)).open('a',
+                                                       encoding='utf-8') \
+                    as outfp:
+                writer = csv.writer(outfp, delimiter='\t')
+
+                # new file, write header
+                if outfp.tell() == 0:
+                    writer.writerow(OUTPUT_HEADER)
+
+                writer.writerows(row for _, row in items)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Extract clickstream data.')
@@ -72,16 +143,33 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Snapshot file.'
+                        help='Snapshot file (TSV file or index compiled '
+                             'with snapshotindex.py).'
                         )
     parser.add_argument('-t', '--titles',
                         type=pathlib.Path,
                         required=True,
                         help='Titles file.'
                         )
+    parser.add_argument('--buffer-rows',
+                        type=int,
+                        default=DEFAULT_BUFFER_ROWS,
+                        help='Number of rows grouped by title in memory, '
+                             'when it is exceeded they are spilled to a '
+                             'temporary file [default: {}].'
+                             .format(DEFAULT_BUFFER_ROWS)
+                        )
+    parser.add_argument('--spill-dir',
+                        type=pathlib.Path,
+                        help='Directory for the temporary files '
+                             '[default: the system temporary directory].'
+                        )
 
     args = parser.parse_args()
 
+    if args.buffer_rows < 1:
+        parser.error('--buffer-rows must be positive.')
+
     print('* Read the "titles" file: ', file=sys.stderr)
     titles = set()
     titles_files = args.titles
@@ -97,62 +185,68 @@ if __name__ == '__main__':
 
     print('* Read the "snapshot" file: ', file=sys.stderr)
     snapshot_file = args.snapshot
-    snaplen = count_file_lines(snapshot_file)
-    title2id = dict()
-    with tqdm.tqdm(total=snaplen) as pbar:
-        with safe_path(snapshot_file).open('r', encoding='utf-8') as snapfp:
-            reader = csv.reader(snapfp, delimiter='\t')
-            for l in reader:
-                page_title = l[1].replace(' ', '_')
-                page_id = int(l[0])
-                title2id[page_title] = page_id
-                pbar.update(1)
+    _, title2id = load_snapshot(snapshot_file)
 
     print('* Read the "clickstream" file: ', file=sys.stderr)
+    # the rows are grouped by output file, when the buffer is full they are
+    # spilled to a temporary file; at the end everything is merged and each
+    # output file is written once
+    outfiles = {title: OUTPUT_FILENAME.format(sanitize(title))
+                for title in titles}
+    rows = collections.defaultdict(list)
+    nrows = 0
+    runfiles = []
+
     clickstream_file = args.CLICKSTREAM_FILE
     cslen = count_file_lines(clickstream_file)
-    with tqdm.tqdm(total=cslen) as pbar:
-        with safe_path(clickstream_file).open('r', encoding='utf-8') as csfp:
-            reader = csv.reader(csfp, delimiter='\t')
-            for line in reader:
-                pbar.update()
-                if line[0] in SPECIAL_SOURCES:
-                    continue
-                else:
-                    source_title = line[0]
-                    target_title = line[1]
-                    link_type = line[2]
-                    click_count = int(line[3])
-
-                    if link_type == 'link' and \
-                            source_title in titles:
-
-                        if title2id.get(target_title, None) is None:
-                            # import ipdb; ipdb.set_trace()
-                            print('Error: "{}" not found'.format(target_title))
-                            continue
-                        else:
-                            target_id = title2id[target_title]
-
-                        outfile = pathlib.Path(
-                            'enwiki.comparison.{}.clickstream.txt'
-                            .format(sanitize(source_title))
-                            )
-                        with safe_path(outfile).open('a+', encoding='utf-8') \
-                                as outfp:
-                            writer = csv.writer(outfp, delimiter='\t')
-
-                            # new file, write header
-                            if outfp.tell() == 0:
-                                writer.writerow(OUTPUT_HEADER)
-
-
-                            writer.writerow((target_title.replace('_', ' '),
-                                             target_id,
-                                             click_count
-                                             )
-                                            )
-
 
+    # the spilled runs are removed even if reading or merging fails
+    spill_parent = args.spill_dir.as_posix() if args.spill_dir else None
+    with tempfile.TemporaryDirectory(dir=spill_parent) as spill_name:
+        spill_dir = pathlib.Path(spill_name)
+
+        with tqdm.tqdm(total=cslen) as pbar:
+            with safe_path(clickstream_file).open('r', encoding='utf-8') \
+                    as csfp:
+                reader = csv.reader(csfp, delimiter='\t')
+                for line in reader:
+                    pbar.update()
+                    if line[0] in SPECIAL_SOURCES:
+                        continue
+                    else:
+                        source_title = line[0]
+                        target_title = line[1]
+                        link_type = line[2]
+                        click_count = int(line[3])
+
+                        if link_type == 'link' and \
+                                source_title in titles:
+
+                            # clickstream titles use underscores for spaces,
+                            # try the title as it is only if it is not found
+                            target_id = title2id.get(
+                                target_title.replace('_', ' '), None)
+                            if target_id is None:
+                                target_id = title2id.get(target_title, None)
+                            if target_id is None:
+                                # import ipdb; ipdb.set_trace()
+                                print('Error: "{}" not found'
+                                      .format(target_title))
+                                continue
+
+                            rows[outfiles[source_title]].append(
+                                (target_title.replace('_', ' '),
+                                 target_id,
+                                 click_count
+                                 )
+                                )
+                            nrows += 1
+
+                            if nrows >= args.buffer_rows:
+                                runfiles.append(spill_rows(rows, spill_dir))
+                                nrows = 0
+
+        print('* Write the output files: ', file=sys.stderr)
+        write_outputs(rows, runfiles)
 
     exit(0)
@@ -7,6 +7,8 @@ import argparse
 import pathlib
 import itertools
 
+from snapshotindex import load_snapshot
+
 ALLOWED_FIELDS = set(['source_id',
                       'source_title',
                       'target_id',
@@ -75,12 +77,15 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
     parser.add_argument('--snapshot-delimiter',
                         type=str,
                         default='\t',
-                        help="Wikipedia snapshot delimiter [default: '\t']."
+                        help="Wikipedia snapshot delimiter, ignored for compiled "
+                             "indexes [default: '\t']."
                         )
 
     parser.add_argument('--map',
@@ -133,11 +138,8 @@ if __name__ == '__main__':
                     else:
                         tofilter.add(int(el))
 
-    snapshot = dict()
-    with snapshotfile.open('r') as snapfp:
-        snap_reader = csv.reader(snapfp, delimiter=args.snapshot_delimiter)
-        snapshot = dict([(int(line[0]), line[1])
-                         for line in snap_reader])
+    snapshot, _ = load_snapshot(snapshotfile,
+                                delimiter=args.snapshot_delimiter)
 
     mapo2n = dict()
     if mapfile:
@@ -8,6 +8,8 @@ import argparse
 import subprocess
 from collections import defaultdict
 
+from snapshotindex import load_snapshot
+
 
 # Create (sane/safe) filename from any (unsafe) string
 # https://stackoverflow.com/a/7406369/2377454
@@ -53,7 +55,6 @@ def get_header(afile):
 
 
 FILTER_HEADER = ('page_title', 'page_id')
-SNAPSHOT_HEADER = ('page_id', 'page_title')
 OUTFILE_HEADER = ('link_title', 'link_id')
 
 
@@ -78,7 +79,8 @@ if __name__ == '__main__':
                         type=pathlib.Path,
                         required=True,
                         help='File with (new) page ids and page titles, '
-                             'i.e., snapshot.'
+                             'i.e., snapshot (TSV file or index compiled '
+                             'with snapshotindex.py).'
                         )
 
     args = parser.parse_args()
@@ -107,22 +109,7 @@ if __name__ == '__main__':
 
 
     print('* Read the "snapshot" file: ', file=sys.stderr)
-    snap_id2title = dict()
-    snap_title2id = dict()
-    snaplen = count_file_lines(snapshot_file)
-    with tqdm.tqdm(total=snaplen) as pbar:
-        with snapshot_file.open('r') as snapfp:
-            snapreader = csv.DictReader(snapfp,
-                                        fieldnames=SNAPSHOT_HEADER,
-                                        delimiter='\t')
-            for data in snapreader:
-                page_id = int(data['page_id'])
-                page_title = data['page_title']
-
-                snap_id2title[page_id] = page_title
-                snap_title2id[page_title] = page_id
-
-                pbar.update(1)
+    snap_id2title, snap_title2id = load_snapshot(snapshot_file)
 
 
     print('* Read the "filter" file: ', file=sys.stderr)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Read score files.
+#
+# The ranking tools (compute_scores.py, ssppr, 2Drank.py) write one score
+# per line:
+#
+#   score(<pageid>):<spaces><score>
+#
+# where:
+#   - <pageid> is an integer number
+#   - <score> is a real number that can be written using the scientific
+#     notation
+#
+# Score files whose lines are all well-formed are parsed in bulk with
+# NumPy; otherwise they are parsed line by line with REGEX_SCORE, so that
+# malformed lines are reported on stderr exactly as before.
+#
+# This module also defines a binary score format:
+#
+#   header   <8s I 32s d i q Q>: magic, version, algorithm (ASCII, padded
+#                                with NULs), alpha (NaN if unknown),
+#                                K (-1 if unknown), source page (-1 if
+#                                unknown), number of scores
+#   ids      uint32[number of scores], sorted page ids
+#   padding  to a multiple of 8 bytes
+#   scores   float64[number of scores], the score of each page
+#
+# all values are little-endian. read_scores() reads both formats, binary
+# files are memory-mapped and their columns are returned without copies.
+#
+# Usage:
+#   scorefile.py SCORES.bin [-o SCORES.txt]    (binary to text dump)
+#   scorefile.py SCORES.txt -o SCORES.bin [-A ALGORITHM] [-a ALPHA] [-k K]
+#                [-s SOURCE]                   (text to binary conversion)
+
+import io
+import os
+import re
+import sys
+import math
+import struct
+import argparse
+import pathlib
+
+import numpy as np
+
+REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
+regex_score = re.compile(REGEX_SCORE)
+
+REGEX_ID = r'([0-9]+)'
+regex_id = re.compile(REGEX_ID)
+
+MAGIC = b'PLSCORES'
+VERSION = 1
+HEADER = struct.Struct('<8sI32sdiqQ')
+HEADER_SIZE = HEADER.size
+ALGORITHM_SIZE = 32
+
+ID_DTYPE = np.dtype('<u4')
+SCORE_DTYPE = np.dtype('<f8')
+
+# score file name for the standard input
+STDIN = '-'
+
+# text output template
+OUTLINE_SCORE = 'score({pageid}):\t{score}\n'
+
+# well-formed files, parsed in bulk: every line is accepted by
+# process_line() and gives the same values (a score starts with a digit
+# and a "-" can only follow an "e", checked separately)
+FAST_SCORE_LINE = rb'score\([0-9]+\):[ \t]+[0-9][0-9.e-]*[ \t]*\r?'
+FAST_SCORES = re.compile(rb'(?:%s\n)*(?:%s)?' % (FAST_SCORE_LINE,
+                                                 FAST_SCORE_LINE))
+FAST_ID_LINE = rb'[0-9]+[ \t]*\r?'
+FAST_IDS = re.compile(rb'(?:%s\n)*(?:%s)?' % (FAST_ID_LINE, FAST_ID_LINE))
+FAST_DTYPE = np.dtype([('pageid', np.int64), ('score', np.float64)])
+
+
+# Processing non-UTF-8 Posix filenames using Python pathlib?
+# https://stackoverflow.com/a/45724695/2377454
+def safe_path(path: pathlib.Path) -> pathlib.Path:
+    encoded_path = path.as_posix().encode('utf-8')
+    return pathlib.Path(os.fsdecode(encoded_path))
+
+
+def is_stdin(infile):
+    return pathlib.Path(infile).as_posix() == STDIN
+
+
+def is_binary(infile):
+    """
+    Tell if infile is a binary score file, stdin is checked when it is
+    read.
+    """
+    if is_stdin(infile):
+        return False
+
+    with safe_path(pathlib.Path(infile)).open('rb') as infp:
+        return infp.read(len(MAGIC)) == MAGIC
+
+
+def _scores_offset(count):
+    # the score column starts at a multiple of 8 bytes
+    ids_end = HEADER_SIZE + count*ID_DTYPE.itemsize
+    return ids_end + (-ids_end % SCORE_DTYPE.itemsize)
+
+
+class ScoreFile:
+    """
+    Memory-mapped binary score file.
+
+    ids and scores are read-only views on the file, ids are sorted and
+    scores[i] is the score of page ids[i].
+    """
+
+    def __init__(self, path, data=None):
+        """
+        Map the binary score file path, if data is given it is used instead
+        of the content of the file (e.g. for a file read from stdin).
+        """
+        path = pathlib.Path(path)
+        if data is None:
+            data = np.memmap(safe_path(path).as_posix(), dtype=np.uint8,
+                             mode='r')
+        else:
+            data = np.frombuffer(data, dtype=np.uint8)
+
+        header = data[:HEADER_SIZE].tobytes()
+        if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a binary score file.'.format(path))
+
+        (_, version, algorithm, alpha, K, source, count) = \
+            HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('Unsupported score file version {} in {}.'
+                             .format(version, path))
+
+        self.path = path
+        self.algorithm = algorithm.rstrip(b'\0').decode('ascii')
+        self.alpha = alpha if not math.isnan(alpha) else None
+        self.K = K if K >= 0 else None
+        self.source = source if source >= 0 else None
+        self.count = count
+
+        ids_end = HEADER_SIZE + count*ID_DTYPE.itemsize
+        scores_start = _scores_offset(count)
+        scores_end = scores_start + count*SCORE_DTYPE.itemsize
+        if data.size != scores_end:
+            raise ValueError('Truncated or corrupted score file {}.'
+                             .format(path))
+
+        self.ids = data[HEADER_SIZE:ids_end].view(ID_DTYPE)
+        self.scores = data[scores_start:scores_end].view(SCORE_DTYPE)
+
+    def __len__(self):
+        return self.count
+
+
+def write_binary_scores(outpath, pageids, scores, algorithm='', alpha=None,
+                        K=None, source=None):
+    """
+    Write pageids and their scores to the binary score file outpath ("-" is
+    the standard output), sorting them by page id.
+    """
+    pageids = np.asarray(pageids)
+    scores = np.asarray(scores, dtype=SCORE_DTYPE)
+    if pageids.size != scores.size:
+        raise ValueError('Got {} page ids and {} scores.'
+                         .format(pageids.size, scores.size))
+    if pageids.size and (pageids.min() < 0 or
+                         pageids.max() > np.iinfo(ID_DTYPE).max):
+        raise ValueError('Page ids do not fit in {}.'.format(ID_DTYPE))
+
+    algorithm = algorithm.encode('ascii')
+    if len(algorithm) > ALGORITHM_SIZE:
+        raise ValueError('Algorithm name longer than {} characters: {}'
+                         .format(ALGORITHM_SIZE, algorithm))
+
+    order = np.argsort(pageids, kind='stable')
+    count = pageids.size
+
+    header = HEADER.pack(MAGIC, VERSION, algorithm,
+                         alpha if alpha is not None else math.nan,
+                         K if K is not None else -1,
+                         source if source is not None else -1,
+                         count)
+    padding = b'\0' * (_scores_offset(count) - HEADER_SIZE -
+                       count*ID_DTYPE.itemsize)
+
+    def write(outfp):
+        outfp.write(header)
+        outfp.write(pageids[order].astype(ID_DTYPE).tobytes())
+        outfp.write(padding)
+        outfp.write(scores[order].tobytes())
+
+    if is_stdin(outpath):
+        write(sys.stdout.buffer)
+    else:
+        with safe_path(pathlib.Path(outpath)).open('wb') as outfp:
+            write(outfp)
+
+
+def write_text_scores(outfp, pageids, scores):
+    """
+    Write pageids and their scores as score(<pageid>):<TAB><score> lines.
+    """
+    for pageid, score in zip(pageids.tolist(), scores.tolist()):
+        outfp.write(OUTLINE_SCORE.format(pageid=pageid, score=repr(score)))
+
+
+def rank_positions(page_ids, page_scores):
+    """
+    Rank pages by descending score, ties broken by ascending page id.
+
+    Return the page ids sorted by id, the position of each of them in the
+    ranking (starting from 1) and their score; a page listed more than once
+    gets its best position.
+    """
+    order = np.lexsort((page_ids, -page_scores))
+
+    # inverse permutation of order: position of each page in the ranking
+    positions = np.empty(order.size, dtype=np.int64)
+    positions[order] = np.arange(1, order.size + 1)
+
+    byid = np.lexsort((positions, page_ids))
+    page_ids = page_ids[byid]
+    first = np.ones(byid.size, dtype=bool)
+    first[1:] = page_ids[1:] != page_ids[:-1]
+    byid = byid[first]
+
+    return page_ids[first], positions[byid], page_scores[byid]
+
+
+def lookup_positions(ranked_ids, query_ids):
+    """
+    Find the ids in query_ids in the sorted array ranked_ids, return the
+    index of each of them in ranked_ids and a mask of the ids found.
+    """
+    if ranked_ids.size == 0:
+        return (np.zeros(query_ids.size, dtype=np.int64),
+                np.zeros(query_ids.size, dtype=bool))
+
+    idx = np.searchsorted(ranked_ids, query_ids)
+    idx = np.minimum(idx, ranked_ids.size - 1)
+
+    return idx, ranked_ids[idx] == query_ids
+
+
+def process_line(line, allow_ids=False):
+    """
+    Parse one line of a score file, return (pageid, score).
+
+    If allow_ids is True, lines with only a page id are accepted and their
+    score is None. Malformed lines are reported on stderr and return
+    (None, None).
+    """
+    match_score = regex_score.match(line)
+
+    pageid = None
+    score = None
+    try:
+        if match_score:
+            pageid = int(match_score.group(1))
+            score = float(match_score.group(2))
+        elif allow_ids and regex_id.match(line):
+            pageid = int(regex_id.match(line).group(1))
+    except ValueError:
+        pageid = None
+        score = None
+
+    if pageid is None:
+        print('Error: could not process line: {}'.format(line),
+              file=sys.stderr)
+
+    # if match fails this is (None, None)
+    return pageid, score
+
+
+def _parse_fast(buf, allow_ids=False):
+    """
+    Parse a buffer whose lines are all well-formed (see FAST_SCORES and
+    FAST_IDS), return None if this is not the case.
+    """
+    try:
+        if buf.count(b'-') == buf.count(b'e-') and FAST_SCORES.fullmatch(buf):
+            data = buf.replace(b'score(', b'').replace(b'):', b' ')
+            values = np.loadtxt(io.BytesIO(data), dtype=FAST_DTYPE,
+                                comments=None, ndmin=1)
+            return (np.ascontiguousarray(values['pageid']),
+                    np.ascontiguousarray(values['score']))
+
+        if allow_ids and FAST_IDS.fullmatch(buf):
+            ids = np.loadtxt(io.BytesIO(buf), dtype=np.int64,
+                             comments=None, ndmin=1)
+            return ids, np.full(ids.size, np.nan)
+    except (ValueError, OverflowError):
+        # e.g. a score that is not a number ("1.2.3")
+        pass
+
+    return None
+
+
+def _parse_lines(buf, allow_ids=False):
+    pageids = []
+    scores = []
+    for line in buf.decode('utf-8', errors='replace').splitlines(True):
+        pageid, score = process_line(line, allow_ids)
+        if pageid is not None:
+            pageids.append(pageid)
+            scores.append(score if score is not None else np.nan)
+
+    return (np.array(pageids, dtype=np.int64),
+            np.array(scores, dtype=np.float64))
+
+
+def parse_scores(buf, allow_ids=False):
+    """
+    Parse the content of a score file, return an array of page ids and an
+    array with their scores, in the order of the file.
+
+    If allow_ids is True, lines with only a page id are accepted and their
+    score is NaN.
+    """
+    if not buf:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    parsed = _parse_fast(buf, allow_ids)
+    if parsed is None:
+        parsed = _parse_lines(buf, allow_ids)
+
+    return parsed
+
+
+def read_scores(infile, allow_ids=False):
+    """
+    Read a text or binary score file (or stdin if infile is "-"), see
+    parse_scores. The arrays of a binary file are memory-mapped, ids are
+    sorted.
+    """
+    if is_binary(infile):
+        scorefile = ScoreFile(infile)
+        return scorefile.ids, scorefile.scores
+
+    if is_stdin(infile):
+        buf = sys.stdin.buffer.read()
+        if buf.startswith(MAGIC):
+            scorefile = ScoreFile(infile, data=buf)
+            return scorefile.ids, scorefile.scores
+    else:
+        with safe_path(pathlib.Path(infile)).open('rb') as infp:
+            buf = infp.read()
+
+    return parse_scores(buf, allow_ids)
+
+
+if __name__ == '__main__':
+    desc = 'Dump a binary score file as text, or convert a text score file ' \
+           'to binary.'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('FILE',
+                        type=pathlib.Path,
+                        help='Binary score file to dump, or text score file '
+                             'to convert ("-" reads from stdin).')
+    parser.add_argument('-a', '--alpha',
+                        type=float,
+                        help='Damping factor stored in the binary header.')
+    parser.add_argument('-A', '--algorithm',
+                        default='',
+                        help='Algorithm name stored in the binary header.')
+    parser.add_argument('--header',
+                        action='store_true',
+                        help='Print the header of a binary score file on '
+                             'stderr.')
+    parser.add_argument('-k', '--maxloop',
+                        type=int,
+                        dest='K',
+                        help='Max loop length (K) stored in the binary '
+                             'header.')
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        help='Output file, required to convert text to '
+                             'binary [default: stdout].')
+    parser.add_argument('-s', '--source',
+                        type=int,
+                        help='Source page stored in the binary header.')
+
+    args = parser.parse_args()
+
+    scorefile = None
+    if is_stdin(args.FILE):
+        buf = sys.stdin.buffer.read()
+        if buf.startswith(MAGIC):
+            scorefile = ScoreFile(args.FILE, data=buf)
+    elif is_binary(args.FILE):
+        scorefile = ScoreFile(args.FILE)
+
+    if scorefile is not None:
+        if args.header:
+            for field in ('algorithm', 'alpha', 'K', 'source', 'count'):
+                print('{}: {}'.format(field, getattr(scorefile, field)),
+                      file=sys.stderr)
+
+        if args.output is None:
+            outfp = sys.stdout
+        else:
+            outfp = safe_path(args.output).open('w+', encoding='UTF-8')
+
+        with outfp:
+            write_text_scores(outfp, scorefile.ids, scorefile.scores)
+
+        exit(0)
+
+    if args.output is None:
+        parser.error('-o/--output is required to convert text to binary.')
+
+    if is_stdin(args.FILE):
+        pageids, scores = parse_scores(buf)
+    else:
+        pageids, scores = read_scores(args.FILE)
+
+    write_binary_scores(args.output, pageids, scores,
+                        algorithm=args.algorithm,
+                        alpha=args.alpha,
+                        K=args.K,
+                        source=args.source)
+
+    print('Written {} scores to {}.'.format(pageids.size, args.output),
+          file=sys.stderr)
+
+    exit(0)
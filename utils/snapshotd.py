@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Snapshot lookup daemon.
+#
+# Mapping page ids to titles needs the whole snapshot in memory, and scripts
+# like wikipedia_results.py are called many times in a row with the same
+# snapshot. This daemon keeps the snapshots it is asked for (TSV files or
+# indexes compiled with snapshotindex.py) loaded and serves batched lookups
+# over a Unix socket; a snapshot is reloaded when its file changes.
+#
+# The protocol is one JSON object per line, each request gets one response:
+#
+#   {"op": "titles", "snapshot": PATH, "keys": [id, ...]}
+#   {"op": "ids", "snapshot": PATH, "keys": [title, ...]}
+#       -> {"values": [value or null, ...]}
+#   {"op": "ping"} -> {"values": []}
+#   {"op": "shutdown"} -> {"values": []}
+#
+# errors are returned as {"error": MESSAGE}.
+#
+# The socket is SNAPSHOTD_SOCKET if set (an empty value disables the
+# daemon for the clients), $XDG_RUNTIME_DIR/snapshotd.sock or
+# /tmp/snapshotd-<uid>.sock otherwise.
+#
+# Usage:
+#   snapshotd.py [SNAPSHOT ...] &     start, optionally preloading snapshots
+#   snapshotd.py --stop               stop
+
+import os
+import sys
+import json
+import socket
+import argparse
+import pathlib
+import threading
+import socketserver
+
+from snapshotindex import safe_path, load_snapshot
+
+SOCKET_ENV = 'SNAPSHOTD_SOCKET'
+SOCKET_NAME = 'snapshotd.sock'
+
+OPS = ('titles', 'ids', 'ping', 'shutdown')
+
+# client timeout (seconds), loading a large TSV snapshot takes a while
+TIMEOUT = 600
+
+
+def socket_path():
+    """
+    Return the path of the daemon socket, None if the daemon is disabled.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path is not None:
+        return pathlib.Path(path) if path else None
+
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir:
+        return pathlib.Path(rundir)/SOCKET_NAME
+
+    return pathlib.Path('/tmp')/'snapshotd-{}.sock'.format(os.getuid())
+
+
+def snapshot_key(snapshot_file):
+    return safe_path(pathlib.Path(snapshot_file)).resolve().as_posix()
+
+
+class SnapshotCache:
+    """
+    Snapshots loaded by the daemon, keyed by their resolved path.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            cached = self.snapshots.get(path)
+            if cached is None or cached[0] != version:
+                print('* Loading snapshot {}'.format(path), file=sys.stderr)
+                self.snapshots[path] = (version, load_snapshot(path))
+                cached = self.snapshots[path]
+
+        return cached[1]
+
+
+class SnapshotHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {'values': self.server.process(json.loads(line))}
+            except (OSError, ValueError, KeyError, TypeError) as err:
+                response = {'error': '{}: {}'.format(type(err).__name__, err)}
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+            if self.server.stopping:
+                # shutdown() waits for serve_forever() to return, it cannot
+                # be called from the thread of a request
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class SnapshotServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path.as_posix(), SnapshotHandler)
+        self.cache = SnapshotCache()
+        self.stopping = False
+
+    def process(self, request):
+        op = request['op']
+        if op not in OPS:
+            raise ValueError('unknown op {}'.format(op))
+
+        if op == 'ping':
+            return []
+        if op == 'shutdown':
+            self.stopping = True
+            return []
+
+        id2title, title2id = self.cache.get(request['snapshot'])
+        if op == 'titles':
+            return [id2title.get(int(key), None) for key in request['keys']]
+
+        return [title2id.get(key, None) for key in request['keys']]
+
+
+class SnapshotClient:
+    """
+    Connection to the daemon, raises OSError if it is not running.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = socket_path()
+        if path is None:
+            raise ConnectionRefusedError('snapshot daemon disabled')
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(TIMEOUT)
+        try:
+            self.sock.connect(path.as_posix())
+        except OSError:
+            self.sock.close()
+            raise
+
+        self.rfile = self.sock.makefile('rb')
+
+    def request(self, op, snapshot_file=None, keys=()):
+        request = {'op': op, 'keys': list(keys)}
+        if snapshot_file is not None:
+            request['snapshot'] = snapshot_key(snapshot_file)
+
+        self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionResetError('snapshot daemon closed the '
+                                       'connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError(response['error'])
+
+        return response['values']
+
+    def titles(self, snapshot_file, pageids):
+        return self.request('titles', snapshot_file, pageids)
+
+    def ids(self, snapshot_file, titles):
+        return self.request('ids', snapshot_file, titles)
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def lookup_snapshot(snapshot_file, pageids, reverse=False):
+    """
+    Return the id -> title mapping of a snapshot for pageids (and, if
+    reverse, the title -> id mapping for their titles).
+
+    The daemon is used if it is running, then only the requested entries
+    are returned; otherwise the whole snapshot is loaded.
+    """
+    pageids = list(set(pageids))
+    try:
+        with SnapshotClient() as client:
+            titles = client.titles(snapshot_file, pageids)
+            id2title = {pageid: title
+                        for pageid, title in zip(pageids, titles)
+                        if title is not None}
+
+            title2id = None
+            if reverse:
+                titles = list(set(id2title.values()))
+                pageids = client.ids(snapshot_file, titles)
+                title2id = dict(zip(titles, pageids))
+
+            return id2title, title2id
+    except (OSError, ValueError):
+        pass
+
+    return load_snapshot(snapshot_file)
+
+
+def serve(path, preload=()):
+    # a socket that does not accept connections is left from a dead daemon
+    if path.exists():
+        try:
+            SnapshotClient(path).close()
+        except OSError:
+            path.unlink()
+        else:
+            print('Error: a snapshot daemon is already running on {}.'
+                  .format(path), file=sys.stderr)
+            return 1
+
+    old_umask = os.umask(0o077)
+    try:
+        server = SnapshotServer(path)
+    finally:
+        os.umask(old_umask)
+
+    try:
+        for snapshot_file in preload:
+            server.cache.get(snapshot_key(snapshot_file))
+
+        print('* Listening on {}'.format(path), file=sys.stderr)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        path.unlink()
+
+    return 0
+
+
+if __name__ == '__main__':
+    desc = 'Serve snapshot id-title lookups over a Unix socket.'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('SNAPSHOT',
+                        type=pathlib.Path,
+                        nargs='*',
+                        help='Snapshots to load at startup (TSV files or '
+                             'indexes compiled with snapshotindex.py), the '
+                             'others are loaded on the first request.')
+    parser.add_argument('-S', '--socket',
+                        type=pathlib.Path,
+                        help='Socket path [default: ${} or {}].'
+                             .format(SOCKET_ENV, socket_path()))
+    parser.add_argument('--stop',
+                        action='store_true',
+                        help='Stop the running daemon.')
+
+    args = parser.parse_args()
+
+    path = args.socket if args.socket is not None else socket_path()
+    if path is None:
+        parser.error('no socket path (${} is empty).'.format(SOCKET_ENV))
+
+    if args.stop:
+        try:
+            with SnapshotClient(path) as client:
+                client.request('shutdown')
+        except OSError:
+            print('Error: no snapshot daemon running on {}.'.format(path),
+                  file=sys.stderr)
+            exit(1)
+
+        exit(0)
+
+    exit(serve(path, args.SNAPSHOT))
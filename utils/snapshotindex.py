@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Compiled Wikipedia snapshot index.
+#
+# A snapshot is a TSV file with one page per line: page id and page title.
+# Reading it into dicts takes seconds and GBs of memory for every process,
+# so it can be compiled once into a binary index that is memory-mapped by
+# the tools, with no parsing, and shared by concurrent jobs through the
+# page cache:
+#
+#   header         <8s I I Q Q Q Q>: magic, version, reserved, number of
+#                                    pages, number of titles, number of
+#                                    hash buckets, size of the titles (bytes)
+#   ids            uint32[pages], sorted page ids
+#   offsets        uint64[pages + 1], the title of ids[i] is
+#                                     titles[offsets[i]:offsets[i+1]]
+#   bucket starts  uint32[buckets + 1], title -> id hash table (separate
+#   entry offsets  uint64[titles],      chaining): the entries of bucket b
+#   entry lengths  uint32[titles],      are starts[b] to starts[b+1], entry
+#   entry ids      uint32[titles],      j is the title at titles[offset[j]:
+#                                       offset[j]+length[j]] and its page id
+#   titles         UTF-8 titles in page id order, followed by the titles
+#                  whose page id has another title later in the snapshot
+#
+# every section starts at a multiple of 8 bytes, all values are
+# little-endian. Titles are hashed with CRC-32. As with the dicts built
+# from the TSV file, if a page id (title) appears more than once, its last
+# occurrence wins.
+#
+# Usage (compile a snapshot):
+#   snapshotindex.py SNAPSHOT.tsv -o SNAPSHOT.idx
+
+import os
+import sys
+import csv
+import zlib
+import struct
+import argparse
+import pathlib
+
+import numpy as np
+
+MAGIC = b'PLSNAPIX'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQ')
+HEADER_SIZE = HEADER.size
+
+ID_DTYPE = np.dtype('<u4')
+OFFSET_DTYPE = np.dtype('<u8')
+ROW_DTYPE = np.dtype('<u4')
+LENGTH_DTYPE = np.dtype('<u4')
+
+ALIGNMENT = 8
+
+
+# Processing non-UTF-8 Posix filenames using Python pathlib?
+# https://stackoverflow.com/a/45724695/2377454
+def safe_path(path: pathlib.Path) -> pathlib.Path:
+    encoded_path = path.as_posix().encode('utf-8')
+    return pathlib.Path(os.fsdecode(encoded_path))
+
+
+def is_index(path):
+    """
+    Tell if path is a compiled snapshot index.
+    """
+    with safe_path(pathlib.Path(path)).open('rb') as infp:
+        return infp.read(len(MAGIC)) == MAGIC
+
+
+def title_hash(title_bytes):
+    return zlib.crc32(title_bytes)
+
+
+def _align(size):
+    return size + (-size % ALIGNMENT)
+
+
+def _layout(npages, ntitles, nbuckets, titles_size):
+    """
+    Return the (start, end) byte range of each section of the index.
+    """
+    sections = {}
+    start = _align(HEADER_SIZE)
+    for name, size in (('ids', npages*ID_DTYPE.itemsize),
+                       ('offsets', (npages + 1)*OFFSET_DTYPE.itemsize),
+                       ('starts', (nbuckets + 1)*ROW_DTYPE.itemsize),
+                       ('entry_offsets', ntitles*OFFSET_DTYPE.itemsize),
+                       ('entry_lengths', ntitles*LENGTH_DTYPE.itemsize),
+                       ('entry_ids', ntitles*ID_DTYPE.itemsize),
+                       ('titles', titles_size)):
+        sections[name] = (start, start + size)
+        start = _align(start + size)
+
+    return sections
+
+
+def read_snapshot(snapshot_file, delimiter='\t'):
+    """
+    Read a snapshot TSV file into the id -> title and title -> id dicts.
+    """
+    id2title = {}
+    title2id = {}
+    with safe_path(pathlib.Path(snapshot_file)).open('r', encoding='utf-8') \
+            as snapfp:
+        reader = csv.reader(snapfp, delimiter=delimiter)
+        for line in reader:
+            pageid = int(line[0])
+            title = line[1]
+            id2title[pageid] = title
+            title2id[title] = pageid
+
+    return id2title, title2id
+
+
+def compile_snapshot(snapshot_file, outpath, delimiter='\t'):
+    """
+    Compile the snapshot TSV file to the index outpath, return the number of
+    pages.
+    """
+    id2title, title2id = read_snapshot(snapshot_file, delimiter)
+
+    ids = np.array(sorted(id2title), dtype=np.int64)
+    if ids.size and (ids[0] < 0 or ids[-1] > np.iinfo(ID_DTYPE).max):
+        raise ValueError('Page ids do not fit in {}.'.format(ID_DTYPE))
+
+    encoded = [id2title[pageid].encode('utf-8') for pageid in ids.tolist()]
+    lengths = np.array([len(title) for title in encoded], dtype=np.int64)
+    offsets = np.zeros(ids.size + 1, dtype=OFFSET_DTYPE)
+    np.cumsum(lengths, out=offsets[1:])
+    titles_size = int(offsets[-1])
+
+    # the title of each entry is shared with the id table when it is still
+    # the title of its page, it is appended to the titles otherwise
+    entry_offsets = []
+    entry_lengths = []
+    entry_ids = []
+    entry_hashes = []
+    orphans = []
+    for title, pageid in title2id.items():
+        title_bytes = title.encode('utf-8')
+        if id2title[pageid] == title:
+            row = int(np.searchsorted(ids, pageid))
+            entry_offsets.append(int(offsets[row]))
+        else:
+            entry_offsets.append(titles_size)
+            titles_size += len(title_bytes)
+            orphans.append(title_bytes)
+
+        entry_lengths.append(len(title_bytes))
+        entry_ids.append(pageid)
+        entry_hashes.append(title_hash(title_bytes))
+
+    nbuckets = 1
+    while nbuckets < len(entry_ids):
+        nbuckets *= 2
+
+    buckets = np.array(entry_hashes, dtype=np.int64) & (nbuckets - 1)
+    order = np.argsort(buckets, kind='stable')
+    starts = np.zeros(nbuckets + 1, dtype=np.int64)
+    np.cumsum(np.bincount(buckets, minlength=nbuckets), out=starts[1:])
+
+    sections = _layout(ids.size, len(entry_ids), nbuckets, titles_size)
+    data = {'ids': ids.astype(ID_DTYPE),
+            'offsets': offsets,
+            'starts': starts.astype(ROW_DTYPE),
+            'entry_offsets':
+                np.array(entry_offsets, dtype=OFFSET_DTYPE)[order],
+            'entry_lengths':
+                np.array(entry_lengths, dtype=LENGTH_DTYPE)[order],
+            'entry_ids': np.array(entry_ids, dtype=ID_DTYPE)[order],
+            }
+
+    with safe_path(pathlib.Path(outpath)).open('wb') as outfp:
+        outfp.write(HEADER.pack(MAGIC, VERSION, 0, ids.size, len(entry_ids),
+                                nbuckets, titles_size))
+        for name, array in data.items():
+            outfp.seek(sections[name][0])
+            outfp.write(array.tobytes())
+
+        outfp.seek(sections['titles'][0])
+        for title in encoded:
+            outfp.write(title)
+        for title in orphans:
+            outfp.write(title)
+
+    return ids.size
+
+
+class SnapshotIndex:
+    """
+    Memory-mapped compiled snapshot index.
+
+    id2title and title2id are read-only mappings with the same interface as
+    the dicts built from the TSV file ([], get and in, and items() for
+    title2id).
+    """
+
+    def __init__(self, path):
+        path = pathlib.Path(path)
+        data = np.memmap(safe_path(path).as_posix(), dtype=np.uint8,
+                         mode='r')
+
+        header = data[:HEADER_SIZE].tobytes()
+        if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a snapshot index.'.format(path))
+
+        (_, version, _, npages, ntitles, nbuckets, titles_size) = \
+            HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('Unsupported snapshot index version {} in {}.'
+                             .format(version, path))
+
+        sections = _layout(npages, ntitles, nbuckets, titles_size)
+        if data.size != sections['titles'][1]:
+            raise ValueError('Truncated or corrupted snapshot index {}.'
+                             .format(path))
+
+        def view(name, dtype):
+            start, end = sections[name]
+            return data[start:end].view(dtype)
+
+        self.ids = view('ids', ID_DTYPE)
+        self.offsets = view('offsets', OFFSET_DTYPE)
+        self.starts = view('starts', ROW_DTYPE)
+        self.entry_offsets = view('entry_offsets', OFFSET_DTYPE)
+        self.entry_lengths = view('entry_lengths', LENGTH_DTYPE)
+        self.entry_ids = view('entry_ids', ID_DTYPE)
+        self.titles = view('titles', np.uint8)
+
+        self.path = path
+        self.npages = npages
+        self.ntitles = ntitles
+        self.nbuckets = nbuckets
+
+        self.id2title = _Id2Title(self)
+        self.title2id = _Title2Id(self)
+
+    def __len__(self):
+        return self.npages
+
+    def _title_bytes(self, start, end):
+        return self.titles[start:end].tobytes()
+
+    def find_id(self, pageid):
+        """
+        Return the row of pageid, -1 if it is not in the snapshot.
+        """
+        if not 0 <= pageid <= np.iinfo(ID_DTYPE).max:
+            return -1
+
+        row = int(np.searchsorted(self.ids, pageid))
+        if row < self.npages and self.ids[row] == pageid:
+            return row
+
+        return -1
+
+    def find_title(self, title):
+        """
+        Return the hash table entry of title, -1 if it is not in the
+        snapshot.
+        """
+        if not self.ntitles:
+            return -1
+
+        title_bytes = title.encode('utf-8')
+        bucket = title_hash(title_bytes) & (self.nbuckets - 1)
+        for entry in range(self.starts[bucket], self.starts[bucket+1]):
+            if self.entry_lengths[entry] != len(title_bytes):
+                continue
+
+            start = int(self.entry_offsets[entry])
+            if self._title_bytes(start, start + len(title_bytes)) == \
+                    title_bytes:
+                return entry
+
+        return -1
+
+    def title(self, row):
+        """
+        Return the title of the page at row of the id table.
+        """
+        start, end = int(self.offsets[row]), int(self.offsets[row+1])
+        return self._title_bytes(start, end).decode('utf-8')
+
+    def titles_of(self, pageids, default=None):
+        """
+        Return the list of the titles of pageids (default for the ids not
+        in the snapshot).
+        """
+        rows, found = self.find_ids(pageids)
+        return [self.title(row) if ok else default
+                for row, ok in zip(rows.tolist(), found.tolist())]
+
+    def ids_of(self, titles, default=None):
+        """
+        Return the list of the page ids of titles (default for the titles
+        not in the snapshot).
+        """
+        entries = [self.find_title(title) for title in titles]
+        return [int(self.entry_ids[entry]) if entry >= 0 else default
+                for entry in entries]
+
+    def find_ids(self, pageids):
+        """
+        Vectorized find_id, return the rows of pageids and the mask of the
+        ids found.
+        """
+        pageids = np.asarray(pageids, dtype=np.int64)
+        if not self.npages:
+            return (np.zeros(pageids.size, dtype=np.int64),
+                    np.zeros(pageids.size, dtype=bool))
+
+        rows = np.searchsorted(self.ids, pageids)
+        rows = np.minimum(rows, self.npages - 1)
+
+        return rows, self.ids[rows] == pageids
+
+
+class _Id2Title:
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, pageid):
+        row = self.index.find_id(pageid)
+        if row < 0:
+            raise KeyError(pageid)
+
+        return self.index.title(row)
+
+    def __contains__(self, pageid):
+        return self.index.find_id(pageid) >= 0
+
+    def get(self, pageid, default=None):
+        row = self.index.find_id(pageid)
+        return self.index.title(row) if row >= 0 else default
+
+    def __len__(self):
+        return len(self.index)
+
+
+class _Title2Id:
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, title):
+        entry = self.index.find_title(title)
+        if entry < 0:
+            raise KeyError(title)
+
+        return int(self.index.entry_ids[entry])
+
+    def __contains__(self, title):
+        return self.index.find_title(title) >= 0
+
+    def get(self, title, default=None):
+        entry = self.index.find_title(title)
+        return int(self.index.entry_ids[entry]) if entry >= 0 else default
+
+    def __len__(self):
+        return self.index.ntitles
+
+
+def load_snapshot(snapshot_file, delimiter='\t'):
+    """
+    Return the id -> title and title -> id mappings of a snapshot, from a
+    compiled index (memory-mapped) or from the TSV file.
+    """
+    if is_index(snapshot_file):
+        index = SnapshotIndex(snapshot_file)
+        return index.id2title, index.title2id
+
+    return read_snapshot(snapshot_file, delimiter)
+
+
+if __name__ == '__main__':
+    desc = 'Compile a Wikipedia snapshot (page id, page title) to an index.'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('SNAPSHOT',
+                        type=pathlib.Path,
+                        help='Snapshot file, one page per line: page id and '
+                             'page title.')
+    parser.add_argument('-d', '--delimiter',
+                        type=str,
+                        default='\t',
+                        help="Snapshot file delimiter [default: '\t'].")
+    parser.add_argument('-o', '--output',
+                        type=pathlib.Path,
+                        required=True,
+                        help='Output index file.')
+
+    args = parser.parse_args()
+
+    if is_index(args.SNAPSHOT):
+        print('Error: {} is already a snapshot index.'.format(args.SNAPSHOT),
+              file=sys.stderr)
+        exit(1)
+
+    npages = compile_snapshot(args.SNAPSHOT, args.output,
+                              delimiter=args.delimiter)
+
+    print('Written {} pages to {}.'.format(npages, args.output),
+          file=sys.stderr)
+
+    exit(0)
@@ -0,0 +1,6 @@
+import sys
+import pathlib
+
+# the utils are standalone scripts, make them importable
+UTILS_DIR = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, UTILS_DIR.as_posix())
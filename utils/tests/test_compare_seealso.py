@@ -0,0 +1,15 @@
+from compare_seealso import read_links
+
+
+def test_read_links(tmp_path):
+    links = tmp_path/'links.txt'
+    links.write_text('link_title\tlink_id\nA\t2\nB\t1\n')
+
+    assert read_links(links) == {1, 2}
+
+
+def test_read_links_empty_file(tmp_path):
+    links = tmp_path/'links.txt'
+    links.write_text('')
+
+    assert read_links(links) == set()
@@ -0,0 +1,59 @@
+import sys
+import subprocess
+
+import numpy as np
+
+from conftest import UTILS_DIR
+from compute_scores import CycleProfile, linear_score, rank_scores
+
+SCORES = [(1, 0.5), (2, 0.25), (3, 0.75), (4, 0.25)]
+
+
+def test_rank_scores_top():
+    assert list(rank_scores(SCORES, order='score', top=2)) == \
+        [(3, 0.75), (1, 0.5)]
+
+
+def test_rank_scores_top_zero():
+    assert list(rank_scores(SCORES, top=0)) == []
+
+
+def test_top_zero_rejected(tmp_path):
+    cycles = tmp_path/'cycles.txt'
+    cycles.write_text('1 2\n')
+
+    result = subprocess.run([sys.executable,
+                             (UTILS_DIR/'compute_scores.py').as_posix(),
+                             cycles.as_posix(), '--top', '0'],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 2
+    assert '--top must be positive' in result.stderr
+
+
+def test_profile_blocks():
+    profile = CycleProfile()
+    profile.add(np.array([1, 2, 2, 3, 4]), np.array([2, 3]))
+    profile.add(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    profile.add(np.array([4, 1, 5, 6, 7, 8]), np.array([2, 4]))
+
+    assert profile.nodes.tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert profile.counts[:, 2].tolist() == [2, 1, 0, 1, 0, 0, 0, 0]
+    assert profile.counts[:, 3].tolist() == [0, 1, 1, 1, 0, 0, 0, 0]
+    assert profile.counts[:, 4].tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert dict(profile.scores(linear_score, K=2)) == \
+        {1: 1.0, 2: 0.5, 4: 0.5}
+
+
+def test_profile_python_backend_rejected(tmp_path):
+    cycles = tmp_path/'cycles.txt'
+    cycles.write_text('1 2\n')
+
+    result = subprocess.run([sys.executable,
+                             (UTILS_DIR/'compute_scores.py').as_posix(),
+                             cycles.as_posix(), '-b', 'python',
+                             '-p', (tmp_path/'profile.npz').as_posix()],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 2
+    assert 'supported only by the numpy backend' in result.stderr
@@ -0,0 +1,24 @@
+import numpy as np
+
+from count_loops import merge_node_counts
+
+
+def test_merge_node_counts():
+    nodes = np.array([2, 5], dtype=np.int64)
+    counts = np.array([1, 3], dtype=np.int64)
+    blocks = [np.array([5, 1, 5], dtype=np.int64),
+              np.array([7, 2], dtype=np.int64)]
+
+    nodes, counts = merge_node_counts(nodes, counts, blocks)
+
+    assert nodes.tolist() == [1, 2, 5, 7]
+    assert counts.tolist() == [1, 2, 5, 1]
+
+
+def test_merge_node_counts_empty():
+    nodes = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+
+    nodes, counts = merge_node_counts(nodes, counts, [])
+
+    assert nodes.size == 0 and counts.size == 0
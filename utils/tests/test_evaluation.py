@@ -0,0 +1,14 @@
+from evaluation import format_filename
+
+TEMPLATES = {'looprank': 'enwiki.{algo}.f{scoring_function}.{title}.{maxloop}.txt',
+             'ssppr': 'enwiki.{algo}.a{alpha:.2f}.{title}.{maxloop}.txt',
+             }
+
+
+def test_format_filename():
+    assert (format_filename(TEMPLATES, ('looprank', 'linear', None, 4),
+                            'Foo bar') ==
+            'enwiki.looprank.flinear.Foo_bar.4.txt')
+    assert (format_filename(TEMPLATES, ('ssppr', None, 0.85, 'wholenetwork'),
+                            'AC/DC: "live"?') ==
+            'enwiki.ssppr.a0.85.ACDC_live.wholenetwork.txt')
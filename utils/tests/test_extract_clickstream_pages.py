@@ -0,0 +1,32 @@
+import collections
+
+from extract_clickstream_pages import OUTPUT_HEADER, spill_rows, \
+    write_outputs
+
+
+def test_spill_and_merge(tmp_path):
+    out_a = (tmp_path/'a.txt').as_posix()
+    out_b = (tmp_path/'b.txt').as_posix()
+    spill_dir = tmp_path/'spill'
+    spill_dir.mkdir()
+
+    rows = collections.defaultdict(list)
+    runfiles = []
+
+    rows[out_b].append(('B 1', 1, 10))
+    rows[out_a].append(('A 1', 2, 20))
+    runfiles.append(spill_rows(rows, spill_dir))
+    assert not rows
+
+    rows[out_a].append(('A 2', 3, 30))
+    runfiles.append(spill_rows(rows, spill_dir))
+
+    rows[out_b].append(('B 2', 4, 40))
+    rows[out_a].append(('A 3', 5, 50))
+    write_outputs(rows, runfiles)
+
+    header = '\t'.join(OUTPUT_HEADER) + '\n'
+    assert (tmp_path/'a.txt').read_text() == \
+        header + 'A 1\t2\t20\nA 2\t3\t30\nA 3\t5\t50\n'
+    assert (tmp_path/'b.txt').read_text() == \
+        header + 'B 1\t1\t10\nB 2\t4\t40\n'
@@ -0,0 +1,35 @@
+import warnings
+
+import numpy as np
+
+from scorefile import parse_scores
+
+
+def test_parse_scores():
+    ids, scores = parse_scores(b'score(3):\t0.5\nscore(1): 1.5e-05\n')
+
+    assert ids.tolist() == [3, 1]
+    assert scores.tolist() == [0.5, 1.5e-05]
+
+
+def test_parse_scores_ids():
+    ids, scores = parse_scores(b'3\n1', allow_ids=True)
+
+    assert ids.tolist() == [3, 1]
+    assert np.all(np.isnan(scores))
+
+
+def test_parse_scores_malformed_lines(capsys):
+    # no space after the colon, negative score
+    ids, scores = parse_scores(b'score(3):0.5\nscore(1): -1\nscore(2): 2\n')
+
+    assert ids.tolist() == [2]
+    assert scores.tolist() == [2.0]
+    assert capsys.readouterr().err.count('could not process line') == 2
+
+
+def test_parse_scores_no_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        parse_scores(b'score(3): 0.5\nscore(1): 1.2.3\n')
+        parse_scores(b'score(3): 0.5\nscore(1): 2\n')
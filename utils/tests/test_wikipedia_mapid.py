@@ -0,0 +1,23 @@
+import sys
+import subprocess
+
+from conftest import UTILS_DIR
+
+
+def test_id_only_lines_are_not_mapped(tmp_path, monkeypatch):
+    # no snapshot daemon
+    monkeypatch.setenv('SNAPSHOTD_SOCKET', '')
+
+    snapshot = tmp_path/'snapshot.tsv'
+    snapshot.write_text('1\tPage_1\n2\tPage_2\n3\tPage_3\n')
+    scores = tmp_path/'scores.txt'
+    scores.write_text('score(1): 0.5\n2\nscore(3): 0.1\n')
+
+    result = subprocess.run([sys.executable,
+                             (UTILS_DIR/'wikipedia_mapid.py').as_posix(),
+                             '-i', scores.as_posix(),
+                             '-s', snapshot.as_posix()],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 0
+    assert result.stdout == 'Page_1\t1\nPage_3\t3\n'
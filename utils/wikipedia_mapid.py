@@ -2,49 +2,26 @@
 
 import re
 import sys
-import csv
+import math
 import errno
 import argparse
 import pathlib
 import itertools
 
-# Regex:
-#  score(<pageid>):<spaces><score>
-#
-# where:
-#   - <pageid> is an integer number
-#   - <score> is a real number that can be written using the scientific
-#     notation
-REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
-regex_score = re.compile(REGEX_SCORE)
-
-REGEX_ID = r'([0-9]+)'
-regex_id = re.compile(REGEX_ID)
-
+from scorefile import STDIN, read_scores
+from snapshotd import lookup_snapshot
 
 # output templates
 OUTLINE = '{title}\t{id_}\n'
 
 
-def process_line(line):
-    match_score = regex_score.match(line)
-    match_id = regex_id.match(line)
-
-    title = None
-    score = None
-    if match_score:
-        pageid = int(match_score.group(1))
-        score = float(match_score.group(2))
-        title = id2title.get(pageid, None)
-    elif match_id:
-        pageid = int(match_id.group(1))
-        title = title2id.get(pageid, None)
-    else:
-        print('Error: could not process line: {}'.format(line),
-              file=sys.stderr)
+def lookup(pageid, score):
+    # lines with only the page id have a NaN score, they are accepted but
+    # not mapped (their id was looked up among the titles)
+    if math.isnan(score):
+        return None, None
 
-    # if match fails this is (None, None)
-    return title, score
+    return id2title.get(pageid, None), score
 
 
 if __name__ == '__main__':
@@ -58,7 +35,9 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
     parser.add_argument('--sort',
                         choices=['score','title'],
@@ -75,27 +54,20 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    snapshotname = args.snapshot
-    id2title = {}
-    title2id = {}
-    with snapshotname.open('r') as snapshotfile:
-        reader = csv.reader(snapshotfile, delimiter='\t')
-        for l in reader:
-            id_ = int(l[0])
-            title = l[1]
-            id2title[id_] = title
-            title2id[title] = id_
-
     all_outlines = []
-    infile = None
+    infile = STDIN
     if args.input:
-        infile = args.input.open('r')
-    else:
-        infile = sys.stdin
+        infile = args.input
+
+    pageids, scores = read_scores(infile, allow_ids=True)
+
+    # served by snapshotd.py if it is running
+    id2title, title2id = lookup_snapshot(args.snapshot, pageids.tolist(),
+                                         reverse=True)
 
     try:
-        for line in infile:
-            title, score = process_line(line)
+        for pageid, score in zip(pageids.tolist(), scores.tolist()):
+            title, score = lookup(pageid, score)
 
             if title is not None:
                 if score is not None and args.sort:
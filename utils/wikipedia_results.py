@@ -2,49 +2,26 @@
 
 import re
 import sys
-import csv
+import math
 import errno
 import argparse
 import pathlib
 import itertools
 
-# Regex:
-#  score(<pageid>):<spaces><score>
-#
-# where:
-#   - <pageid> is an integer number
-#   - <score> is a real number that can be written using the scientific
-#     notation
-REGEX_SCORE = r'score\(([0-9]+)\):\s+([0-9]+\.?[0-9]*e?-?[0-9]*)'
-regex_score = re.compile(REGEX_SCORE)
-
-REGEX_ID = r'([0-9]+)'
-regex_id = re.compile(REGEX_ID)
-
+from scorefile import STDIN, read_scores
+from snapshotd import lookup_snapshot
 
 # output templates
 OUTLINE_SCORE = 'score({title}):\t{score}\n'
 OUTLINE_NOSCORE = '{title}\n'
 
 
-def process_line(line):
-    match_score = regex_score.match(line)
-    match_id = regex_id.match(line)
-
-    title = None
-    score = None
-    if match_score:
-        pageid = int(match_score.group(1))
-        score = float(match_score.group(2))
-        title = snapshot[pageid]
-    elif match_id:
-        pageid = int(match_id.group(1))
-        title = snapshot[pageid]
-    else:
-        print('Error: could not process line: {}'.format(line),
-              file=sys.stderr)
-
-    # if match fails this is (None, None)
+def lookup(pageid, score):
+    # lines with only the page id have a NaN score
+    title = snapshot[pageid]
+    if math.isnan(score):
+        score = None
+
     return title, score
 
 
@@ -59,7 +36,9 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--snapshot',
                         type=pathlib.Path,
                         required=True,
-                        help='Wikipedia snapshot with the id-title mapping.'
+                        help='Wikipedia snapshot with the id-title mapping '
+                             '(TSV file or index compiled with '
+                             'snapshotindex.py).'
                         )
     parser.add_argument('--sort',
                         choices=['score','title'],
@@ -76,21 +55,19 @@ if __name__ == '__main__':
 
     args = parser.parse_args()
 
-    snapshotname = args.snapshot
-    with snapshotname.open('r') as snapshotfile:
-        reader = csv.reader(snapshotfile, delimiter='\t')
-        snapshot = dict((int(l[0]), l[1]) for l in reader)
-
     all_outlines = []
-    infile = None
+    infile = STDIN
     if args.input:
-        infile = args.input.open('r')
-    else:
-        infile = sys.stdin
+        infile = args.input
+
+    pageids, scores = read_scores(infile, allow_ids=True)
+
+    # served by snapshotd.py if it is running
+    snapshot, _ = lookup_snapshot(args.snapshot, pageids.tolist())
 
     try:
-        for line in infile:
-            title, score = process_line(line)
+        for pageid, score in zip(pageids.tolist(), scores.tolist()):
+            title, score = lookup(pageid, score)
 
             if title is not None:
                 if score is not None and args.sort: